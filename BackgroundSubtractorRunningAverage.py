@@ -0,0 +1,26 @@
+import cv2
+import numpy as np
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class BackgroundSubtractorRunningAverage:
+
+    # frame differencing against a running average of the gray frames, same apply interface as the OpenCV
+    # background subtractors: pixels differing by more than threshold from the background are 255 in the mask
+    def __init__(self, alpha=.05, threshold=25):
+        self.__alpha = alpha
+        self.__threshold = threshold
+        self.__background = None
+
+    def apply(self, frame):
+        gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        if self.__background is None:
+            self.__background = gray.astype(np.float32)
+            return np.zeros(gray.shape, dtype=np.uint8)
+        difference = cv2.absdiff(gray.astype(np.float32), self.__background)
+        cv2.accumulateWeighted(gray, self.__background, self.__alpha)
+        return np.where(difference > self.__threshold, np.uint8(255), np.uint8(0))
@@ -19,3 +19,20 @@ class ENFAnalysisConfig:
         self.ground_truth = None
         self.disable_plots = None
         self.skip_seconds = None
+        self.top_k = None
+        self.exact_search = None
+        self.workers = None
+        self.narrow_band = None
+        self.processes = None
+        self.video_index = None
+        self.pipeline = None
+        self.roi = None
+        self.scale = None
+        self.motion_scale = None
+        self.motion_stride = None
+        self.motion_method = None
+        self.segmentation_cache = None
+        self.segmentation_scale = None
+        self.luma_cache = None
+        self.luma = None
+        self.chunked_storage = None
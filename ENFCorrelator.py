@@ -0,0 +1,120 @@
+from typing import List
+
+import numpy as np
+from scipy.fft import rfft, irfft, next_fast_len
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class ENFCorrelator:
+
+    # rolling_sums: precomputed (cumsum_valid, cumsum_y, cumsum_y2) of reference - offset, each with a leading 0
+    def __init__(self, reference, offset=None, rolling_sums=None):
+        reference = np.asarray(reference, dtype=np.float64)
+        self.__size = reference.size
+        self.__valid = ~np.isnan(reference)
+        self.__complete = bool(np.all(self.__valid))
+        # center the reference, pearson is shift invariant and the cumulative sums stay numerically stable
+        if offset is None:
+            offset = np.mean(reference[self.__valid]) if np.any(self.__valid) else 0.
+        self.__y = np.where(self.__valid, reference - offset, 0.)
+        if rolling_sums is None:
+            rolling_sums = ENFCorrelator.rolling_sums(self.__y, self.__valid)
+        self.__cumsum_valid, self.__cumsum_y, self.__cumsum_y2 = rolling_sums
+        # correlation lags never exceed the reference length, so no padding for the query is required
+        self.__fft_size = next_fast_len(self.__size, real=True)
+        self.__spectra = {}
+
+    def size(self):
+        return self.__size
+
+    def __spectrum(self, name):
+        if name not in self.__spectra:
+            if name == 'valid':
+                data = self.__valid.astype(np.float64)
+            elif name == 'y2':
+                data = self.__y ** 2
+            else:
+                data = self.__y
+            self.__spectra[name] = rfft(data, self.__fft_size)
+        return self.__spectra[name]
+
+    def __xcorr(self, query, name, positions):
+        return self.__xcorr_many([query], name)[0][:positions]
+
+    def __xcorr_many(self, queries, name, block_size=16):
+        # c[i] = sum_j query[j] * reference[i + j], queries of a block share one batched fft
+        result = []
+        for block_start in range(0, len(queries), block_size):
+            block = queries[block_start:block_start + block_size]
+            padded = np.zeros((len(block), self.__fft_size))
+            for row, query in enumerate(block):
+                padded[row, :query.size] = query
+            query_spectra = np.conj(rfft(padded, axis=1, workers=-1))
+            correlated = irfft(self.__spectrum(name)[None, :] * query_spectra, self.__fft_size, axis=1, workers=-1)
+            result.extend(correlated[row, :self.__size - query.size + 1] for row, query in enumerate(block))
+        return result
+
+    @staticmethod
+    def rolling_sums(y, valid):
+        return (np.concatenate(([0], np.cumsum(valid, dtype=np.int64))),
+                np.concatenate(([0.], np.cumsum(y))),
+                np.concatenate(([0.], np.cumsum(y ** 2))))
+
+    @staticmethod
+    def __rolling(cumsum, window, positions):
+        return (cumsum[window:window + positions] - cumsum[:positions]).astype(np.float64)
+
+    def sliding_pearson(self, extracted_enf) -> np.ndarray:
+        return self.sliding_pearson_many([extracted_enf])[0]
+
+    def sliding_pearson_many(self, extracted_enfs) -> List[np.ndarray]:
+        # all queries share the spectra and rolling sums of the reference
+        queries = [self.__prepare_query(extracted_enf) for extracted_enf in extracted_enfs]
+        sums_xy = self.__xcorr_many([x for x, _ in queries], 'y')
+        return [self.__pearson(x, valid_x, sum_xy) for (x, valid_x), sum_xy in zip(queries, sums_xy)]
+
+    def __prepare_query(self, extracted_enf):
+        x = np.asarray(extracted_enf, dtype=np.float64)
+        if x.size == 0 or x.size > self.__size:
+            raise ValueError(f"extracted enf ({x.size}) must not be longer than the reference ({self.__size})")
+        valid_x = ~np.isnan(x)
+        offset = np.mean(x[valid_x]) if np.any(valid_x) else 0.
+        return np.where(valid_x, x - offset, 0.), valid_x
+
+    def __pearson(self, x, valid_x, sum_xy):
+        window = x.size
+        positions = self.__size - window + 1
+        # pairwise complete observations like pandas.Series.corr: n, sum(y), sum(y^2) within the valid pairs
+        if np.all(valid_x):
+            n = self.__rolling(self.__cumsum_valid, window, positions)
+            sum_y = self.__rolling(self.__cumsum_y, window, positions)
+            sum_y2 = self.__rolling(self.__cumsum_y2, window, positions)
+        else:
+            valid_x_float = valid_x.astype(np.float64)
+            n = np.rint(self.__xcorr(valid_x_float, 'valid', positions))
+            sum_y = self.__xcorr(valid_x_float, 'y', positions)
+            sum_y2 = self.__xcorr(valid_x_float, 'y2', positions)
+        if self.__complete:
+            sum_x = np.full(positions, np.sum(x))
+            sum_x2 = np.full(positions, np.sum(x ** 2))
+        else:
+            sum_x = self.__xcorr(x, 'valid', positions)
+            sum_x2 = self.__xcorr(x ** 2, 'valid', positions)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cov = sum_xy - sum_x * sum_y / n
+            var_x = sum_x2 - sum_x ** 2 / n
+            var_y = sum_y2 - sum_y ** 2 / n
+            correlated = cov / np.sqrt(var_x * var_y)
+        # constant sections have no defined correlation, rounding noise must not turn them into matches
+        undefined = (n < 2) | (var_x <= 1e-10 * sum_x2) | (var_y <= 1e-10 * sum_y2)
+        correlated[undefined] = np.nan
+        return np.clip(correlated, -1., 1.)
+
+    @staticmethod
+    def correlate(extracted_enf, reference) -> np.ndarray:
+        return ENFCorrelator(reference).sliding_pearson(extracted_enf)
@@ -14,6 +14,9 @@ class ENFExtractionResult:
         self.data_frame: Optional[pd.DataFrame] = None
 
     def get_timestamp(self):
+        # None without correlation (all nan)
+        if self.max_correlation_index is None:
+            return None
         return self.data_frame.index[self.max_correlation_index]
 
     def show_plot(self, margin_in_sec=10, title="", block=True):
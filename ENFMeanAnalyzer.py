@@ -1,9 +1,15 @@
+from typing import List
+
 from scipy.fft import rfft, rfftfreq
 from scipy.signal import stft, windows, butter, sosfilt
 import matplotlib.pyplot as plt
 import numpy as np
 from base_functions import *
+from ENFCorrelator import ENFCorrelator
 from ENFExtractionResult import ENFExtractionResult
+from ENFNarrowBandEstimator import ENFNarrowBandEstimator
+from ENFSubsequenceSearch import ENFSubsequenceSearch
+from ENFTimestampSearch import ENFTimestampMatch
 
 logger = logging.getLogger(__file__)
 logger.setLevel(LOGGER_LEVEL)
@@ -12,7 +18,8 @@ logger.setLevel(LOGGER_LEVEL)
 class ENFMeanAnalyzer:
 
     def __init__(self, destination, fps=30, expected_enf_frequency_in_hz=10., show_plots=True, filename_prefix=None,
-                 bandpass_order=6, bandpass_width=.3, fps_real=30., save_data=True, samples_stft=256, nfft=8192):
+                 bandpass_order=6, bandpass_width=.3, fps_real=30., save_data=True, samples_stft=256, nfft=8192,
+                 narrow_band=False):
         self.__save_data = save_data
         self.__fps_real = fps_real
         self.__filename_prefix = filename_prefix
@@ -25,6 +32,7 @@ class ENFMeanAnalyzer:
         self.__samples_stft = samples_stft
         self.__bandpass_order = bandpass_order
         self.__bandpass_width = bandpass_width
+        self.__narrow_band = narrow_band
 
     def __fft(self, data, title):
         if self.__show_plots or self.__save_data:
@@ -115,28 +123,18 @@ class ENFMeanAnalyzer:
             else:
                 plt.close()
 
-    def __qi(self, data):
-        overlap_stft = self.__samples_stft - self.__fps  # (samples / 2)
-        boxcar = windows.boxcar(self.__samples_stft)
-        f1, t1, Zxx = stft(data, fs=1, nperseg=self.__samples_stft, noverlap=overlap_stft, window=boxcar,
-                           nfft=self.__nfft)
-        f1_real = f1 * self.__fps_real
-        f_low = self.__expected_enf_frequency_in_hz - self.__bandpass_width
-        f_high = self.__expected_enf_frequency_in_hz + self.__bandpass_width
-        freq_idx = np.where((f1_real > f_low) & (f1_real < f_high))
-        freq = f1_real[freq_idx]
-        energy = np.abs(Zxx)[freq_idx]
-        energy_k = 20 * np.log10(np.abs(energy))
-        idx = np.argmax(energy_k, axis=0)
-        k_max = energy_k[idx][0]
-        k_m1 = energy_k[idx - 1][0]
-        k_p1 = energy_k[idx + 1][0]
-        p = .5 * ((k_m1 - k_p1) / (k_m1 - 2 * k_max + k_p1))
-        return freq[idx] + ((k_max + p) / self.__nfft)
+    def __narrow_band_estimator(self, stft_samples, overlap_stft, window) -> ENFNarrowBandEstimator:
+        return ENFNarrowBandEstimator(self.__fps_real, self.__expected_enf_frequency_in_hz - self.__bandpass_width,
+                                      self.__expected_enf_frequency_in_hz + self.__bandpass_width, stft_samples,
+                                      overlap_stft, nfft=self.__nfft, window=window)
 
     def __enf_with_stft(self, data, stft_samples=256):
         overlap_stft = stft_samples - self.__fps
         hann = windows.hann(stft_samples)
+        if self.__narrow_band:
+            estimator = self.__narrow_band_estimator(stft_samples, overlap_stft, hann)
+            magnitude = estimator.magnitude(data)
+            return estimator.peak_frequencies(magnitude=magnitude), estimator.weighted_frequencies(magnitude=magnitude)
         f1, t1, Zxx = stft(data, fs=1, nperseg=stft_samples, noverlap=overlap_stft, window=hann,
                            nfft=self.__nfft)
         f1_real = f1 * self.__fps_real
@@ -149,18 +147,51 @@ class ENFMeanAnalyzer:
         weighted_energy_freq = np.sum(energy * freq[:, None], axis=0) / np.sum(energy, axis=0)
         return max_freq_stft, weighted_energy_freq
 
-    def correlate(self, extracted_enf: np.ndarray, frequency_data: pd.Series, description="") -> ENFExtractionResult:
+    def correlate(self, extracted_enf: np.ndarray, frequency_data: pd.Series, description="",
+                  correlator: ENFCorrelator = None, correlated: np.ndarray = None) -> ENFExtractionResult:
+        # correlated: curve of correlation_curves, calculated if None
+        if correlated is None:
+            correlated = self.correlation_curves([extracted_enf], frequency_data, correlator)[0]
+        return self.__extraction_result(extracted_enf, correlated, frequency_data, description)
+
+    def correlation_curves(self, extracted_enfs: List[np.ndarray], frequency_data: pd.Series,
+                           correlator: ENFCorrelator = None) -> List[np.ndarray]:
+        # pearson correlation of every enf at every position of the frequency data, all enf in one pass
+        if correlator is None:
+            correlator = ENFCorrelator(frequency_data.to_numpy())
+        elif correlator.size() != frequency_data.size:
+            raise ValueError(f"correlator ({correlator.size()}) doesn't match frequency data ({frequency_data.size})")
+        logger.debug(f'correlate: {len(extracted_enfs)} enf against {frequency_data.size} samples')
+        return correlator.sliding_pearson_many(extracted_enfs)
+
+    def correlate_many(self, extracted_enfs: List[np.ndarray], frequency_data: pd.Series, descriptions: List[str],
+                       correlator: ENFCorrelator = None) -> List[ENFExtractionResult]:
+        return [self.correlate(extracted_enf, frequency_data, description, correlated=correlated)
+                for extracted_enf, description, correlated in
+                zip(extracted_enfs, descriptions, self.correlation_curves(extracted_enfs, frequency_data, correlator))]
+
+    def correlate_top_k(self, extracted_enf: np.ndarray, frequency_data, top_k=5) -> List[ENFTimestampMatch]:
+        # exact best matches without the whole correlation curve, frequency_data: pd.Series or GroundTruthStore
+        if isinstance(frequency_data, pd.Series):
+            matches = ENFSubsequenceSearch(frequency_data.to_numpy()).search(extracted_enf, top_k=top_k)
+            for match in matches:
+                match.timestamp = frequency_data.index[match.index]
+            return matches
+        return ENFSubsequenceSearch(frequency_data).search(extracted_enf, top_k=top_k)
+
+    def __extraction_result(self, extracted_enf: np.ndarray, correlated: np.ndarray, frequency_data: pd.Series,
+                            description) -> ENFExtractionResult:
         data_frame = pd.DataFrame(frequency_data)
         enf_series = pd.Series(extracted_enf, name=ENFExtractionResult.dataframe_name)
-        size = (data_frame.size - enf_series.size) + 1
-        correlated = np.zeros(size)
-        for i in range(0, size):
-            if i % 10000 == 0:
-                logger.debug(f'correlate: {i}/{size}')
-            section = frequency_data.iloc[i:i + enf_series.size].reset_index(drop=True)
-            correlated[i] = enf_series.corr(section)
         self.__correlation_plot(correlated, description)
-        index_max_correlation = np.argmax(correlated)
+        if np.all(np.isnan(correlated)):
+            # constant or all nan enf: no correlation and no timestamp
+            logger.warning(f'no correlation: {description}')
+            enf_result = ENFExtractionResult()
+            enf_result.max_correlation = np.nan
+            enf_result.data_frame = data_frame
+            return enf_result
+        index_max_correlation = np.nanargmax(correlated)
         time_aligned_enf_data = pd.DataFrame(
             {enf_series.name: np.add(enf_series.array, 50 - self.__expected_enf_frequency_in_hz)},
             index=data_frame.index[
@@ -168,7 +199,7 @@ class ENFMeanAnalyzer:
         data_frame[ENFExtractionResult.dataframe_name] = time_aligned_enf_data
 
         enf_result = ENFExtractionResult()
-        enf_result.max_correlation = round(np.max(correlated), 4)
+        enf_result.max_correlation = round(np.nanmax(correlated), 4)
         enf_result.max_correlation_index = index_max_correlation
         enf_result.data_frame = data_frame
         if self.__filename_prefix is not None and self.__save_data:
@@ -1,5 +1,6 @@
 from typing import Optional
 
+from LumaCache import LumaCache
 from MeanCalculator import MeanCalculator
 from VideoGrabber import VideoGrabber
 import numpy as np
@@ -19,7 +20,17 @@ logger.setLevel(LOGGER_LEVEL)#
 
 class ENFMeanVideoProcessor:
 
-    def __init__(self, video_filename: str, lightness_threshold=None, data_dir="data", save_images=True):
+    # luma: frames after the first one are decoded as Y plane only, faster but the means differ slightly from those
+    # of the BGR frames converted to gray
+    # roi (x, y, width, height) and scale (downscale factor) of the processed frames
+    # luma_cache: the frames are read from the LumaCache of the video if it exists, without roi and scale. the mean
+    # is that of the area averaged frames, with lightness_threshold the threshold is applied to the averaged pixels
+    def __init__(self, video_filename: str, lightness_threshold=None, data_dir="data", save_images=True, luma=False,
+                 roi=None, scale=1, luma_cache=False):
+        self.__luma = luma
+        self.__luma_cache = luma_cache
+        self.__roi = roi
+        self.__scale = scale
         self.__lightness_threshold = lightness_threshold
         self.__data_dir = data_dir
         self.__video_filename = video_filename
@@ -32,25 +43,48 @@ class ENFMeanVideoProcessor:
         return f"{self.__data_dir}/{self.__video_filename}_mean_per_frame.npy"
 
     def process_video(self, video_file, start_frame_nr=0, end_frame_nr=None):
+        luma_cache = LumaCache(video_file) if self.__luma_cache and self.__roi is None and self.__scale == 1 else None
+        if luma_cache is not None and not luma_cache.exists():
+            logger.warning(f"no luma cache of {video_file}, decoding the video")
+            luma_cache = None
+        vg = VideoGrabber(videofile=video_file, start_frame_nr=start_frame_nr, end_frame=end_frame_nr,
+                          luma=self.__luma, roi=self.__roi, scale=self.__scale, luma_cache=luma_cache)
+        self.start(video_file, vg)
+        vg.first_frame(callback=self.first_frame)
+        vg.grab(callback=self.next_frame)
+        self.finish()
+
+    # consumer of a VideoFanOutProcessor: frames of vg, gray: luminance of the frame if already converted
+    def needs_colour(self):
+        return False
+
+    def start(self, video_file, vg: VideoGrabber):
         create_directories(self.__data_dir)
-        self.__vg = VideoGrabber(videofile=video_file, start_frame_nr=start_frame_nr, end_frame=end_frame_nr)
-        self.__vg.first_frame(callback=self.__process_first_frame)
-        self.__vg.grab(callback=self.__process)
+        self.__vg = vg
+
+    def first_frame(self, frame_nr, frame, gray=None):
+        self.__process_first_frame(frame_nr, frame, gray)
+
+    def next_frame(self, frame_nr, frame, gray=None):
+        self.__process(frame_nr, frame if gray is None else gray)
+
+    def finish(self):
         np.save(self.get_mean_data_filename(), self.__mc.mean)
         logger.info(f"done: {self.__video_filename}")
+        return self.__mc.mean
 
-    def __process_first_frame(self, frame_nr, frame):
+    def __process_first_frame(self, frame_nr, frame, gray=None):
         img_name = f'{self.__data_dir}/{self.__video_filename}-first.jpg'
         if self.__save_images:
             cv2.imwrite(img_name, frame)
         img_name = f'{self.__data_dir}/{self.__video_filename}-threshold.jpg'
-        frame_threshold = cv2.cvtColor(np.copy(frame), cv2.COLOR_BGR2GRAY)
+        frame_threshold = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if gray is None else np.copy(gray)
         if self.__lightness_threshold is not None:
             indices = np.where(frame_threshold < self.__lightness_threshold)
             frame_threshold[indices] = 0
         if self.__save_images:
             cv2.imwrite(img_name, frame_threshold)
-        self.__mc.process_first_frame(frame)
+        self.__mc.process_first_frame(frame if gray is None else gray)
 
     def __process(self, frame_nr, frame):
         self.__mc.process(frame)
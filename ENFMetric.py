@@ -19,35 +19,59 @@ class ENFMetric:
 
     @staticmethod
     def calc_metric(mean_intensity_per_superpixel_and_frame) -> ENFMetricResult:
-        pearson_per_superpixel_result = ENFMetric.__calc_pearson_per_superpixel(mean_intensity_per_superpixel_and_frame)
-        ranked_pearson_per_superpixel = {key: val for key, val in
-                                         sorted(pearson_per_superpixel_result.items(), key=lambda ele: ele[0],
-                                                reverse=True)}
-        # TODO check if there are a reasonable number of superpixel to calc statistics!
-        top_two = list(ranked_pearson_per_superpixel)[0:2]
-
-        pearson_per_superpixel_result_list = list(pearson_per_superpixel_result.keys())
+        candidates = np.asarray(mean_intensity_per_superpixel_and_frame, dtype=np.float64)
+        normalized = ENFMetric.z_normalize(candidates)
+        pearson_per_superpixel = ENFMetric.pearson_to_representative(candidates, normalized)
+        valid = np.flatnonzero(~np.isnan(pearson_per_superpixel))
         metric = ENFMetricResult()
-        metric.mean = ENFMetric.round(np.nanmean(pearson_per_superpixel_result_list))
-        metric.median = ENFMetric.round(np.nanmedian(pearson_per_superpixel_result_list))
-        metric.max = ENFMetric.round(np.nanmax(pearson_per_superpixel_result_list))
-        metric.top_two = ENFMetric.round(ENFMetric.pearson(pearson_per_superpixel_result[top_two[0]],
-                                                           pearson_per_superpixel_result[top_two[1]]))
+        # TODO check if there are a reasonable number of superpixel to calc statistics!
+        if valid.size == 0:
+            return metric
+        metric.mean = ENFMetric.round(np.mean(pearson_per_superpixel[valid]))
+        metric.median = ENFMetric.round(np.median(pearson_per_superpixel[valid]))
+        metric.max = ENFMetric.round(np.max(pearson_per_superpixel[valid]))
+        if valid.size > 1:
+            # ranked by index, superpixel with the same correlation are kept
+            top_two = valid[np.argsort(pearson_per_superpixel[valid], kind='stable')[::-1][:2]]
+            metric.top_two = ENFMetric.round(np.dot(normalized[top_two[0]], normalized[top_two[1]]))
         return metric
 
     @staticmethod
     def round(value):
-        return round(value, 4)
+        return round(float(value), 4)
+
+    @staticmethod
+    def z_normalize(candidates, block_size=1024) -> np.ndarray:
+        # rows with zero mean and unit norm: the dot product of two rows is their pearson correlation.
+        # rows without variance are nan
+        candidates = np.asarray(candidates, dtype=np.float64)
+        normalized = np.empty(candidates.shape)
+        for start in range(0, candidates.shape[0], block_size):
+            block = candidates[start:start + block_size]
+            centered = block - np.mean(block, axis=1, keepdims=True)
+            norm = np.sqrt(np.sum(centered ** 2, axis=1, keepdims=True))
+            constant = np.std(block, axis=1, dtype='float32') == 0
+            with np.errstate(divide='ignore', invalid='ignore'):
+                normalized[start:start + block_size] = np.where(constant[:, None], np.nan, centered / norm)
+        return normalized
+
+    @staticmethod
+    def pearson_to_representative(candidates, normalized=None) -> np.ndarray:
+        representative = np.nanmean(candidates, axis=0)
+        normalized = ENFMetric.z_normalize(candidates) if normalized is None else normalized
+        return np.clip(normalized @ ENFMetric.z_normalize(representative[None, :])[0], -1., 1.)
 
     @staticmethod
-    def __calc_pearson_per_superpixel(mean_intensity_per_superpixel_and_frame):
-        representative = np.nanmean(mean_intensity_per_superpixel_and_frame, axis=0)
-        pearson_result = {}
-        for ek_n in mean_intensity_per_superpixel_and_frame:
-            if np.std(ek_n, dtype='float32') != 0:
-                pearson_result[np.corrcoef(ek_n, representative)[0][1]] = ek_n
-        return pearson_result
+    def correlation_matrix(candidates, normalized=None, block_size=1024, out=None) -> np.ndarray:
+        # superpixel x superpixel pearson correlation, evaluated in blocks of rows. out can be a memory-mapped
+        # array, then only one block of rows is held in memory at a time
+        normalized = ENFMetric.z_normalize(candidates) if normalized is None else normalized
+        size = normalized.shape[0]
+        out = np.empty((size, size)) if out is None else out
+        for start in range(0, size, block_size):
+            out[start:start + block_size] = np.clip(normalized[start:start + block_size] @ normalized.T, -1., 1.)
+        return out
 
     @staticmethod
     def pearson(i, j):
-        return np.corrcoef(i, j)[0][1]
\ No newline at end of file
+        return np.corrcoef(i, j)[0][1]
@@ -0,0 +1,77 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from scipy.signal import windows, zoom_fft
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def stft_frame_count(samples, nperseg, hop):
+    # time steps of scipy.signal.stft with zero boundary and padding
+    padded = samples + 2 * (nperseg // 2)
+    padded += (-(padded - nperseg) % hop) % nperseg
+    return (padded - nperseg) // hop + 1
+
+
+# Spectrogram restricted to the band f_low..f_high: the frames are evaluated with a zoom fft (chirp-z) on the bins
+# of the zero-padded nfft spectrum inside the band only. The peak is refined by parabolic interpolation of the
+# log magnitude, so the resolution is below the bin spacing fps_real / nfft. Frames are the same as those of
+# scipy.signal.stft (zero boundary, padded), the results have the same number of time steps.
+class ENFNarrowBandEstimator:
+
+    def __init__(self, fps_real, f_low, f_high, nperseg, noverlap, nfft=8192, window=None):
+        self.__fps_real = fps_real
+        self.__nperseg = nperseg
+        self.__hop = nperseg - noverlap
+        self.__window = windows.hann(nperseg) if window is None else np.asarray(window)
+        bins = np.arange(nfft // 2 + 1)
+        bins = bins[(bins * fps_real / nfft > f_low) & (bins * fps_real / nfft < f_high)]
+        if bins.size < 3:
+            raise ValueError(f"band {f_low} - {f_high} Hz contains less than 3 bins at nfft {nfft}")
+        self.__bins = bins
+        self.__nfft = nfft
+
+    def frequencies(self) -> np.ndarray:
+        return self.__bins * self.__fps_real / self.__nfft
+
+    def bytes_per_frame(self):
+        # windowed frame, chirp-z work buffer and band spectrum (complex)
+        return 8 * self.__nperseg + 16 * 2 * (self.__nperseg + self.__bins.size) + 16 * self.__bins.size
+
+    def frame_count(self, samples):
+        return stft_frame_count(samples, self.__nperseg, self.__hop)
+
+    def __frames(self, data):
+        data = np.asarray(data, dtype=np.float64)
+        pad = [(0, 0)] * (data.ndim - 1)
+        data = np.pad(data, pad + [(self.__nperseg // 2, self.__nperseg // 2)])
+        data = np.pad(data, pad + [(0, (-(data.shape[-1] - self.__nperseg) % self.__hop) % self.__nperseg)])
+        return sliding_window_view(data, self.__nperseg, axis=-1)[..., ::self.__hop, :]
+
+    def magnitude(self, data) -> np.ndarray:
+        # (..., frequency, time) like scipy.signal.stft
+        frames = self.__frames(data) * self.__window
+        spectrum = zoom_fft(frames, [self.__bins[0] / self.__nfft, self.__bins[-1] / self.__nfft], m=self.__bins.size,
+                            fs=1, endpoint=True, axis=-1)
+        return np.swapaxes(np.abs(spectrum), -1, -2)
+
+    def peak_frequencies(self, data=None, magnitude=None) -> np.ndarray:
+        magnitude = self.magnitude(data) if magnitude is None else magnitude
+        energy = np.log(magnitude + np.finfo(np.float64).tiny)
+        idx = np.argmax(energy, axis=-2)
+        # parabola through the maximum and its neighbours, the maximum at the band edges is not refined
+        inner = np.clip(idx, 1, self.__bins.size - 2)
+        k_m1 = np.take_along_axis(energy, (inner - 1)[..., None, :], axis=-2)[..., 0, :]
+        k_max = np.take_along_axis(energy, inner[..., None, :], axis=-2)[..., 0, :]
+        k_p1 = np.take_along_axis(energy, (inner + 1)[..., None, :], axis=-2)[..., 0, :]
+        denominator = k_m1 - 2 * k_max + k_p1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            p = np.where(denominator < 0, .5 * (k_m1 - k_p1) / denominator, 0.)
+        p = np.where(idx == inner, np.clip(p, -.5, .5), 0.)
+        return (self.__bins[idx] + p) * self.__fps_real / self.__nfft
+
+    def weighted_frequencies(self, data=None, magnitude=None) -> np.ndarray:
+        magnitude = self.magnitude(data) if magnitude is None else magnitude
+        return np.sum(magnitude * self.frequencies()[:, None], axis=-2) / np.sum(magnitude, axis=-2)
@@ -0,0 +1,220 @@
+from typing import List, Optional
+
+import numpy as np
+
+from ENFCorrelator import ENFCorrelator
+from ENFTimestampSearch import ENFTimestampMatch
+from GroundTruthStore import GroundTruthStore
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class ENFSubsequenceSearchStats:
+
+    def __init__(self):
+        self.offsets = 0
+        self.blocks = 0
+        self.pruned_per_stage: List[int] = []
+        self.fully_evaluated = 0
+
+    def pruning_rate(self):
+        return 1 - self.fully_evaluated / self.offsets if self.offsets > 0 else 0.
+
+    def __str__(self):
+        return f'offsets: {self.offsets}, blocks: {self.blocks}, pruned per stage: {self.pruned_per_stage}, ' \
+               f'fully evaluated: {self.fully_evaluated}, pruning rate: {self.pruning_rate():.4f}'
+
+
+# Exact top-k search in the style of the UCR suite: for z-normalized sequences the squared euclidean distance is
+# d^2 = 2 * m * (1 - pearson), so the best correlations are the smallest distances. Cascading lower bounds from
+# segment means (PAA) of increasing resolution reject most offsets before the full distance is calculated, which
+# itself is abandoned early in blocks, query samples with the largest magnitude first. Offsets are visited best
+# bound first, so the threshold (k-th best distance so far) is tight early. Reference windows containing nan are
+# skipped.
+# The reference is read in blocks of offsets, only block_size + query length samples are in memory at once. The
+# threshold carries over, so most offsets of later blocks are already rejected by the first bound.
+class ENFSubsequenceSearch:
+
+    # reference: frequencies (array or memory-mapped array) or a GroundTruthStore
+    def __init__(self, reference, stages=(8, 32, 128), block_size=1 << 20, chunk_size=1 << 14, max_elements=1 << 22,
+                 seeds=64):
+        if isinstance(reference, GroundTruthStore):
+            self.__size = reference.size()
+            self.__read = reference.frequencies
+            self.__timestamp_of = reference.timestamp_of
+        else:
+            self.__size = len(reference)
+            self.__read = lambda start, end: np.asarray(reference[start:end], dtype=np.float64)
+            self.__timestamp_of = None
+        self.__stages = stages
+        self.__block_size = block_size
+        self.__chunk_size = chunk_size
+        self.__max_elements = max_elements
+        self.__seeds = seeds
+        self.stats: Optional[ENFSubsequenceSearchStats] = None
+
+    def __read_block(self, start, end):
+        reference = self.__read(start, end)
+        valid = ~np.isnan(reference)
+        offset = np.mean(reference[valid]) if np.any(valid) else 0.
+        y = np.where(valid, reference - offset, 0.)
+        return (y,) + ENFCorrelator.rolling_sums(y, valid)
+
+    @staticmethod
+    def __window_statistics(cumsum_valid, cumsum_y, cumsum_y2, window, positions):
+        # mean and standard deviation of all windows of the block, contiguous slices of the cumulative sums
+        count = cumsum_valid[window:window + positions] - cumsum_valid[:positions]
+        mean = (cumsum_y[window:window + positions] - cumsum_y[:positions]) / window
+        mean_y2 = (cumsum_y2[window:window + positions] - cumsum_y2[:positions]) / window
+        variance = mean_y2 - mean ** 2
+        # constant windows have no defined correlation, rounding noise must not turn them into matches
+        usable = (count == window) & (variance > 1e-10 * mean_y2)
+        return usable, mean, np.sqrt(np.maximum(variance, 0.))
+
+    def __rows(self, columns):
+        return max(self.__max_elements // max(columns, 1), 1)
+
+    @staticmethod
+    def __paa_bound_all(query, segments, cumsum_y, mean, std):
+        # bound of the first stage for every offset of the block: the segment means of the windows are
+        # shifted slices of one rolling sum, so no offsets are gathered
+        length = query.size // segments
+        query_paa = query[:segments * length].reshape(segments, length).mean(axis=1)
+        rolling = cumsum_y[length:] - cumsum_y[:-length]
+        result = np.zeros(mean.size)
+        for segment in range(segments):
+            reference_paa = (rolling[segment * length:segment * length + mean.size] / length - mean) / std
+            result += (query_paa[segment] - reference_paa) ** 2
+        return length * result
+
+    def __paa_bound(self, query, segments, cumsum_y, offsets, mean, std):
+        # sum over segments of length * (mean(q) - mean(z))^2 <= sum (q - z)^2 (cauchy-schwarz per segment)
+        length = query.size // segments
+        starts = np.arange(segments) * length
+        query_paa = query[:segments * length].reshape(segments, length).mean(axis=1)
+        result = np.empty(offsets.size)
+        rows = self.__rows(segments)
+        for start in range(0, offsets.size, rows):
+            end = start + rows
+            segment_starts = offsets[start:end, None] + starts[None, :]
+            sums = cumsum_y[segment_starts + length] - cumsum_y[segment_starts]
+            reference_paa = (sums / length - mean[start:end, None]) / std[start:end, None]
+            result[start:end] = length * np.sum((query_paa[None, :] - reference_paa) ** 2, axis=1)
+        return result
+
+    def __distance(self, query, order, y, offsets, mean, std, threshold):
+        # full distance, abandoned block wise as soon as the partial sum reaches the threshold
+        result = np.zeros(offsets.size)
+        active = np.arange(offsets.size)
+        block = max(self.__stages[-1], 1) if self.__stages else query.size
+        for block_start in range(0, query.size, block):
+            indices = order[block_start:block_start + block]
+            rows = self.__rows(indices.size)
+            for start in range(0, active.size, rows):
+                rows_active = active[start:start + rows]
+                values = (y[offsets[rows_active, None] + indices[None, :]] - mean[rows_active, None]) / \
+                    std[rows_active, None]
+                result[rows_active] += np.sum((query[indices][None, :] - values) ** 2, axis=1)
+            active = active[result[active] < threshold]
+        result[np.setdiff1d(np.arange(offsets.size), active)] = np.inf
+        return result
+
+    @staticmethod
+    def __best(offsets, distances, count, exclusion):
+        # greedy selection by distance, selected offsets are at least exclusion apart
+        selected = []
+        for i in np.argsort(distances):
+            if not np.isfinite(distances[i]):
+                break
+            if all(abs(offsets[i] - offsets[j]) >= exclusion for j in selected):
+                selected.append(i)
+                if len(selected) == count:
+                    break
+        return np.array(selected, dtype=np.int64)
+
+    def __threshold(self, offsets, distances, top_k, exclusion):
+        # every selected offset can exclude at most one of offsets separated by 2 * exclusion, so no offset with a
+        # larger distance can reach the top k
+        best = self.__best(offsets, distances, top_k, 2 * exclusion)
+        return distances[best[-1]] if best.size == top_k else np.inf
+
+    def search(self, extracted_enf, top_k=5, exclusion=None) -> List[ENFTimestampMatch]:
+        query = np.asarray(extracted_enf, dtype=np.float64)
+        window = query.size
+        positions = self.__size - window + 1
+        if window < 2 or positions < 1:
+            raise ValueError(f"extracted enf ({window}) must not be longer than the reference ({self.__size})")
+        valid = ~np.isnan(query)
+        if np.count_nonzero(valid) < 2 or np.ptp(query[valid]) == 0:
+            logger.warning('subsequence search: constant or nan enf, no matches')
+            return []
+        if not np.all(valid):
+            query = np.interp(np.arange(window), np.flatnonzero(valid), query[valid])
+        query = (query - np.mean(query)) / np.std(query)
+        exclusion = window // 4 if exclusion is None else exclusion
+        # largest contributions first, they raise the partial distance fastest
+        order = np.argsort(-np.abs(query))
+        stages = [segments for segments in self.__stages if segments <= window // 2]
+        self.stats = ENFSubsequenceSearchStats()
+        self.stats.pruned_per_stage = [0] * (len(stages) + 1)
+
+        evaluated_offsets = np.zeros(0, dtype=np.int64)
+        evaluated_distances = np.zeros(0)
+        threshold = np.inf
+        for block_start in range(0, positions, self.__block_size):
+            block_positions = min(self.__block_size, positions - block_start)
+            y, cumsum_valid, cumsum_y, cumsum_y2 = self.__read_block(block_start, block_start + block_positions +
+                                                                     window - 1)
+            usable, mean, std = self.__window_statistics(cumsum_valid, cumsum_y, cumsum_y2, window, block_positions)
+            self.stats.blocks += 1
+            self.stats.offsets += int(np.count_nonzero(usable))
+            if stages:
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    bound = self.__paa_bound_all(query, stages[0], cumsum_y, mean, std)
+            else:
+                bound = np.zeros(block_positions)
+            bound[~usable] = np.inf
+
+            visited = 0
+            remaining = np.flatnonzero(bound < threshold)
+            chunk_size = self.__seeds
+            while remaining.size > 0:
+                # best bound first, small chunks first until the threshold is tight
+                if remaining.size > chunk_size:
+                    chunk = remaining[np.argpartition(bound[remaining], chunk_size - 1)[:chunk_size]]
+                else:
+                    chunk = remaining
+                chunk_size = min(2 * chunk_size, self.__chunk_size)
+                candidates = chunk
+                visited += candidates.size
+                for stage, segments in enumerate(stages[1:], start=1):
+                    stage_bound = self.__paa_bound(query, segments, cumsum_y, candidates, mean[candidates],
+                                                   std[candidates])
+                    keep = stage_bound < threshold
+                    self.stats.pruned_per_stage[stage] += int(np.count_nonzero(~keep))
+                    candidates = candidates[keep]
+                distances = self.__distance(query, order, y, candidates, mean[candidates], std[candidates],
+                                            threshold)
+                keep = np.isfinite(distances)
+                self.stats.pruned_per_stage[-1] += int(np.count_nonzero(~keep))
+                self.stats.fully_evaluated += int(np.count_nonzero(keep))
+                evaluated_offsets = np.concatenate((evaluated_offsets, block_start + candidates[keep]))
+                evaluated_distances = np.concatenate((evaluated_distances, distances[keep]))
+                threshold = self.__threshold(evaluated_offsets, evaluated_distances, top_k, exclusion)
+                # offsets above the threshold can't become part of the result anymore
+                keep = evaluated_distances <= threshold
+                evaluated_offsets, evaluated_distances = evaluated_offsets[keep], evaluated_distances[keep]
+                bound[chunk] = np.inf
+                remaining = remaining[bound[remaining] < threshold]
+            self.stats.pruned_per_stage[0] += int(np.count_nonzero(usable)) - visited
+        logger.debug(f'subsequence search: {self.stats}')
+
+        result = []
+        for i in self.__best(evaluated_offsets, evaluated_distances, top_k, exclusion):
+            index = int(evaluated_offsets[i])
+            correlation = 1 - evaluated_distances[i] / (2 * window)
+            timestamp = self.__timestamp_of(index) if self.__timestamp_of is not None else None
+            result.append(ENFTimestampMatch(timestamp, round(float(correlation), 4), index))
+        return result
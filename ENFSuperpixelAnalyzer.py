@@ -1,12 +1,16 @@
-from concurrent.futures import ThreadPoolExecutor, wait
-from typing import Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple, List
 
 from scipy.fft import rfft, rfftfreq
 from scipy.signal import stft, windows, butter, sosfilt
 import matplotlib.pyplot as plt
 import numpy as np
 
+from ENFCorrelator import ENFCorrelator
 from ENFExtractionResult import ENFExtractionResult
+from ENFNarrowBandEstimator import ENFNarrowBandEstimator, stft_frame_count
+from ENFSubsequenceSearch import ENFSubsequenceSearch
+from ENFTimestampSearch import ENFTimestampMatch
 from base_functions import *
 from ENFMetric import ENFMetric, ENFMetricResult
 
@@ -18,7 +22,8 @@ class ENFSuperpixelAnalyzer:
 
     def __init__(self, destination, fps=30, expected_enf_frequency_in_hz=10., show_plots=True, filename_prefix=None,
                  bandpass_order=6, bandpass_width=.3, fps_real=30., save_data=True, samples_stft=512,
-                 samples_stft_me=1024, nfft=8192):
+                 samples_stft_me=1024, nfft=8192, workers=None, max_block_bytes=1 << 28,
+                 narrow_band=False):
         self.__save_data = save_data
         self.__fps_real = fps_real
         self.__filename_prefix = filename_prefix
@@ -32,6 +37,9 @@ class ENFSuperpixelAnalyzer:
         self.__samples_stft_me = samples_stft_me
         self.__bandpass_order = bandpass_order
         self.__bandpass_width = bandpass_width
+        self.__workers = workers if workers is not None else os.cpu_count()
+        self.__max_block_bytes = max_block_bytes
+        self.__narrow_band = narrow_band
 
     def __fft(self, data, title):
         if self.__save_data or self.__show_plots:
@@ -157,31 +165,46 @@ class ENFSuperpixelAnalyzer:
                      [(self.__expected_enf_frequency_in_hz - self.__bandpass_width) / (.5 * self.__fps_real),
                       (self.__expected_enf_frequency_in_hz + self.__bandpass_width) / (.5 * self.__fps_real)],
                      btype='bandpass', output='sos')
-        f_low = self.__expected_enf_frequency_in_hz - self.__bandpass_width
-        f_high = self.__expected_enf_frequency_in_hz + self.__bandpass_width
         overlap_stft = stft_samples - self.__fps
         hann = windows.hann(stft_samples)
-        data = sosfilt(sos, enf_superpixel_data[0])
-        f1, t1, Zxx = stft(data, fs=1, nperseg=stft_samples, noverlap=overlap_stft, window=hann, nfft=self.__nfft)
-        result = np.zeros(shape=(enf_superpixel_data.shape[0], t1.size))
-        with ThreadPoolExecutor(max_workers=6) as executor:
-            futures = [
-                executor.submit(self.__enf_with_stft_one_superpixel, sos, sp, enf_superpixel_data[sp], stft_samples,
-                                overlap_stft, hann, f_low, f_high, result) for sp in
-                range(enf_superpixel_data.shape[0])]
-            wait(futures)
-        return result
-
-    def __enf_with_stft_one_superpixel(self, sos, sp_idx, superpixel_data, stft_samples, overlap_stft, window, f_low,
-                                       f_high, result):
-        data = sosfilt(sos, superpixel_data)
-        f1, t1, Zxx = stft(data, fs=1, nperseg=stft_samples, noverlap=overlap_stft, window=window, nfft=self.__nfft)
+        estimator = self.__narrow_band_estimator(stft_samples, overlap_stft, hann) if self.__narrow_band else None
+        # rows per block, so that the spectrograms of all blocks in flight (one per worker) fit into max_block_bytes
+        frames = stft_frame_count(enf_superpixel_data.shape[1], stft_samples, stft_samples - overlap_stft)
+        if estimator is not None:
+            bytes_per_row = estimator.bytes_per_frame() * frames
+        else:
+            # complex spectrogram and its magnitude
+            bytes_per_row = (self.__nfft // 2 + 1) * frames * (16 + 8)
+        rows = max(1, self.__max_block_bytes // (self.__workers * bytes_per_row))
+        blocks = [enf_superpixel_data[start:start + rows] for start in range(0, enf_superpixel_data.shape[0], rows)]
+        with ThreadPoolExecutor(max_workers=self.__workers) as executor:
+            results = list(executor.map(
+                lambda block: self.__enf_with_stft_block(sos, block, stft_samples, overlap_stft, hann, estimator),
+                blocks))
+        return np.concatenate(results, axis=0)
+
+    def __enf_with_stft_block(self, sos, superpixel_data, stft_samples, overlap_stft, window, estimator=None):
+        # band-pass and spectrograms of all superpixels of the block along the time axis at once
+        data = sosfilt(sos, superpixel_data, axis=1)
+        if estimator is not None:
+            return estimator.peak_frequencies(data)
+        f1, t1, Zxx = stft(data, fs=1, nperseg=stft_samples, noverlap=overlap_stft, window=window, nfft=self.__nfft,
+                           axis=1)
         f1_real = f1 * self.__fps_real
-        result[sp_idx] = f1_real[np.argmax(np.abs(Zxx), axis=0)]
+        return f1_real[np.argmax(np.abs(Zxx), axis=1)]
+
+    def __narrow_band_estimator(self, stft_samples, overlap_stft, window) -> ENFNarrowBandEstimator:
+        return ENFNarrowBandEstimator(self.__fps_real, self.__expected_enf_frequency_in_hz - self.__bandpass_width,
+                                      self.__expected_enf_frequency_in_hz + self.__bandpass_width, stft_samples,
+                                      overlap_stft, nfft=self.__nfft, window=window)
 
     def __enf_with_stft(self, data, stft_samples=256):
         overlap_stft = stft_samples - self.__fps
         hann = windows.hann(stft_samples)
+        if self.__narrow_band:
+            estimator = self.__narrow_band_estimator(stft_samples, overlap_stft, hann)
+            magnitude = estimator.magnitude(data)
+            return estimator.peak_frequencies(magnitude=magnitude), estimator.weighted_frequencies(magnitude=magnitude)
         f1, t1, Zxx = stft(data, fs=1, nperseg=stft_samples, noverlap=overlap_stft, window=hann,
                            nfft=self.__nfft)
         f1_real = f1 * self.__fps_real
@@ -194,18 +217,51 @@ class ENFSuperpixelAnalyzer:
         weighted_energy_freq = np.sum(energy * freq[:, None], axis=0) / np.sum(energy, axis=0)
         return max_energy_stft, weighted_energy_freq
 
-    def correlate(self, extracted_enf: np.ndarray, frequency_data: pd.Series, description="") -> ENFExtractionResult:
+    def correlate(self, extracted_enf: np.ndarray, frequency_data: pd.Series, description="",
+                  correlator: ENFCorrelator = None, correlated: np.ndarray = None) -> ENFExtractionResult:
+        # correlated: curve of correlation_curves, calculated if None
+        if correlated is None:
+            correlated = self.correlation_curves([extracted_enf], frequency_data, correlator)[0]
+        return self.__extraction_result(extracted_enf, correlated, frequency_data, description)
+
+    def correlation_curves(self, extracted_enfs: List[np.ndarray], frequency_data: pd.Series,
+                           correlator: ENFCorrelator = None) -> List[np.ndarray]:
+        # pearson correlation of every enf at every position of the frequency data, all enf in one pass
+        if correlator is None:
+            correlator = ENFCorrelator(frequency_data.to_numpy())
+        elif correlator.size() != frequency_data.size:
+            raise ValueError(f"correlator ({correlator.size()}) doesn't match frequency data ({frequency_data.size})")
+        logger.debug(f'correlate: {len(extracted_enfs)} enf against {frequency_data.size} samples')
+        return correlator.sliding_pearson_many(extracted_enfs)
+
+    def correlate_many(self, extracted_enfs: List[np.ndarray], frequency_data: pd.Series, descriptions: List[str],
+                       correlator: ENFCorrelator = None) -> List[ENFExtractionResult]:
+        return [self.correlate(extracted_enf, frequency_data, description, correlated=correlated)
+                for extracted_enf, description, correlated in
+                zip(extracted_enfs, descriptions, self.correlation_curves(extracted_enfs, frequency_data, correlator))]
+
+    def correlate_top_k(self, extracted_enf: np.ndarray, frequency_data, top_k=5) -> List[ENFTimestampMatch]:
+        # exact best matches without the whole correlation curve, frequency_data: pd.Series or GroundTruthStore
+        if isinstance(frequency_data, pd.Series):
+            matches = ENFSubsequenceSearch(frequency_data.to_numpy()).search(extracted_enf, top_k=top_k)
+            for match in matches:
+                match.timestamp = frequency_data.index[match.index]
+            return matches
+        return ENFSubsequenceSearch(frequency_data).search(extracted_enf, top_k=top_k)
+
+    def __extraction_result(self, extracted_enf: np.ndarray, correlated: np.ndarray, frequency_data: pd.Series,
+                            description) -> ENFExtractionResult:
         data_frame = pd.DataFrame(frequency_data)
         enf_series = pd.Series(extracted_enf, name=ENFExtractionResult.dataframe_name)
-        size = (data_frame.size - enf_series.size) + 1
-        correlated = np.zeros(size)
-        for i in range(0, size):
-            if i % 10000 == 0:
-                logger.debug(f'correlate: {i}/{size}')
-            section = frequency_data.iloc[i:i + enf_series.size].reset_index(drop=True)
-            correlated[i] = enf_series.corr(section)
         self.__correlation_plot(correlated, description)
-        index_max_correlation = np.argmax(correlated)
+        if np.all(np.isnan(correlated)):
+            # constant or all nan enf: no correlation and no timestamp
+            logger.warning(f'no correlation: {description}')
+            enf_result = ENFExtractionResult()
+            enf_result.max_correlation = np.nan
+            enf_result.data_frame = data_frame
+            return enf_result
+        index_max_correlation = np.nanargmax(correlated)
         time_aligned_enf_data = pd.DataFrame(
             {enf_series.name: np.add(enf_series.array, 50 - self.__expected_enf_frequency_in_hz)},
             index=data_frame.index[
@@ -213,7 +269,7 @@ class ENFSuperpixelAnalyzer:
         data_frame[ENFExtractionResult.dataframe_name] = time_aligned_enf_data
 
         enf_result = ENFExtractionResult()
-        enf_result.max_correlation = round(np.max(correlated), 4)
+        enf_result.max_correlation = round(np.nanmax(correlated), 4)
         enf_result.max_correlation_index = index_max_correlation
         enf_result.data_frame = data_frame
         if self.__filename_prefix is not None and self.__save_data:
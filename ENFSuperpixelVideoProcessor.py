@@ -1,8 +1,17 @@
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import Optional
 
+from LumaCache import LumaCache
 from MeanMedianSuperpixelCalculator import MeanMedianSuperpixelCalculator
 from MotionDetectorGSOC import MotionDetectorGSOC
+from MotionDetectorSuperpixelVariance import MotionDetectorSuperpixelVariance
+from SharedFrameRing import SharedFrameRing
+from SuperpixelIntensityStore import SuperpixelIntensityStore
+from SuperpixelSegmentationCache import SuperpixelSegmentationCache
 from VideoGrabber import VideoGrabber
 import numpy as np
 from os import makedirs
@@ -14,15 +23,159 @@ logger = logging.getLogger(__name__)
 logger.setLevel(LOGGER_LEVEL)
 
 
+def process_segment(video_file, start_frame_nr, end_frame_nr, segmented_superpixel, selected_superpixels,
+                    motion_detection=True, motion_threshold_factor=.2, block_size=16, roi=None, scale=1,
+                    motion_scale=1, motion_stride=1, motion_method='gsoc', first_frame_nr=0, motion_trace_frames=None,
+                    luma=False):
+    # worker of a video processed in segments: means of the selected superpixel (rows) per frame (columns) of the
+    # frames start_frame_nr..end_frame_nr - 1, the steady superpixel and the motion trace. the segmentation is the one
+    # of the first frame (first_frame_nr) of the video. the frame before the segment only initializes the background
+    # model of the motion detection, the frames of the segment are decoded like in a sequential run
+    md = MotionDetectorGSOC(show_background=False, motion_threshold_factor=motion_threshold_factor,
+                            motion_scale=motion_scale, motion_stride=motion_stride, method=motion_method)
+    mmc = MeanMedianSuperpixelCalculator(mode='mean')
+    vg = VideoGrabber(videofile=video_file, start_frame_nr=start_frame_nr - 1, end_frame=end_frame_nr, silent=True,
+                      luma=luma and not motion_detection, roi=roi, scale=scale)
+
+    def process_first_frame(frame_nr, frame):
+        md.first_frame(frame, segmented_superpixel=segmented_superpixel, frame_nr=start_frame_nr - 1 - first_frame_nr,
+                       motion_trace_frames=motion_trace_frames)
+        mmc.initialize(segmented_superpixel=segmented_superpixel, total_nr_frames=end_frame_nr - start_frame_nr)
+        mmc.select_superpixels(selected_superpixels)
+
+    vg.first_frame(callback=process_first_frame)
+    # colour frames are processed one by one, a ring of 4k colour blocks would be too large
+    blocks = luma and not motion_detection
+    for frame_nr, frames in vg.frames(block_size=block_size if blocks else None):
+        if motion_detection:
+            md.next_frame(frames)
+        if blocks:
+            mmc.next_frames(frames)
+        else:
+            mmc.next_frame(frames)
+    md.stop()
+    selected = np.zeros(len(md.get_superpixel_indices()), dtype=bool)
+    selected[np.subtract(selected_superpixels, 1)] = True
+    return mmc.get_mean_per_superpixel(selected), md.get_steady_superpixel_indices(), md.get_motion_trace()
+
+
+def decode_stage(ring: SharedFrameRing, video_file, start_frame_nr, end_frame_nr, luma, results, roi=None, scale=1):
+    # pipeline: frames after start_frame_nr (already processed) into the ring
+    vg = VideoGrabber(videofile=video_file, start_frame_nr=start_frame_nr, end_frame=end_frame_nr, silent=True,
+                      luma=luma, roi=roi, scale=scale)
+    vg.first_frame(callback=lambda frame_nr, frame: None)
+    frames, blocked, start = 0, 0., time.perf_counter()
+    for frame_nr, frame in vg.frames():
+        wait = time.perf_counter()
+        slot = ring.next_slot()
+        blocked += time.perf_counter() - wait
+        slot[...] = frame
+        ring.commit()
+        frames += 1
+    ring.finish()
+    ring.close()
+    results.put(('decode', frames, time.perf_counter() - start, blocked, None))
+
+
+def motion_stage(ring: SharedFrameRing, consumer, first_frame, segmented_superpixel, motion_threshold_factor, results,
+                 motion_scale=1, motion_stride=1, motion_method='gsoc', motion_trace_frames=None):
+    md = MotionDetectorGSOC(show_background=False, motion_threshold_factor=motion_threshold_factor,
+                            motion_scale=motion_scale, motion_stride=motion_stride, method=motion_method)
+    md.first_frame(first_frame, segmented_superpixel=segmented_superpixel, motion_trace_frames=motion_trace_frames)
+    frames, blocked, start = 0, 0., time.perf_counter()
+    while True:
+        wait = time.perf_counter()
+        item = ring.get(consumer)
+        blocked += time.perf_counter() - wait
+        if item is None:
+            break
+        for frame in item[1]:
+            md.next_frame(frame)
+        ring.release(consumer, len(item[1]))
+        frames += len(item[1])
+    del item
+    ring.close()
+    md.stop()
+    results.put(('motion', frames, time.perf_counter() - start, blocked,
+                 (md.get_steady_superpixel_indices(), md.get_motion_trace())))
+
+
+def aggregation_stage(ring: SharedFrameRing, consumer, segmented_superpixel, selected_superpixels, total_nr_frames,
+                      block_size, results):
+    mmc = MeanMedianSuperpixelCalculator(mode='mean')
+    mmc.initialize(segmented_superpixel=segmented_superpixel, total_nr_frames=total_nr_frames)
+    mmc.select_superpixels(selected_superpixels)
+    frames, blocked, start = 0, 0., time.perf_counter()
+    while True:
+        wait = time.perf_counter()
+        item = ring.get(consumer, max_count=block_size)
+        blocked += time.perf_counter() - wait
+        if item is None:
+            break
+        mmc.next_frames(item[1])
+        ring.release(consumer, len(item[1]))
+        frames += len(item[1])
+    del item
+    ring.close()
+    selected = np.zeros(int(np.max(segmented_superpixel)), dtype=bool)
+    selected[np.subtract(selected_superpixels, 1)] = True
+    results.put(('aggregation', frames, time.perf_counter() - start, blocked,
+                 mmc.get_mean_per_superpixel(selected)[:, :frames]))
+
+
 class ENFSuperpixelVideoProcessor:
 
     def __init__(self, show_final_image=False, show_background=False, show_motion_free_image=False,
                  motion_threshold_factor=.2, lightness_threshold=None, data_dir=None, motion_detection=True,
-                 dataset_video: DatasetVideoSuperpixel = None, dry_run=False, save_img=True):
+                 dataset_video: DatasetVideoSuperpixel = None, dry_run=False, save_img=True, chunked_storage=False,
+                 intensity_dtype='float16', processes=1, pipeline=False, ring_slots=16, roi=None, scale=1,
+                 motion_scale=1, motion_stride=1, motion_method='gsoc', segmentation_cache_dir=None,
+                 segmentation_scale=1, store_all_superpixels=False, luma_cache=False, luma=False):
         self.__dataset_video = dataset_video
+        # segmentation_cache_dir: directory of a SuperpixelSegmentationCache, the segmentation of the first frame is
+        # reused when the same video is processed again
+        self.__segmentation_cache_dir = segmentation_cache_dir
+        self.__segmentation_cache: Optional[SuperpixelSegmentationCache] = None
+        # store_all_superpixels: the means of all superpixel are stored together with the first frame luminance and
+        # the motion per second of every superpixel, other thresholds can be applied without processing the video
+        # again (SuperpixelIntensityStore.threshold_labels). the default rows of the store are the steady superpixel
+        self.__store_all_superpixels = store_all_superpixels
+        # luma_cache: the frames are read from the LumaCache of the video if it exists (low resolution, the
+        # segmentation is calculated at this resolution), sequentially
+        self.__luma_cache = luma_cache
+        # luma: without motion detection frames after the first one are decoded as Y plane only, faster but the means
+        # differ slightly from those of the BGR frames converted to gray
+        self.__luma = luma
+        self.__motion_trace_frames = None
+        # roi (x, y, width, height) and scale (downscale factor) of the processed frames, the segmentation is
+        # calculated at this resolution
+        self.__roi = roi
+        self.__scale = scale
+        # motion detection on frames downscaled by motion_scale, every motion_stride-th frame
+        self.__motion_scale = motion_scale
+        self.__motion_stride = motion_stride
+        # pipeline: decoding, motion detection and aggregation in separate processes connected by a SharedFrameRing
+        # of ring_slots frames, only without windows
+        self.__pipeline = pipeline
+        self.__ring_slots = ring_slots
+        self.__first_frame = None
+        # processes: number of processes for videos processed in segments, only without windows
+        self.__processes = processes
+        self.__motion_threshold_factor = motion_threshold_factor
+        # chunked_storage: means per superpixel are written during processing into a SuperpixelIntensityStore
+        # instead of a single npy file at the end
+        # with store_all_superpixels: the statistics of all superpixel are part of the store
+        self.__chunked_storage = chunked_storage or store_all_superpixels
+        self.__intensity_dtype = intensity_dtype
+        self.__store: Optional[SuperpixelIntensityStore] = None
         self.__save_img = save_img
         self.__dry_run = dry_run
         self.__motion_detection = motion_detection
+        # motion_method: see MOTION_DETECTION_METHODS. 'variance' uses the means per superpixel after processing, the
+        # frames aren't used for motion detection
+        self.__motion_method = motion_method
+        self.__frame_motion_detection = motion_detection and motion_method != 'variance'
+        self.__frame_motion_method = motion_method if motion_method != 'variance' else 'difference'
         self.__lightness_threshold = lightness_threshold
         self.__data_dir = data_dir
         self.__video_filename = ""
@@ -30,9 +183,11 @@ class ENFSuperpixelVideoProcessor:
         self.__show_final_image = show_final_image
         self.__wait_key = show_background or show_final_image or show_motion_free_image
         self.__md = MotionDetectorGSOC(show_background=show_background, show_motion_free_image=show_motion_free_image,
-                                       motion_threshold_factor=motion_threshold_factor, dataset_video=dataset_video)
+                                       motion_threshold_factor=motion_threshold_factor, dataset_video=dataset_video,
+                                       motion_scale=motion_scale, motion_stride=motion_stride,
+                                       method=self.__frame_motion_method, segmentation_scale=segmentation_scale)
         self.__mmc = MeanMedianSuperpixelCalculator(threshold=lightness_threshold, mode='mean',
-                                                    ds_video_sp=dataset_video)
+                                                    ds_video_sp=dataset_video, select_all=store_all_superpixels)
 
     def get_mean_data_filename(self, video_file=None):
         if video_file is None:
@@ -40,13 +195,71 @@ class ENFSuperpixelVideoProcessor:
         else:
             return f"{self.__data_dir}/{video_file}_mean_per_spx.npy"
 
+    def get_mean_data_directory(self, video_file=None):
+        return f"{self.__data_dir}/{self.__video_filename if video_file is None else video_file}_mean_per_spx"
+
+    def has_mean_data(self, video_file):
+        return SuperpixelIntensityStore(self.get_mean_data_directory(video_file)).is_complete() or \
+            Path(self.get_mean_data_filename(video_file)).is_file()
+
+    def load_mean_data(self, video_file):
+        store = SuperpixelIntensityStore(self.get_mean_data_directory(video_file))
+        if store.is_complete():
+            return store.read()
+        return np.load(self.get_mean_data_filename(video_file))
+
     def process_video(self, video_file, start_frame_nr=0, end_frame_nr=None):
+        luma_cache = self.__open_luma_cache(video_file) if self.__luma_cache else None
+        parallel = self.__processes > 1 and not self.__wait_key and luma_cache is None
+        pipeline = self.__pipeline and not parallel and not self.__wait_key and luma_cache is None
+        vg = VideoGrabber(videofile=video_file, start_frame_nr=start_frame_nr, end_frame=end_frame_nr,
+                          luma=self.__luma and not self.needs_colour() and not parallel and not pipeline,
+                          roi=self.__roi, scale=self.__scale, luma_cache=luma_cache)
+        self.start(video_file, vg)
+        vg.first_frame(callback=self.first_frame)
+        if parallel:
+            self.__process_segments(video_file)
+        elif pipeline:
+            self.__process_pipeline(video_file)
+        else:
+            vg.grab(callback=self.next_frame)
+        return self.finish()
+
+    # consumer of a VideoFanOutProcessor: frames of vg, gray: luminance of the frame if already converted
+    def needs_colour(self):
+        # colour frames are only needed for motion detection
+        return self.__frame_motion_detection
+
+    def start(self, video_file, vg: VideoGrabber):
         self.__video_filename = Path(video_file).name
-        self.__vg = VideoGrabber(videofile=video_file, start_frame_nr=start_frame_nr, end_frame=end_frame_nr)
-        self.__vg.first_frame(callback=self.__process_first_frame)
-        self.__vg.grab(callback=self.__process_frame)
+        self.__store = None
+        if self.__chunked_storage and not self.__dry_run and self.__data_dir:
+            self.__store = SuperpixelIntensityStore(self.get_mean_data_directory(), dtype=self.__intensity_dtype)
+        self.__segmentation_cache = SuperpixelSegmentationCache(video_file, vg.get_start_frame_nr(), self.__roi,
+                                                                self.__scale, self.__segmentation_cache_dir) \
+            if self.__segmentation_cache_dir is not None else None
+        self.__vg = vg
+        self.__motion_trace_frames = max(round(self.__vg.get_fps()), 1) \
+            if self.__store_all_superpixels and self.__frame_motion_detection else None
+
+    def first_frame(self, frame_nr, frame, gray=None):
+        self.__process_first_frame(frame_nr, frame, gray)
+
+    def next_frame(self, frame_nr, frame, gray=None):
+        self.__process_frame(frame_nr, frame, gray)
+
+    def finish(self):
+        if self.__store is not None:
+            self.__store.close()
+        if self.__motion_detection and self.__motion_method == 'variance':
+            self.__detect_motion_from_means()
+        if self.__store is not None:
+            self.__store.set_steady_labels(np.add(np.where(self.__md.get_steady_superpixel_indices())[0], 1))
+            if self.__store_all_superpixels:
+                self.__store.save_statistics(*self.__mmc.get_first_frame_intensities(), self.__md.get_motion_trace(),
+                                             self.__motion_trace_frames)
         mean_per_superpixel = self.__mmc.get_mean_per_superpixel(self.__md.get_steady_superpixel_indices())
-        if not self.__dry_run and self.__data_dir:
+        if self.__store is None and not self.__dry_run and self.__data_dir:
             makedirs(self.__data_dir, exist_ok=True)
             np.save(self.get_mean_data_filename(), mean_per_superpixel)
         if self.__show_final_image:
@@ -60,22 +273,128 @@ class ENFSuperpixelVideoProcessor:
         logger.info(f"done: {self.__video_filename}")
         return mean_per_superpixel
 
-    def __process_first_frame(self, frame_nr, frame):
-        self.__md.first_frame(frame)
+    def __open_luma_cache(self, video_file):
+        luma_cache = LumaCache(video_file)
+        if not luma_cache.exists():
+            logger.warning(f"no luma cache of {video_file}, decoding the video")
+            return None
+        if self.__roi is not None or self.__scale > 1:
+            logger.warning("luma cache not used with roi or scale")
+            return None
+        return luma_cache
+
+    def __detect_motion_from_means(self):
+        selected_superpixels = np.array(self.__mmc.get_selected_superpixels(), dtype=np.int64)
+        selected = np.zeros(len(self.__md.get_superpixel_indices()), dtype=bool)
+        selected[selected_superpixels - 1] = True
+        steady = MotionDetectorSuperpixelVariance().steady_superpixel(self.__mmc.get_mean_per_superpixel(selected))
+        self.__md.apply_disabled_superpixel(selected_superpixels[~steady])
+        logger.debug(f'superpixel with motion (variance): {np.count_nonzero(~steady)} / {steady.size}')
+
+    def __process_segments(self, video_file):
+        # the frames after the first one in equal segments, one per process. the results are appended in order, a
+        # superpixel with motion in any segment isn't steady
+        start_frame_nr = self.__vg.get_start_frame_nr() + 1
+        end_frame_nr = self.__vg.get_start_frame_nr() + self.__vg.total_frames()
+        bounds = np.linspace(start_frame_nr, end_frame_nr, min(self.__processes, end_frame_nr - start_frame_nr) + 1,
+                             dtype=int)
+        logger.debug(f'{len(bounds) - 1} segments: {bounds.tolist()}')
+        segmented_superpixel = self.__md.segmented_superpixel()
+        selected_superpixels = self.__mmc.get_selected_superpixels()
+        with ProcessPoolExecutor(max_workers=len(bounds) - 1) as executor:
+            futures = [executor.submit(process_segment, video_file, int(start), int(end), segmented_superpixel,
+                                       selected_superpixels, self.__frame_motion_detection,
+                                       self.__motion_threshold_factor,
+                                       roi=self.__roi, scale=self.__scale, motion_scale=self.__motion_scale,
+                                       motion_stride=self.__motion_stride,
+                                       motion_method=self.__frame_motion_method,
+                                       first_frame_nr=self.__vg.get_start_frame_nr(),
+                                       motion_trace_frames=self.__motion_trace_frames,
+                                       luma=self.__luma)
+                       for start, end in zip(bounds[:-1], bounds[1:])]
+            for start, future in zip(bounds[:-1], futures):
+                mean_per_superpixel, steady_superpixel, motion_trace = future.result()
+                self.__mmc.append_means(mean_per_superpixel)
+                if self.__frame_motion_detection:
+                    self.__md.merge_steady_superpixel(steady_superpixel)
+                if motion_trace is not None:
+                    self.__md.merge_motion_trace(motion_trace)
+                logger.debug(f'segment {start} - {start + mean_per_superpixel.shape[1] - 1} done')
+
+    def __process_pipeline(self, video_file):
+        # one process per stage, the frames are passed in shared memory. aggregation is consumer 0, motion detection
+        # consumer 1 of the ring
+        start_frame_nr = self.__vg.get_start_frame_nr()
+        total_nr_frames = self.__vg.total_frames() - 1
+        luma = self.__luma and not self.__frame_motion_detection
+        shape = (self.__vg.get_height(), self.__vg.get_width()) + (() if luma else (3,))
+        ring = SharedFrameRing(shape, slots=self.__ring_slots, consumers=2 if self.__frame_motion_detection else 1)
+        results = multiprocessing.Queue()
+        segmented_superpixel = self.__md.segmented_superpixel()
+        stages = [multiprocessing.Process(target=decode_stage,
+                                          args=(ring, video_file, start_frame_nr, start_frame_nr + total_nr_frames + 1,
+                                                luma, results, self.__roi, self.__scale)),
+                  multiprocessing.Process(target=aggregation_stage,
+                                          args=(ring, 0, segmented_superpixel, self.__mmc.get_selected_superpixels(),
+                                                total_nr_frames, self.__ring_slots // 2, results))]
+        if self.__frame_motion_detection:
+            stages.append(multiprocessing.Process(target=motion_stage,
+                                                  args=(ring, 1, self.__first_frame, segmented_superpixel,
+                                                        self.__motion_threshold_factor, results, self.__motion_scale,
+                                                        self.__motion_stride, self.__frame_motion_method,
+                                                        self.__motion_trace_frames)))
+        for stage in stages:
+            stage.start()
+        stats = {}
+        try:
+            while len(stats) < len(stages):
+                try:
+                    name, frames, duration, blocked, result = results.get(timeout=1)
+                except queue.Empty:
+                    if any(stage.exitcode not in (None, 0) for stage in stages):
+                        raise RuntimeError("pipeline stage failed")
+                    continue
+                stats[name] = (frames, duration, blocked)
+                if name == 'aggregation':
+                    self.__mmc.append_means(result)
+                elif name == 'motion':
+                    steady_superpixel, motion_trace = result
+                    self.__md.merge_steady_superpixel(steady_superpixel)
+                    if motion_trace is not None:
+                        self.__md.merge_motion_trace(motion_trace)
+        finally:
+            for stage in stages:
+                if stage.exitcode is None and len(stats) < len(stages):
+                    stage.terminate()
+                stage.join()
+            ring.close()
+            ring.unlink()
+        # busy: frames per second of the time not blocked by the ring, the stage with the lowest rate is the bottleneck
+        busy = {name: frames / max(duration - blocked, 1e-9) for name, (frames, duration, blocked) in stats.items()}
+        for name, (frames, duration, blocked) in stats.items():
+            logger.info(f'{name}: {frames} frames, {busy[name]:.1f} fps busy, {frames / duration:.1f} fps, '
+                        f'blocked {100 * blocked / duration:.0f} %')
+        logger.info(f'bottleneck: {min(busy, key=busy.get)}')
+
+    def __process_first_frame(self, frame_nr, frame, gray=None):
+        self.__first_frame = frame
+        self.__md.first_frame(frame, segmentation_cache=self.__segmentation_cache,
+                              motion_trace_frames=self.__motion_trace_frames)
         self.__mmc.initialize(segmented_superpixel=self.__md.segmented_superpixel(),
-                              total_nr_frames=self.__vg.total_frames())
-        self.__mmc.first_frame(frame)
+                              total_nr_frames=self.__vg.total_frames(), store=self.__store,
+                              segmentation=self.__segmentation_cache)
+        self.__mmc.first_frame(frame if gray is None else gray)
         if self.__dataset_video is not None:
             self.__dataset_video.lightness_threshold = self.__mmc.get_threshold()
         self.__md.apply_disabled_superpixel(self.__mmc.get_disabled_superpixels())
         if not self.__dry_run and self.__save_img:
             self.__md.save_image(f'{self.__data_dir}/{self.__video_filename}-first.jpg')
 
-    def __process_frame(self, frame_nr, frame):
-        if self.__motion_detection:
+    def __process_frame(self, frame_nr, frame, gray=None):
+        if self.__frame_motion_detection:
             self.__md.next_frame(frame)
             self.__md.show_motionless_image()
-        self.__mmc.next_frame(frame)
+        self.__mmc.next_frame(frame if gray is None else gray)
         if frame_nr % 50 == 0:
             logger.debug(f'frame {frame_nr + self.__vg.get_start_frame_nr()} / {self.__vg.total_frames()}')
         # cv2.waitKey()
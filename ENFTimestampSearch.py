@@ -0,0 +1,122 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+from scipy.signal import find_peaks
+
+from ENFCorrelator import ENFCorrelator
+from GroundTruthStore import GroundTruthStore
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class ENFTimestampMatch:
+
+    def __init__(self, timestamp, correlation, index):
+        self.timestamp = timestamp
+        self.correlation = correlation
+        self.index = index
+
+    def __str__(self):
+        return f'timestamp: {self.timestamp}, correlation: {self.correlation}'
+
+
+def decimate(data, factor) -> np.ndarray:
+    # block mean as low-pass filter, nan values are ignored
+    data = np.asarray(data, dtype=np.float64)
+    blocks = data[:(data.size // factor) * factor].reshape(-1, factor)
+    valid = ~np.isnan(blocks)
+    count = np.sum(valid, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(count > 0, np.sum(np.where(valid, blocks, 0.), axis=1) / count, np.nan)
+
+
+def best_offsets(correlated, count, distance) -> np.ndarray:
+    # local maxima at least distance apart, ordered by correlation
+    correlated = np.nan_to_num(correlated, nan=-2.)
+    peaks, _ = find_peaks(np.concatenate(([-2.], correlated, [-2.])), distance=max(distance, 1))
+    peaks -= 1
+    return peaks[np.argsort(correlated[peaks])[::-1][:count]]
+
+
+def _correlate_sections(extracted_enf, sections) -> List[Tuple[int, float]]:
+    result = []
+    for section_start, reference in sections:
+        correlated = ENFCorrelator(reference).sliding_pearson(extracted_enf)
+        if np.all(np.isnan(correlated)):
+            continue
+        index = int(np.nanargmax(correlated))
+        result.append((section_start + index, float(correlated[index])))
+    return result
+
+
+class ENFTimestampSearch:
+
+    # factors: decimation pyramid, coarsest first, the last level is followed by the full resolution
+    def __init__(self, store: GroundTruthStore, factors=(16, 4), candidates=32, workers=None):
+        self.__store = store
+        self.__factors = factors
+        self.__candidates = candidates
+        self.__workers = workers if workers is not None else os.cpu_count()
+
+    def search(self, extracted_enf, start_timestamp=None, end_timestamp=None, top_k=5) -> List[ENFTimestampMatch]:
+        extracted_enf = np.asarray(extracted_enf, dtype=np.float64)
+        start = 0 if start_timestamp is None else max(self.__store.index_of(start_timestamp), 0)
+        end = self.__store.size() if end_timestamp is None else min(self.__store.index_of(end_timestamp),
+                                                                    self.__store.size())
+        reference = self.__store.frequencies(start, end)
+        logger.debug(f'search: {extracted_enf.size} samples in {reference.size} samples of ground truth')
+
+        candidates = None
+        previous_factor = None
+        for factor in self.__factors:
+            enf_decimated = decimate(extracted_enf, factor)
+            reference_decimated = decimate(reference, factor)
+            if enf_decimated.size < 8 or enf_decimated.size > reference_decimated.size:
+                continue
+            if candidates is None:
+                correlated = ENFCorrelator(reference_decimated).sliding_pearson(enf_decimated)
+            else:
+                correlated = np.full(reference_decimated.size - enf_decimated.size + 1, np.nan)
+                margin = 2 * previous_factor // factor
+                for candidate in candidates:
+                    section_start = max(candidate * previous_factor // factor - margin, 0)
+                    section_end = min(candidate * previous_factor // factor + margin + 1, correlated.size)
+                    if section_end <= section_start:
+                        continue
+                    section = reference_decimated[section_start:section_end + enf_decimated.size - 1]
+                    correlated[section_start:section_end] = ENFCorrelator(section).sliding_pearson(enf_decimated)
+            candidates = best_offsets(correlated, self.__candidates, enf_decimated.size // 4)
+            previous_factor = factor
+            logger.debug(f'search: decimation {factor}, best correlation: {np.nanmax(correlated):.4f}')
+
+        if candidates is None:
+            sections = [(0, reference)]
+        else:
+            margin = 2 * previous_factor
+            sections = []
+            for candidate in candidates:
+                section_start = max(candidate * previous_factor - margin, 0)
+                section_end = min(candidate * previous_factor + margin + extracted_enf.size, reference.size)
+                if section_end - section_start >= extracted_enf.size:
+                    sections.append((section_start, reference[section_start:section_end]))
+        matches = self.__correlate_sections(extracted_enf, sections)
+
+        result = []
+        for index, correlation in sorted(set(matches), key=lambda match: match[1], reverse=True):
+            index += start
+            if all(abs(index - match.index) >= extracted_enf.size // 4 for match in result):
+                result.append(ENFTimestampMatch(self.__store.timestamp_of(index), round(correlation, 4), index))
+            if len(result) == top_k:
+                break
+        return result
+
+    def __correlate_sections(self, extracted_enf, sections):
+        if self.__workers <= 1 or len(sections) <= 1:
+            return _correlate_sections(extracted_enf, sections)
+        shards = [sections[i::self.__workers] for i in range(self.__workers) if sections[i::self.__workers]]
+        with ProcessPoolExecutor(max_workers=len(shards)) as executor:
+            results = executor.map(_correlate_sections, [extracted_enf] * len(shards), shards)
+            return [match for result in results for match in result]
@@ -0,0 +1,266 @@
+import json
+from typing import Optional, Tuple
+
+import numpy as np
+
+from ENFCorrelator import ENFCorrelator
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def to_epoch_seconds(timestamps) -> np.ndarray:
+    return np.asarray((pd.DatetimeIndex(timestamps) - pd.Timestamp(0)) // pd.Timedelta(seconds=1), dtype=np.int64)
+
+
+class GroundTruthStore:
+    index_filename = "index.json"
+    ingested_filename = "ingested.json"
+    values_filename = "frequency.npy"
+    rolling_filenames = ("cumsum_valid.npy", "cumsum_delta.npy", "cumsum_delta2.npy")
+    int16_missing = np.iinfo(np.int16).min
+    growth_in_samples = 31 * 86400
+    chunk_size = 86400
+
+    # values are stored as deltas from the nominal frequency: float32 or int16 in multiples of scale (Hz)
+    def __init__(self, directory=None, nominal=50., dtype='float32', scale=.0001, stride=1):
+        self.__directory = Path(directory if directory is not None else get_ground_truth_store_path())
+        self.__nominal = nominal
+        self.__dtype = dtype
+        self.__scale = scale
+        self.__stride = stride
+        self.__start: Optional[int] = None
+        self.__size = 0
+        self.__values: Optional[np.ndarray] = None
+        self.__rolling_sums = None
+        if self.exists():
+            self.__open()
+
+    def exists(self):
+        return (self.__directory / self.index_filename).is_file()
+
+    def __open(self):
+        with open(self.__directory / self.index_filename) as index_file:
+            index = json.load(index_file)
+        self.__start = index['start']
+        self.__size = index['size']
+        self.__stride = index['stride']
+        self.__nominal = index['nominal']
+        self.__dtype = index['dtype']
+        self.__scale = index['scale']
+        self.__values = np.load(self.__directory / self.values_filename, mmap_mode='r')
+        self.__rolling_sums = None
+
+    def __save_index(self):
+        index = {'start': self.__start, 'size': self.__size, 'stride': self.__stride, 'nominal': self.__nominal,
+                 'dtype': self.__dtype, 'scale': self.__scale}
+        with open(self.__directory / self.index_filename, 'w') as index_file:
+            json.dump(index, index_file)
+
+    def size(self):
+        return self.__size
+
+    def get_stride(self):
+        return self.__stride
+
+    def get_nominal(self):
+        return self.__nominal
+
+    def start_timestamp(self):
+        return pd.Timestamp(self.__start, unit='s') if self.__start is not None else None
+
+    def end_timestamp(self):
+        return self.timestamp_of(self.__size - 1) if self.__size > 0 else None
+
+    def timestamp_of(self, index):
+        return pd.Timestamp((self.__start + index * self.__stride), unit='s')
+
+    def index_of(self, timestamp) -> int:
+        return int((to_epoch_seconds([timestamp])[0] - self.__start) // self.__stride)
+
+    def contains(self, start_timestamp, end_timestamp=None):
+        if self.__start is None:
+            return False
+        end_timestamp = start_timestamp if end_timestamp is None else end_timestamp
+        return self.index_of(start_timestamp) >= 0 and self.index_of(end_timestamp) < self.__size
+
+    def __clip(self, start, end):
+        return max(start, 0), min(end, self.__size)
+
+    def day_range(self, day) -> Tuple[int, int]:
+        start = self.index_of(pd.Timestamp(day).normalize())
+        return self.__clip(start, start + 86400 // self.__stride)
+
+    def recording_range(self, timestamp, enf_length, offset=30) -> Tuple[int, int]:
+        # same section as base_functions.slice_csv_data, but not limited to a single day
+        start = self.index_of(timestamp)
+        return self.__clip(start - offset, start + enf_length + offset)
+
+    def deltas(self, start, end) -> np.ndarray:
+        values = np.asarray(self.__values[start:end])
+        if self.__dtype == 'int16':
+            deltas = values.astype(np.float64) * self.__scale
+            deltas[values == self.int16_missing] = np.nan
+            return deltas
+        return values.astype(np.float64)
+
+    def frequencies(self, start, end) -> np.ndarray:
+        return self.deltas(start, end) + self.__nominal
+
+    def series(self, start, end) -> pd.Series:
+        index = pd.date_range(self.timestamp_of(start), periods=end - start, freq=f'{self.__stride}s', name='time')
+        return pd.Series(self.frequencies(start, end), index=index, name='Hz')
+
+    def correlator(self, start, end) -> ENFCorrelator:
+        cumsum_valid, cumsum_delta, cumsum_delta2 = self.__get_rolling_sums()
+        return ENFCorrelator(self.frequencies(start, end), offset=self.__nominal,
+                             rolling_sums=(cumsum_valid[start:end + 1], cumsum_delta[start:end + 1],
+                                           cumsum_delta2[start:end + 1]))
+
+    def __get_rolling_sums(self):
+        if self.__rolling_sums is None:
+            paths = [self.__directory / filename for filename in self.rolling_filenames]
+            if not all(path.is_file() for path in paths):
+                self.__calc_rolling_sums(paths)
+            self.__rolling_sums = tuple(np.load(path, mmap_mode='r') for path in paths)
+        return self.__rolling_sums
+
+    def __calc_rolling_sums(self, paths):
+        logger.debug(f'calculating rolling sums for {self.__size} samples')
+        cumsum_valid = np.lib.format.open_memmap(paths[0], mode='w+', dtype=np.int64, shape=(self.__size + 1,))
+        cumsum_delta = np.lib.format.open_memmap(paths[1], mode='w+', dtype=np.float64, shape=(self.__size + 1,))
+        cumsum_delta2 = np.lib.format.open_memmap(paths[2], mode='w+', dtype=np.float64, shape=(self.__size + 1,))
+        cumsum_valid[0] = cumsum_delta[0] = cumsum_delta2[0] = 0
+        for start in range(0, self.__size, self.chunk_size):
+            end = min(start + self.chunk_size, self.__size)
+            deltas = self.deltas(start, end)
+            valid = ~np.isnan(deltas)
+            deltas[~valid] = 0.
+            cumsum_valid[start + 1:end + 1] = cumsum_valid[start] + np.cumsum(valid)
+            cumsum_delta[start + 1:end + 1] = cumsum_delta[start] + np.cumsum(deltas)
+            cumsum_delta2[start + 1:end + 1] = cumsum_delta2[start] + np.cumsum(deltas ** 2)
+        for cumsum in (cumsum_valid, cumsum_delta, cumsum_delta2):
+            cumsum.flush()
+
+    def __encode(self, frequencies):
+        deltas = np.asarray(frequencies, dtype=np.float64) - self.__nominal
+        if self.__dtype == 'int16':
+            encoded = np.clip(np.rint(deltas / self.__scale), self.int16_missing + 1, np.iinfo(np.int16).max)
+            encoded[np.isnan(deltas)] = self.int16_missing
+            return encoded.astype(np.int16)
+        return deltas.astype(np.float32)
+
+    def __missing_value(self):
+        return self.int16_missing if self.__dtype == 'int16' else np.nan
+
+    def __reserve(self, first, last):
+        if self.__start is None:
+            start, shift = first, 0
+        elif first < self.__start:
+            shift = -((first - self.__start) // self.__stride)
+            start = self.__start - shift * self.__stride
+        else:
+            start, shift = self.__start, 0
+        size = max(self.__size + shift, (last - start) // self.__stride + 1)
+        if shift == 0 and self.__values is not None and size <= self.__values.shape[0]:
+            self.__size = size
+            return
+        # over-allocate, so appending day by day doesn't copy the whole archive every time
+        capacity = size + max(self.growth_in_samples, size // 4)
+        logger.debug(f'ground truth store: allocating {capacity} samples')
+        temporary_path = self.__directory / f'{self.values_filename}.tmp'
+        values = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=self.__dtype, shape=(capacity,))
+        values[:] = self.__missing_value()
+        for chunk_start in range(0, self.__size, self.chunk_size):
+            chunk_end = min(chunk_start + self.chunk_size, self.__size)
+            values[shift + chunk_start:shift + chunk_end] = self.__values[chunk_start:chunk_end]
+        values.flush()
+        del values
+        self.__values = None
+        os.replace(temporary_path, self.__directory / self.values_filename)
+        self.__start = start
+        self.__size = size
+
+    def add(self, timestamps, frequencies):
+        self.add_epochs(to_epoch_seconds(timestamps), frequencies)
+
+    def add_epochs(self, epochs: np.ndarray, frequencies):
+        if epochs.size == 0:
+            return
+        create_directories(self.__directory)
+        self.__reserve(int(epochs.min()), int(epochs.max()))
+        self.__save_index()
+        values = np.load(self.__directory / self.values_filename, mmap_mode='r+')
+        aligned = (epochs - self.__start) % self.__stride == 0
+        values[(epochs[aligned] - self.__start) // self.__stride] = self.__encode(frequencies)[aligned]
+        values.flush()
+        del values
+        self.__invalidate_rolling_sums()
+        self.__open()
+
+    def __invalidate_rolling_sums(self):
+        self.__rolling_sums = None
+        for filename in self.rolling_filenames:
+            path = self.__directory / filename
+            if path.is_file():
+                path.unlink()
+
+    def __read_ingested(self):
+        path = self.__directory / self.ingested_filename
+        if not path.is_file():
+            return {}
+        with open(path) as ingested_file:
+            return json.load(ingested_file)
+
+    def is_ingested(self, content_hash):
+        return content_hash in self.__read_ingested()
+
+    def mark_ingested(self, content_hash, source):
+        ingested = self.__read_ingested()
+        ingested[content_hash] = str(source)
+        create_directories(self.__directory)
+        with open(self.__directory / self.ingested_filename, 'w') as ingested_file:
+            json.dump(ingested, ingested_file, indent=1)
+
+    def ingest_csv(self, csv_files):
+        for csv_file in sorted(csv_files):
+            ground_truth = read_csv(csv_file)
+            self.add(ground_truth.index, ground_truth.to_numpy())
+            logger.info(f'ground truth store: added {csv_file}, {self.start_timestamp()} - {self.end_timestamp()}')
+
+
+def _day_of_csv(csv_file):
+    try:
+        return pd.Timestamp(datetime.strptime(Path(csv_file).stem, "%Y-%m-%d"))
+    except ValueError:
+        return None
+
+
+def _store_contains_day(store: GroundTruthStore, day):
+    return day is not None and store.contains(day, day + pd.Timedelta(seconds=86400 - store.get_stride()))
+
+
+def ground_truth_available(csv_file, store: GroundTruthStore = None):
+    store = GroundTruthStore() if store is None else store
+    if _store_contains_day(store, _day_of_csv(csv_file)):
+        return True
+    return Path(f'{get_enf_truth_path()}/{csv_file}').is_file()
+
+
+def load_ground_truth(csv_file, recording_timestamp=None, enf_length=None,
+                      store: GroundTruthStore = None) -> Tuple[pd.Series, ENFCorrelator]:
+    # prefer the binary store if it covers the day of the csv file, fall back to parsing the csv file
+    store = GroundTruthStore() if store is None else store
+    day = _day_of_csv(csv_file)
+    if _store_contains_day(store, day):
+        if recording_timestamp is not None:
+            start, end = store.recording_range(recording_timestamp, enf_length)
+        else:
+            start, end = store.day_range(day)
+        logger.debug(f'ground truth store: {store.timestamp_of(start)} - {store.timestamp_of(end - 1)}')
+        return store.series(start, end), store.correlator(start, end)
+    ground_truth = read_csv(f'{get_enf_truth_path()}/{csv_file}')
+    if recording_timestamp is not None:
+        ground_truth = slice_csv_data(ground_truth, recording_timestamp, enf_length)
+    return ground_truth, ENFCorrelator(ground_truth.to_numpy())
@@ -0,0 +1,120 @@
+import argparse
+import json
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from VideoGrabber import VideoGrabber
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class LumaCache:
+    version = 1
+
+    # luma of every frame of a video, area averaged to width x height (height: aspect ratio of the video), in a npy
+    # file next to the video (frames x height x width, uint8). read memory-mapped, the downsampling is the compression:
+    # 128 x 72 is about 9 kB per frame. only valid as long as size and modification time of the video are unchanged
+    def __init__(self, videofile, width=128, height=None, cache_file=None):
+        self.__videofile = videofile
+        self.__width = width
+        self.__height = height
+        self.__cache_file = Path(cache_file) if cache_file is not None else None
+        self.__named = cache_file is not None
+        self.__info = None
+        self.__frames: Optional[np.ndarray] = None
+        if self.__cache_file is None and height is not None:
+            self.__cache_file = Path(f'{videofile}.luma_{width}x{height}.npy')
+        if self.__cache_file is None:
+            # height of an existing cache of this width
+            for cache_file in sorted(Path(videofile).parent.glob(f'{Path(videofile).name}.luma_{width}x*.npy')):
+                self.__cache_file = cache_file
+                break
+        if self.__cache_file is not None and self.__info_file().is_file():
+            self.__load()
+
+    def __info_file(self):
+        return Path(f'{self.__cache_file}.json')
+
+    def __file_stats(self):
+        stat = os.stat(self.__videofile)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def __load(self):
+        with open(self.__info_file()) as info_file:
+            info = json.load(info_file)
+        if info['version'] != self.version or info['file_stats'] != self.__file_stats() or \
+                not self.__cache_file.is_file():
+            logger.debug(f'outdated luma cache: {self.__cache_file}')
+            return
+        self.__info = info
+        self.__width, self.__height = info['width'], info['height']
+
+    def exists(self):
+        return self.__info is not None
+
+    def create(self, block_size=64):
+        vg = VideoGrabber(videofile=self.__videofile, silent=True, luma=True, index=True)
+        if self.__height is None:
+            self.__height = max(round(self.__width * vg.get_height() / vg.get_width()), 1)
+        if not self.__named:
+            self.__cache_file = Path(f'{self.__videofile}.luma_{self.__width}x{self.__height}.npy')
+        temporary_path = Path(f'{self.__cache_file}.tmp.npy')
+        frames = np.lib.format.open_memmap(temporary_path, mode='w+', dtype=np.uint8,
+                                           shape=(vg.total_frames(), self.__height, self.__width))
+        size = (self.__width, self.__height)
+        vg.first_frame(callback=lambda frame_nr, frame: cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY), size,
+                                                                   dst=frames[0], interpolation=cv2.INTER_AREA))
+        count = 1
+        for frame_nr, block in vg.frames(block_size=block_size):
+            for frame in block:
+                cv2.resize(frame, size, dst=frames[count], interpolation=cv2.INTER_AREA)
+                count += 1
+        frames.flush()
+        del frames
+        os.replace(temporary_path, self.__cache_file)
+        self.__info = {'version': self.version, 'file_stats': self.__file_stats(), 'width': self.__width,
+                       'height': self.__height, 'frames': count, 'fps': vg.get_fps(),
+                       'source_width': vg.get_width(), 'source_height': vg.get_height()}
+        with open(self.__info_file(), 'w') as info_file:
+            json.dump(self.__info, info_file)
+        self.__frames = None
+        logger.debug(f'luma cache: {count} frames, {self.__width}x{self.__height}, {self.__cache_file}')
+
+    def frames(self) -> np.ndarray:
+        # frames x height x width, memory-mapped (read only)
+        if self.__frames is None:
+            self.__frames = np.load(self.__cache_file, mmap_mode='r')[:self.__info['frames']]
+        return self.__frames
+
+    def total_frames(self):
+        return self.__info['frames']
+
+    def fps(self):
+        return self.__info['fps']
+
+    def get_width(self):
+        return self.__width
+
+    def get_height(self):
+        return self.__height
+
+    def source_size(self):
+        return self.__info['source_width'], self.__info['source_height']
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("video_files", nargs='+', help="video files to cache")
+    argparser.add_argument("-W", "--width", type=int, default=128, help="width of the cached frames, default: 128")
+    argparser.add_argument("-f", "--force", action="store_true", help="recreate existing caches")
+    args = argparser.parse_args()
+
+    for video_file in args.video_files:
+        cache = LumaCache(video_file, width=args.width)
+        if args.force or not cache.exists():
+            cache.create()
+        logger.info(f'{video_file}: {cache.total_frames()} frames, {cache.get_width()}x{cache.get_height()}')
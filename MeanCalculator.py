@@ -1,6 +1,6 @@
-import cv2
 from base_functions import *
 import numpy as np
+from VideoGrabber import to_gray
 
 from persistence.DatasetVideoMean import DatasetVideoMean
 
@@ -16,7 +16,7 @@ class MeanCalculator:
         self.mean = []
 
     def process_first_frame(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = to_gray(frame)
         if self.lightness_threshold is not None:
             if np.max(gray) < self.lightness_threshold:
                 logger.warning(
@@ -32,7 +32,7 @@ class MeanCalculator:
             self.mean.append(np.mean(gray))
 
     def process(self, frame):
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        gray = to_gray(frame)
         if self.lightness_threshold is not None:
             self.mean.append(gray[gray > self.lightness_threshold].mean())
         else:
@@ -1,7 +1,12 @@
-import cv2
+from typing import Optional
+
 import numpy as np
+from scipy.sparse import csr_matrix
 
 from base_functions import *
+from SuperpixelIntensityStore import SuperpixelIntensityStore
+from SuperpixelSegmentationCache import SuperpixelSegmentationCache
+from VideoGrabber import to_gray
 from persistence.DatasetVideoSuperpixel import DatasetVideoSuperpixel
 
 logger = logging.getLogger(__name__)
@@ -10,40 +15,71 @@ logger.setLevel(LOGGER_LEVEL)
 
 class MeanMedianSuperpixelCalculator:
 
-    def __init__(self, threshold=None, mode='mean', ds_video_sp: DatasetVideoSuperpixel = None):
+    # median: calculate the median per superpixel and frame too, always done for mode 'median'. select_all: the
+    # intensities of all superpixel are calculated, superpixel below the threshold are only disabled
+    def __init__(self, threshold=None, mode='mean', ds_video_sp: DatasetVideoSuperpixel = None, median=False,
+                 select_all=False):
         self.__threshold = threshold
+        self.__select_all = select_all
+        self.__bright_superpixels = []
+        self.__first_frame_mean: np.ndarray = None
+        self.__first_frame_median: np.ndarray = None
+        self.__luminance_median = None
+        self.__luminance_max = None
         self.__ds_video_sp = ds_video_sp
         self.__mode = mode
+        self.__median = median or mode == 'median'
         self.__selected_superpixels = []
-        self.__pixel_locations = {}
+        self.__mean_operator: csr_matrix = None
+        self.__histogram_offsets: np.ndarray = None
+        self.__label_count = 0
         self.__current_frame = 0
         self.__superpixel_indices = None
         self.__superpixel_regions_mean: np.ndarray = None
         self.__superpixel_regions_median: np.ndarray = None
+        self.__store: Optional[SuperpixelIntensityStore] = None
 
     def get_disabled_superpixels(self):
         disabled_superpixels = []
         for i in self.__superpixel_indices:
-            if i not in self.__selected_superpixels:
+            if i not in self.__bright_superpixels:
                 disabled_superpixels.append(i)
         return disabled_superpixels
 
-    def initialize(self, segmented_superpixel, total_nr_frames):
+    # store: the means of the selected superpixel are written incrementally instead of being kept in memory.
+    # segmentation: cached pixel counts and pixel index of segmented_superpixel, the operator isn't sorted again
+    def initialize(self, segmented_superpixel, total_nr_frames, store: SuperpixelIntensityStore = None,
+                   segmentation: SuperpixelSegmentationCache = None):
         segmented_superpixel_1d = np.reshape(segmented_superpixel, -1)
-        self.__superpixel_indices = np.unique(segmented_superpixel_1d)
-        for i in self.__superpixel_indices:
-            self.__pixel_locations[i] = np.where(segmented_superpixel_1d == i)[0]
-        self.__superpixel_regions_mean = np.zeros(shape=(len(self.__superpixel_indices) + 1, total_nr_frames),
-                                                  dtype=np.float16)
-        self.__superpixel_regions_median = np.zeros(shape=(len(self.__superpixel_indices) + 1, total_nr_frames),
-                                                    dtype=np.float16)
+        # label -> pixel operator: one row per label with 1 / pixel count at the pixels of the superpixel
+        labels = segmented_superpixel_1d.astype(np.intp)
+        if segmentation is not None:
+            pixel_count = segmentation.pixel_counts()
+            self.__superpixel_indices = np.flatnonzero(pixel_count)
+            self.__mean_operator = csr_matrix((np.repeat(1. / np.maximum(pixel_count, 1), pixel_count),
+                                               segmentation.pixel_index(), segmentation.pixel_offsets()),
+                                              shape=(pixel_count.size, labels.size), dtype=np.float32)
+        else:
+            pixel_count = np.bincount(labels)
+            self.__superpixel_indices = np.unique(segmented_superpixel_1d)
+            self.__mean_operator = csr_matrix((1. / pixel_count[labels], (labels, np.arange(labels.size))),
+                                              shape=(pixel_count.size, labels.size), dtype=np.float32)
+        # bin of (label, luminance) in the 256 bin luminance histograms of all labels
+        self.__label_count = pixel_count.size
+        self.__histogram_offsets = labels * 256
+        self.__store = store
+        if store is None:
+            self.__superpixel_regions_mean = np.zeros(shape=(len(self.__superpixel_indices) + 1, total_nr_frames),
+                                                      dtype=np.float16)
+        if self.__median:
+            self.__superpixel_regions_median = np.zeros(shape=(len(self.__superpixel_indices) + 1, total_nr_frames),
+                                                        dtype=np.float16)
 
     def get_threshold(self):
         return self.__threshold
 
     def first_frame(self, frame):
-        g = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        luminance = g.flatten()
+        luminance = to_gray(frame).flatten()
         if self.__threshold is None:
             self.__threshold = int(np.median(luminance))  # int(np.median(luminance) / 3)
         elif np.max(luminance) < self.__threshold:
@@ -55,34 +91,123 @@ class MeanMedianSuperpixelCalculator:
                 self.__ds_video_sp.lightness_threshold = self.__threshold
                 self.__ds_video_sp.hint = f"{self.__ds_video_sp}, auto threshold"
         logger.debug(f"using threshold {self.__threshold}")
+        mean_intensities = self.__exact_mean_intensities(luminance)
+        median_intensities = self.median_intensities(luminance)
+        self.__first_frame_mean = mean_intensities
+        self.__first_frame_median = median_intensities
+        if self.__select_all:
+            self.__luminance_median = int(np.median(luminance))
+            self.__luminance_max = int(np.max(luminance))
         for i in self.__superpixel_indices:
-            superpixel_mean_intensity = np.mean(luminance[self.__pixel_locations[i]])
-            superpixel_median_intensity = np.median(luminance[self.__pixel_locations[i]])
-            if self.__mode == 'mean':
-                if superpixel_mean_intensity > self.__threshold:
-                    self.__add_mean_median(i, superpixel_mean_intensity, superpixel_median_intensity)
-                    self.__selected_superpixels.append(i)
-            else:
-                if superpixel_median_intensity > self.__threshold:
-                    self.__add_mean_median(i, superpixel_mean_intensity, superpixel_median_intensity)
-                    self.__selected_superpixels.append(i)
+            superpixel_mean_intensity = mean_intensities[i]
+            superpixel_median_intensity = median_intensities[i]
+            intensity = superpixel_mean_intensity if self.__mode == 'mean' else superpixel_median_intensity
+            if intensity > self.__threshold:
+                self.__bright_superpixels.append(i)
+            if intensity > self.__threshold or self.__select_all:
+                self.__add_mean_median(i, superpixel_mean_intensity, superpixel_median_intensity)
+                self.__selected_superpixels.append(i)
+        if self.__store is not None:
+            self.__store.create(self.__selected_superpixels)
+            self.__store.append(mean_intensities[self.__selected_superpixels])
         self.__current_frame += 1
 
     def next_frame(self, frame):
-        g = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        luminance = g.flatten()
-        for i in self.__selected_superpixels:
-            superpixel_mean_intensity = np.mean(luminance[self.__pixel_locations[i]])
-            superpixel_median_intensity = np.median(luminance[self.__pixel_locations[i]])
-            self.__add_mean_median(i, superpixel_mean_intensity, superpixel_median_intensity)
+        luminance = to_gray(frame).flatten()
+        self.__add_means(self.mean_intensities(luminance)[self.__selected_superpixels], self.__current_frame)
+        if self.__median:
+            self.__superpixel_regions_median[self.__selected_superpixels, self.__current_frame] = \
+                self.median_intensities(luminance)[self.__selected_superpixels]
         self.__current_frame += 1
 
+    def next_frames(self, frames):
+        # block of frames, the means of all superpixels are calculated in one sparse matrix product
+        if isinstance(frames, np.ndarray) and frames.ndim == 3:
+            luminance = frames.reshape(frames.shape[0], -1)
+        else:
+            luminance = np.stack([to_gray(frame).reshape(-1) for frame in frames])
+        columns = slice(self.__current_frame, self.__current_frame + luminance.shape[0])
+        self.__add_means(self.mean_intensities(luminance)[self.__selected_superpixels], columns)
+        if self.__median:
+            self.__superpixel_regions_median[self.__selected_superpixels, columns] = \
+                np.stack([self.median_intensities(frame_luminance) for frame_luminance in luminance],
+                         axis=1)[self.__selected_superpixels]
+        self.__current_frame += luminance.shape[0]
+
+    def get_selected_superpixels(self):
+        return self.__selected_superpixels
+
+    def get_first_frame_intensities(self):
+        # mean and median luminance per label (index = label), median and maximum of all pixels of the first frame
+        # (only with select_all)
+        return self.__first_frame_mean, self.__first_frame_median, self.__luminance_median, self.__luminance_max
+
+    def select_superpixels(self, selected_superpixels):
+        # instead of the first frame: superpixel selected by another calculator, e.g. of a video processed in segments
+        self.__selected_superpixels = list(selected_superpixels)
+        if self.__store is not None:
+            self.__store.create(self.__selected_superpixels)
+
+    def append_means(self, mean_intensities):
+        # means of the selected superpixel (rows) of the following frames (columns), e.g. of a segment of the video
+        mean_intensities = np.asarray(mean_intensities).reshape(len(self.__selected_superpixels), -1)
+        columns = slice(self.__current_frame, self.__current_frame + mean_intensities.shape[1])
+        self.__add_means(mean_intensities, columns)
+        self.__current_frame += mean_intensities.shape[1]
+
+    def mean_intensities(self, luminance) -> np.ndarray:
+        # mean per label (index = label) of a frame (pixels) or of a block of frames
+        # (frames x pixels -> labels x frames)
+        if luminance.ndim == 1:
+            return self.__mean_operator @ luminance
+        return self.__mean_operator @ np.ascontiguousarray(luminance.T, dtype=np.float32)
+
+    def __exact_mean_intensities(self, luminance) -> np.ndarray:
+        # float64 means per label like np.mean for the threshold of the first frame, the float32 operator can select
+        # superpixel with a mean equal to the threshold
+        histograms = self.histograms(luminance)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return histograms @ np.arange(256) / histograms.sum(axis=1)
+
+    def histograms(self, luminance) -> np.ndarray:
+        # 256 bin luminance histogram per label (labels x 256) of a frame in one pass over the pixels
+        return np.bincount(self.__histogram_offsets + luminance, minlength=self.__label_count * 256).reshape(-1, 256)
+
+    def quantile_intensities(self, luminance, q) -> np.ndarray:
+        # quantile per label from the cumulative histograms, interpolated like np.quantile. nan for empty labels
+        cumulative = np.cumsum(self.histograms(luminance), axis=1)
+        count = cumulative[:, -1]
+        position = (count - 1) * q
+        lower = np.floor(position)
+        # the k-th smallest value (0-based) is the first bin whose cumulative count exceeds k
+        lower_value = np.sum(cumulative <= lower[:, None], axis=1)
+        upper_value = np.sum(cumulative <= np.minimum(lower + 1, count - 1)[:, None], axis=1)
+        result = lower_value + (position - lower) * (upper_value - lower_value)
+        result[count == 0] = np.nan
+        return result
+
+    def median_intensities(self, luminance) -> np.ndarray:
+        return self.quantile_intensities(luminance, .5)
+
+    def __add_means(self, mean_intensities, columns):
+        if self.__store is not None:
+            self.__store.append(mean_intensities)
+        else:
+            self.__superpixel_regions_mean[self.__selected_superpixels, columns] = mean_intensities
+
     def __add_mean_median(self, i, superpixel_mean_intensity, superpixel_median_intensity):
-        self.__superpixel_regions_mean[(i, self.__current_frame)] = superpixel_mean_intensity
-        self.__superpixel_regions_median[(i, self.__current_frame)] = superpixel_median_intensity
+        if self.__store is None:
+            self.__superpixel_regions_mean[(i, self.__current_frame)] = superpixel_mean_intensity
+        if self.__median:
+            self.__superpixel_regions_median[(i, self.__current_frame)] = superpixel_median_intensity
 
     def get_median_per_superpixel(self, superpixel_indices):
+        if not self.__median:
+            logger.warning("median per superpixel wasn't calculated")
+            return None
         return self.__superpixel_regions_median[np.add(np.where(superpixel_indices), 1)[0]]
 
     def get_mean_per_superpixel(self, superpixel_indices):
+        if self.__store is not None:
+            return self.__store.read(labels=np.add(np.where(superpixel_indices), 1)[0])
         return self.__superpixel_regions_mean[np.add(np.where(superpixel_indices), 1)[0]]
@@ -7,18 +7,59 @@ from skimage.segmentation import mark_boundaries
 import threading
 import logging
 
+from BackgroundSubtractorRunningAverage import BackgroundSubtractorRunningAverage
+from SuperpixelSegmentationCache import SuperpixelSegmentationCache
 from persistence.DatasetVideoSuperpixel import DatasetVideoSuperpixel
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOGGER_LEVEL)
 
 
+# pixel based motion detection methods, 'variance' (MotionDetectorSuperpixelVariance) uses the superpixel means
+MOTION_DETECTION_METHODS = ['gsoc', 'mog2', 'difference', 'variance']
+
+
+def create_background_subtractor(method='gsoc'):
+    # all provide apply(frame) -> motion mask (0 / 255)
+    if method == 'gsoc':
+        return cv2.bgsegm.createBackgroundSubtractorGSOC(beta=.03, alpha=.05, replaceRate=.01)
+    if method == 'mog2':
+        return cv2.createBackgroundSubtractorMOG2(detectShadows=False)
+    if method == 'difference':
+        return BackgroundSubtractorRunningAverage()
+    raise ValueError(f"unknown background subtraction method: {method}")
+
+
+def label_contour_mask(labels):
+    # 255 at pixels whose right or lower neighbour belongs to another superpixel
+    contour_mask = np.zeros(labels.shape, dtype=np.uint8)
+    contour_mask[:, :-1][labels[:, :-1] != labels[:, 1:]] = 255
+    contour_mask[:-1][labels[:-1] != labels[1:]] = 255
+    return contour_mask
+
+
 class MotionDetectorGSOC:
 
+    # motion_scale: the background subtraction runs on frames downscaled by this factor, with the superpixel labels
+    # resampled to this size. motion_stride: only every motion_stride-th frame is used for motion detection.
+    # method: background subtraction of create_background_subtractor. segmentation_scale: LSC runs on the first frame
+    # downscaled by this factor with the region size scaled accordingly (same number of superpixel), the labels are
+    # upsampled to the frame size
     # TODO: remove DatasetVideoSuperpixel
     def __init__(self, show_background=True, show_motion_free_image=False, motion_threshold_factor=.3,
-                 dataset_video: DatasetVideoSuperpixel = None):
+                 dataset_video: DatasetVideoSuperpixel = None, motion_scale=1, motion_stride=1, method='gsoc',
+                 segmentation_scale=1):
         self.__dataset_video = dataset_video
+        self.__segmentation_scale = max(int(segmentation_scale), 1)
+        self.__motion_scale = max(int(motion_scale), 1)
+        self.__motion_stride = max(int(motion_stride), 1)
+        self.__motion_size = None
+        self.__motion_labels = None
+        self.__motion_fraction = None
+        self.__motion_trace = None
+        self.__motion_trace_frames = None
+        self.__motion_trace_offset = 0
+        self.__frame_nr = 0
         self.__region_size = 20
         self.__first_frame = None
         self.__segmented_superpixel = None
@@ -32,7 +73,7 @@ class MotionDetectorGSOC:
         self.__stop = False
         self.__blur = (5, 5)
         self.__contour_mask = None
-        self.__bgSubtractor = cv2.bgsegm.createBackgroundSubtractorGSOC(beta=.03, alpha=.05, replaceRate=.01)
+        self.__bgSubtractor = create_background_subtractor(method)
         self.__show_background = show_background
         self.__show_motion_free_image = show_motion_free_image
         self.__motion_threshold_factor = motion_threshold_factor
@@ -47,17 +88,37 @@ class MotionDetectorGSOC:
     def superpixel_ids(self):
         return self.__superpixels_indices
 
-    def first_frame(self, frame):
+    # segmented_superpixel: segmentation (labels starting at 1) of another motion detector, e.g. of the first frame
+    # of a video processed in segments. the segmentation of this frame is skipped. segmentation_cache: the
+    # segmentation is loaded from the cache or saved to it. frame_nr: number of the frame relative to the first frame
+    # of the video (segments). motion_trace_frames: the largest fraction of pixels with motion per superpixel is
+    # recorded per window of this number of frames
+    def first_frame(self, frame, segmented_superpixel=None, segmentation_cache: SuperpixelSegmentationCache = None,
+                    frame_nr=0, motion_trace_frames=None):
         self.__first_frame = frame
-        self.__bgSubtractor.apply(cv2.GaussianBlur(frame, self.__blur, 0))
+        self.__frame_nr = frame_nr
+        self.__motion_trace_frames = motion_trace_frames
+        self.__motion_trace = [] if motion_trace_frames else None
+        self.__motion_trace_offset = frame_nr // motion_trace_frames if motion_trace_frames else 0
+        self.__motion_size = (max(frame.shape[1] // self.__motion_scale, 1),
+                              max(frame.shape[0] // self.__motion_scale, 1))
+        self.__bgSubtractor.apply(self.__motion_frame(frame))
         self.__region_size = int(min(frame.shape[0], frame.shape[1]) / self.__superpixel_size_denominator)
-        frame_lab = cv2.cvtColor(frame, cv2.COLOR_BGR2Lab)
-        blurred_frame = cv2.GaussianBlur(frame_lab, self.__blur, 0)
-        sp: cv2.ximgproc_SuperpixelLSC = cv2.ximgproc.createSuperpixelLSC(blurred_frame, region_size=self.__region_size,
-                                                                          ratio=self.__slic_ratio)  # , ratio=.04
-        sp.iterate(10)
-        self.__number_of_superpixels = sp.getNumberOfSuperpixels()
-        self.__contour_mask = sp.getLabelContourMask()
+        if segmented_superpixel is None and segmentation_cache is not None and \
+                segmentation_cache.load(frame.shape, self.__region_size, self.__slic_ratio, self.__blur,
+                                        self.__segmentation_scale):
+            labels = np.subtract(segmentation_cache.labels(), 1)
+            self.__number_of_superpixels = segmentation_cache.pixel_counts().size - 1
+            self.__contour_mask = segmentation_cache.contour_mask()
+        elif segmented_superpixel is None:
+            labels = self.__segment(frame)
+            if segmentation_cache is not None:
+                segmentation_cache.save(np.add(labels, 1), self.__contour_mask, self.__region_size, self.__slic_ratio,
+                                        self.__blur, self.__segmentation_scale)
+        else:
+            labels = np.subtract(segmented_superpixel, 1)
+            self.__number_of_superpixels = int(labels.max()) + 1
+            self.__contour_mask = label_contour_mask(labels)
         logger.info(
             f'# superpixel: {self.__number_of_superpixels}, region-size: {self.__region_size}, motion_threshold: {self.__motion_threshold_factor}')
         if self.__dataset_video is not None:
@@ -65,29 +126,100 @@ class MotionDetectorGSOC:
             self.__dataset_video.region_size = self.__region_size
             self.__dataset_video.motion_threshold = self.__motion_threshold_factor
         # add 1 to prevent zero based index
-        self.__segmented_superpixel = np.add(sp.getLabels(), 1)
-        self.__superpixels_indices = np.unique(self.__segmented_superpixel).tolist()
+        self.__segmented_superpixel = np.add(labels, 1)
+        # labels of the cache with pixels, as np.unique of the labels
+        self.__superpixels_indices = np.flatnonzero(segmentation_cache.pixel_counts()).tolist() \
+            if segmentation_cache is not None and segmented_superpixel is None else \
+            np.unique(self.__segmented_superpixel).tolist()
         self.__superpixels_indices_without_motion = np.ones(len(self.__superpixels_indices))
-        self.__total_pixel_per_superpixel = np.bincount(self.__segmented_superpixel.flatten(),
-                                                        minlength=self.__number_of_superpixels + 1)
+        # labels of the pixels of the motion mask, superpixel smaller than the motion scale can vanish
+        self.__motion_labels = self.__segmented_superpixel if self.__motion_scale == 1 else \
+            cv2.resize(self.__segmented_superpixel.astype(np.int32), self.__motion_size,
+                       interpolation=cv2.INTER_NEAREST)
+        self.__total_pixel_per_superpixel = segmentation_cache.pixel_counts() \
+            if segmentation_cache is not None and segmented_superpixel is None and self.__motion_scale == 1 else \
+            np.bincount(self.__motion_labels.reshape(-1), minlength=self.__number_of_superpixels + 1)
+        # largest fraction of pixels with motion per superpixel (index = label - 1) of all frames so far
+        self.__motion_fraction = np.zeros(self.__number_of_superpixels)
         if self.__show_motion_free_image:
             threading.Thread(target=self.__calc_motionless_image).start()
 
+    def __segment(self, frame):
+        # LSC labels (starting at 0) of the frame, sets number of superpixel and contour mask
+        # the frame is scaled by region_size / self.__region_size, the grid of superpixel stays the same
+        region_size = max(round(self.__region_size / self.__segmentation_scale), 2)
+        scale = self.__region_size / region_size
+        segmentation_frame = frame if self.__segmentation_scale == 1 else \
+            cv2.resize(frame, (max(round(frame.shape[1] / scale), 1), max(round(frame.shape[0] / scale), 1)),
+                       interpolation=cv2.INTER_AREA)
+        frame_lab = cv2.cvtColor(segmentation_frame, cv2.COLOR_BGR2Lab)
+        blurred_frame = cv2.GaussianBlur(frame_lab, self.__blur, 0)
+        sp: cv2.ximgproc_SuperpixelLSC = cv2.ximgproc.createSuperpixelLSC(blurred_frame, region_size=region_size,
+                                                                          ratio=self.__slic_ratio)  # , ratio=.04
+        sp.iterate(10)
+        self.__number_of_superpixels = sp.getNumberOfSuperpixels()
+        if self.__segmentation_scale == 1:
+            self.__contour_mask = sp.getLabelContourMask()
+            return sp.getLabels()
+        # every low resolution pixel covers at least one pixel of the frame, no superpixel vanishes
+        labels = cv2.resize(sp.getLabels(), (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_NEAREST)
+        self.__contour_mask = label_contour_mask(labels)
+        return labels
+
+    def __motion_frame(self, frame):
+        if self.__motion_scale > 1:
+            frame = cv2.resize(frame, self.__motion_size, interpolation=cv2.INTER_AREA)
+        return cv2.GaussianBlur(frame, self.__blur, 0)
+
     def next_frame(self, frame):
-        motion_mask = self.__bgSubtractor.apply(cv2.GaussianBlur(frame, self.__blur, 0))
+        self.__frame_nr += 1
+        # a new window of the motion trace starts with this frame (or the first frame of a segment)
+        if self.__motion_trace is not None and self.__motion_trace_offset + len(self.__motion_trace) <= \
+                (self.__frame_nr - 1) // self.__motion_trace_frames:
+            self.__motion_trace.append(np.zeros(self.__number_of_superpixels, dtype=np.float32))
+        if self.__frame_nr % self.__motion_stride != 0:
+            return
+        motion_mask = self.__bgSubtractor.apply(self.__motion_frame(frame))
         if self.__show_background:
-            cv2.imshow("bg", mark_boundaries(motion_mask, self.__segmented_superpixel))
+            cv2.imshow("bg", mark_boundaries(motion_mask, self.__motion_labels))
             if cv2.waitKey(12) == ord('q'):
                 self.__stop = True
                 exit()
-        if 255 in motion_mask:
-            superpixel_motion_mask = np.logical_and(motion_mask, self.__segmented_superpixel)
-            affected_superpixel = self.__segmented_superpixel[superpixel_motion_mask]
-            affected_pixel = np.bincount(affected_superpixel, minlength=self.__number_of_superpixels + 1)
-            affected_pixel_percent = np.divide(affected_pixel[1:], self.__total_pixel_per_superpixel[1:])
-            superpixel_with_motion = np.where(affected_pixel_percent > self.__motion_threshold_factor)[0]
+        if cv2.countNonZero(motion_mask) > 0:
+            affected_pixel = np.bincount(self.__motion_labels[motion_mask != 0],
+                                         minlength=self.__number_of_superpixels + 1)
+            total_pixel = self.__total_pixel_per_superpixel[1:]
+            affected_pixel_percent = np.divide(affected_pixel[1:], total_pixel, out=np.zeros(total_pixel.size),
+                                               where=total_pixel > 0)
+            np.maximum(self.__motion_fraction, affected_pixel_percent, out=self.__motion_fraction)
+            if self.__motion_trace is not None:
+                np.maximum(self.__motion_trace[-1], affected_pixel_percent, out=self.__motion_trace[-1])
+            superpixel_with_motion = np.flatnonzero(affected_pixel_percent > self.__motion_threshold_factor)
             self.__superpixels_indices_without_motion[superpixel_with_motion] = False
 
+    def get_motion_fraction(self):
+        return self.__motion_fraction
+
+    def get_motion_trace(self) -> np.ndarray:
+        # largest fraction of pixels with motion per superpixel (rows, index = label - 1) and window (columns) from the
+        # first window of the video, windows before the first frame (segments) are 0
+        if self.__motion_trace is None:
+            return None
+        trace = np.zeros((self.__number_of_superpixels, self.__motion_trace_offset + len(self.__motion_trace)),
+                         dtype=np.float32)
+        if self.__motion_trace:
+            trace[:, self.__motion_trace_offset:] = np.stack(self.__motion_trace, axis=1)
+        return trace
+
+    def merge_motion_trace(self, motion_trace):
+        # motion trace of a segment of the video, the window at the border of two segments is in both
+        trace = self.get_motion_trace()
+        merged = np.zeros((trace.shape[0], max(trace.shape[1], motion_trace.shape[1])), dtype=np.float32)
+        merged[:, :trace.shape[1]] = trace
+        np.maximum(merged[:, :motion_trace.shape[1]], motion_trace, out=merged[:, :motion_trace.shape[1]])
+        self.__motion_trace = list(merged.T)
+        self.__motion_trace_offset = 0
+
     def __calc_motionless_image(self):
         while True and not self.__stop:
             if self.__queue.empty():
@@ -141,6 +273,11 @@ class MotionDetectorGSOC:
             except queue.Empty:
                 pass
 
+    def merge_steady_superpixel(self, steady_superpixel):
+        # superpixel with motion in any segment of a video are not steady
+        self.__superpixels_indices_without_motion = np.minimum(self.__superpixels_indices_without_motion,
+                                                               steady_superpixel)
+
     def get_steady_superpixel_indices(self):
         return self.__superpixels_indices_without_motion
 
@@ -0,0 +1,37 @@
+import numpy as np
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class MotionDetectorSuperpixelVariance:
+
+    # motion from the means per superpixel (rows) and frame (columns) of MeanMedianSuperpixelCalculator, no pixels
+    # are processed. a change of the mean between two frames is motion if it is larger than sigma_factor times the
+    # robust standard deviation (median absolute change) of the superpixel and larger than relative_threshold of its
+    # level. the flicker of the light changes the means in every frame, motion only in a few
+    def __init__(self, sigma_factor=6., relative_threshold=.05, motion_threshold_factor=0., rows_per_block=64):
+        self.__sigma_factor = sigma_factor
+        self.__relative_threshold = relative_threshold
+        self.__motion_threshold_factor = motion_threshold_factor
+        self.__rows_per_block = rows_per_block
+
+    def motion_fraction(self, mean_per_superpixel) -> np.ndarray:
+        # fraction of the frames with motion per superpixel
+        result = np.zeros(len(mean_per_superpixel))
+        for start in range(0, len(mean_per_superpixel), self.__rows_per_block):
+            means = np.asarray(mean_per_superpixel[start:start + self.__rows_per_block], dtype=np.float32)
+            if means.shape[1] < 2:
+                break
+            change = np.abs(np.diff(means, axis=1))
+            sigma = 1.4826 * np.median(change, axis=1, keepdims=True)
+            level = np.median(means, axis=1, keepdims=True)
+            threshold = np.maximum(self.__sigma_factor * sigma, self.__relative_threshold * level)
+            result[start:start + len(means)] = np.mean(change > threshold, axis=1)
+        return result
+
+    def steady_superpixel(self, mean_per_superpixel) -> np.ndarray:
+        # superpixel with motion in at most motion_threshold_factor of the frames
+        return self.motion_fraction(mean_per_superpixel) <= self.__motion_threshold_factor
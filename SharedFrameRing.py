@@ -0,0 +1,90 @@
+import multiprocessing
+from multiprocessing.shared_memory import SharedMemory
+from typing import Optional, Tuple
+
+import numpy as np
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class SharedFrameRing:
+
+    # ring of frames in shared memory, written in order by one producer and read in order by every consumer. frame
+    # number sequence is in slot sequence % slots, the slot is written again once all consumers released it
+    # (back-pressure). processes get the ring as argument at start, the frames aren't pickled
+    def __init__(self, shape, slots=8, consumers=1, dtype=np.uint8):
+        self.__shape = tuple(shape)
+        self.__slots = slots
+        self.__consumers = consumers
+        self.__dtype = np.dtype(dtype)
+        self.__memory = SharedMemory(create=True, size=max(slots * int(np.prod(self.__shape)) * self.__dtype.itemsize,
+                                                           1))
+        # sequence of the frame in each slot, frames written, finished flag
+        self.__sequences = multiprocessing.Array('q', [-1] * slots + [0, 0], lock=False)
+        self.__free = [multiprocessing.Semaphore(slots) for _ in range(consumers)]
+        self.__filled = [multiprocessing.Semaphore(0) for _ in range(consumers)]
+        self.__read = [0] * consumers
+        self.__frames: Optional[np.ndarray] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_SharedFrameRing__frames'] = None
+        return state
+
+    def frames(self) -> np.ndarray:
+        if self.__frames is None:
+            self.__frames = np.ndarray((self.__slots,) + self.__shape, dtype=self.__dtype, buffer=self.__memory.buf)
+        return self.__frames
+
+    def written(self):
+        return self.__sequences[self.__slots]
+
+    def next_slot(self) -> np.ndarray:
+        # producer: the slot of the next frame, blocks until every consumer released it
+        for free in self.__free:
+            free.acquire()
+        return self.frames()[self.written() % self.__slots]
+
+    def commit(self):
+        # producer: the frame in the slot of next_slot is complete
+        sequence = self.written()
+        self.__sequences[sequence % self.__slots] = sequence
+        self.__sequences[self.__slots] = sequence + 1
+        for filled in self.__filled:
+            filled.release()
+
+    def finish(self):
+        self.__sequences[self.__slots + 1] = 1
+        for filled in self.__filled:
+            filled.release()
+
+    def get(self, consumer, max_count=1) -> Optional[Tuple[int, np.ndarray]]:
+        # consumer: (sequence of the first frame, up to max_count frames without wrapping around the ring) or None
+        # after the last frame. the frames are valid until release
+        self.__filled[consumer].acquire()
+        sequence = self.__read[consumer]
+        if sequence >= self.written():
+            return None
+        count = 1
+        while count < max_count and (sequence + count) % self.__slots != 0 and sequence + count < self.written() and \
+                self.__filled[consumer].acquire(block=False):
+            count += 1
+        slot = sequence % self.__slots
+        if self.__sequences[slot] != sequence:
+            raise RuntimeError(f'frame {sequence} was overwritten in slot {slot}')
+        return sequence, self.frames()[slot:slot + count]
+
+    def release(self, consumer, count=1):
+        self.__read[consumer] += count
+        for _ in range(count):
+            self.__free[consumer].release()
+
+    def close(self):
+        self.__frames = None
+        self.__memory.close()
+
+    def unlink(self):
+        self.__memory.unlink()
@@ -0,0 +1,194 @@
+import json
+from typing import Optional
+
+import numpy as np
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class SuperpixelIntensityStore:
+    index_filename = "index.json"
+    chunk_filename = "chunk_{:06d}.npy"
+    statistics_filename = "superpixel_statistics.npz"
+
+    # intensity per superpixel (rows, selected superpixel labels) and frame (columns). frames are appended and
+    # written in chunk files of chunk_frames columns, the index is updated after every chunk: after a crash all
+    # written chunks are still readable
+    def __init__(self, directory, chunk_frames=1800, dtype='float16'):
+        self.__directory = Path(directory)
+        self.__chunk_frames = chunk_frames
+        self.__dtype = dtype
+        self.__labels: Optional[np.ndarray] = None
+        self.__steady_labels: Optional[np.ndarray] = None
+        self.__frames = 0
+        self.__complete = False
+        self.__buffer: Optional[np.ndarray] = None
+        self.__buffered = 0
+        if self.exists():
+            self.__open()
+
+    def exists(self):
+        return (self.__directory / self.index_filename).is_file()
+
+    def __open(self):
+        with open(self.__directory / self.index_filename) as index_file:
+            index = json.load(index_file)
+        self.__labels = np.array(index['labels'], dtype=np.int64)
+        self.__steady_labels = np.array(index['steady_labels'], dtype=np.int64) \
+            if index['steady_labels'] is not None else None
+        self.__frames = index['frames']
+        self.__chunk_frames = index['chunk_frames']
+        self.__dtype = index['dtype']
+        self.__complete = index['complete']
+
+    def __save_index(self):
+        index = {'labels': self.__labels.tolist(), 'frames': self.__frames, 'chunk_frames': self.__chunk_frames,
+                 'dtype': self.__dtype, 'complete': self.__complete,
+                 'steady_labels': self.__steady_labels.tolist() if self.__steady_labels is not None else None}
+        temporary_path = self.__directory / f'{self.index_filename}.tmp'
+        with open(temporary_path, 'w') as index_file:
+            json.dump(index, index_file)
+        os.replace(temporary_path, self.__directory / self.index_filename)
+
+    def create(self, labels):
+        create_directories(self.__directory)
+        for chunk_file in self.__directory.glob(self.chunk_filename.replace('{:06d}', '*')):
+            chunk_file.unlink()
+        self.__labels = np.asarray(labels, dtype=np.int64)
+        self.__steady_labels = None
+        self.__frames = 0
+        self.__complete = False
+        self.__buffer = np.zeros((self.__labels.size, self.__chunk_frames), dtype=self.__dtype)
+        self.__buffered = 0
+        self.__save_index()
+
+    def get_labels(self):
+        return self.__labels
+
+    def get_steady_labels(self):
+        return self.__steady_labels
+
+    def frames(self):
+        return self.__frames
+
+    def is_complete(self):
+        return self.__complete
+
+    def append(self, values):
+        # values of all stored labels: one frame (rows) or a block of frames (rows x frames)
+        values = np.asarray(values)
+        if values.ndim != 2 or values.shape[0] != self.__labels.size:
+            values = values.reshape(self.__labels.size, -1)
+        position = 0
+        while position < values.shape[1]:
+            count = min(self.__chunk_frames - self.__buffered, values.shape[1] - position)
+            self.__buffer[:, self.__buffered:self.__buffered + count] = values[:, position:position + count]
+            self.__buffered += count
+            position += count
+            if self.__buffered == self.__chunk_frames:
+                self.__write_chunk()
+
+    def __write_chunk(self):
+        chunk = self.__frames // self.__chunk_frames
+        temporary_path = self.__directory / f'{self.chunk_filename.format(chunk)}.tmp.npy'
+        np.save(temporary_path, self.__buffer[:, :self.__buffered])
+        os.replace(temporary_path, self.__directory / self.chunk_filename.format(chunk))
+        self.__frames += self.__buffered
+        self.__buffered = 0
+        self.__save_index()
+
+    def close(self, steady_labels=None):
+        if self.__buffered > 0:
+            self.__write_chunk()
+        self.__buffer = None
+        self.__steady_labels = np.asarray(steady_labels, dtype=np.int64) if steady_labels is not None else None
+        self.__complete = True
+        self.__save_index()
+        logger.debug(f'superpixel intensities: {self.__labels.size} superpixel, {self.__frames} frames, '
+                     f'{self.__directory}')
+
+    def set_steady_labels(self, steady_labels):
+        self.__steady_labels = np.asarray(steady_labels, dtype=np.int64) if steady_labels is not None else None
+        self.__save_index()
+
+    def save_statistics(self, first_frame_mean, first_frame_median, luminance_median, luminance_max, motion_trace,
+                        motion_trace_frames):
+        # per stored label: luminance of the first frame (index = label) and largest fraction of pixels with motion
+        # per window of motion_trace_frames frames (index = label - 1, windows; None without motion detection).
+        # luminance_median, luminance_max: median (automatic lightness threshold) and maximum of the pixels of the
+        # first frame. thresholds can be applied afterwards with threshold_labels
+        motion_trace = np.asarray(motion_trace, dtype=np.float32)[self.__labels - 1] if motion_trace is not None \
+            else np.zeros((self.__labels.size, 0), dtype=np.float32)
+        np.savez_compressed(self.__directory / self.statistics_filename, labels=self.__labels,
+                            first_frame_mean=np.asarray(first_frame_mean)[self.__labels],
+                            first_frame_median=np.asarray(first_frame_median)[self.__labels],
+                            luminance_median=luminance_median, luminance_max=luminance_max, motion_trace=motion_trace,
+                            motion_trace_frames=motion_trace_frames or 0)
+
+    def has_statistics(self):
+        return (self.__directory / self.statistics_filename).is_file()
+
+    def has_motion_trace(self):
+        with np.load(self.__directory / self.statistics_filename) as statistics:
+            return statistics['motion_trace'].shape[1] > 0
+
+    def lightness_threshold(self, lightness_threshold=None):
+        # threshold applied by threshold_labels
+        with np.load(self.__directory / self.statistics_filename) as statistics:
+            return self.__lightness_threshold(statistics, lightness_threshold)
+
+    @staticmethod
+    def __lightness_threshold(statistics, lightness_threshold):
+        # without a threshold or with one above the brightest pixel, the median of the first frame is used like in
+        # MeanMedianSuperpixelCalculator
+        if lightness_threshold is None or lightness_threshold > statistics['luminance_max']:
+            return int(statistics['luminance_median'])
+        return lightness_threshold
+
+    def threshold_labels(self, lightness_threshold=None, motion_threshold_factor=None, mode='mean', start=None,
+                         end=None) -> np.ndarray:
+        # labels of the superpixel brighter than lightness_threshold in the first frame, see lightness_threshold.
+        # superpixel with more than motion_threshold_factor of their pixels moving in the windows start:end are
+        # dropped. motion_threshold_factor None: no motion detection
+        with np.load(self.__directory / self.statistics_filename) as statistics:
+            luminance = statistics['first_frame_mean' if mode == 'mean' else 'first_frame_median']
+            selected = luminance > self.__lightness_threshold(statistics, lightness_threshold)
+            if motion_threshold_factor is not None:
+                if statistics['motion_trace'].shape[1] == 0:
+                    raise ValueError(f"{self.__directory} has no motion trace, motion_threshold_factor "
+                                     f"{motion_threshold_factor} can't be applied")
+                # compared in float32 like stored, a fraction equal to the threshold isn't motion
+                motion = statistics['motion_trace'][:, start:end]
+                selected &= np.all(motion <= np.float32(motion_threshold_factor), axis=1)
+            return statistics['labels'][selected]
+
+    def export(self, directory, labels, steady_labels=None):
+        # new store with the rows of labels, copied chunk by chunk
+        store = SuperpixelIntensityStore(directory, chunk_frames=self.__chunk_frames, dtype=self.__dtype)
+        store.create(labels)
+        for start in range(0, self.__frames, self.__chunk_frames):
+            store.append(self.read(start, start + self.__chunk_frames, labels=labels))
+        store.close(steady_labels)
+        return store
+
+    def read(self, start=None, end=None, labels=None) -> np.ndarray:
+        # only the chunks of the frame range are read, by default the rows of the steady superpixel
+        labels = labels if labels is not None else self.__steady_labels if self.__steady_labels is not None \
+            else self.__labels
+        labels = np.asarray(labels, dtype=np.int64)
+        order = np.argsort(self.__labels)
+        rows = order[np.minimum(np.searchsorted(self.__labels, labels, sorter=order), self.__labels.size - 1)] \
+            if self.__labels.size > 0 else np.zeros(0, dtype=np.int64)
+        if rows.size != labels.size or not np.array_equal(self.__labels[rows], labels):
+            raise ValueError(f"labels not stored in {self.__directory}")
+        start, end, _ = slice(start, end).indices(self.__frames)
+        result = np.zeros((labels.size, max(end - start, 0)), dtype=self.__dtype)
+        for chunk in range(start // self.__chunk_frames, -(-end // self.__chunk_frames)):
+            chunk_start = chunk * self.__chunk_frames
+            data = np.load(self.__directory / self.chunk_filename.format(chunk), mmap_mode='r')
+            first, last = max(start, chunk_start), min(end, chunk_start + data.shape[1])
+            result[:, first - start:last - start] = data[rows, first - chunk_start:last - chunk_start]
+        return result
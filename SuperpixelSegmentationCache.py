@@ -0,0 +1,97 @@
+import hashlib
+import json
+from typing import Optional
+
+import numpy as np
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def video_content_hash(videofile, block_size=1 << 20):
+    # sha256 of the file size and of the first, middle and last block: reading a whole video would take longer than
+    # the segmentation it saves
+    size = os.path.getsize(videofile)
+    sha256 = hashlib.sha256(str(size).encode())
+    with open(videofile, 'rb') as file:
+        for position in sorted({0, max(size // 2 - block_size // 2, 0), max(size - block_size, 0)}):
+            file.seek(position)
+            sha256.update(file.read(block_size))
+    return sha256.hexdigest()
+
+
+class SuperpixelSegmentationCache:
+    version = 1
+
+    # superpixel segmentation of the first frame of a video, one compressed file per video content, start frame,
+    # frame transformation (roi, scale) and segmentation parameters. labels start at 1 (segmented superpixel),
+    # pixel_counts and the pixel index (pixel positions sorted by label, pixel_offsets[label] is the first position
+    # of the label) are indexed by label
+    def __init__(self, videofile, start_frame_nr=0, roi=None, scale=1, directory=None):
+        self.__videofile = videofile
+        self.__source = {'start_frame_nr': int(start_frame_nr), 'roi': list(roi) if roi is not None else None,
+                         'scale': int(scale)}
+        self.__directory = Path(directory if directory is not None else get_segmentation_cache_path())
+        self.__content_hash = None
+        self.__labels: Optional[np.ndarray] = None
+        self.__contour_mask: Optional[np.ndarray] = None
+        self.__pixel_counts: Optional[np.ndarray] = None
+        self.__pixel_index: Optional[np.ndarray] = None
+
+    def __file(self, shape, region_size, ratio, blur, segmentation_scale):
+        if self.__content_hash is None:
+            self.__content_hash = video_content_hash(self.__videofile)
+        key = dict(self.__source, version=self.version, content_hash=self.__content_hash, shape=list(shape[:2]),
+                   region_size=int(region_size), ratio=float(ratio), blur=list(blur),
+                   segmentation_scale=int(segmentation_scale))
+        return self.__directory / f'{hashlib.sha256(json.dumps(key, sort_keys=True).encode()).hexdigest()[:32]}.npz'
+
+    def load(self, shape, region_size, ratio, blur, segmentation_scale=1):
+        # True if the segmentation of these parameters was saved before
+        cache_file = self.__file(shape, region_size, ratio, blur, segmentation_scale)
+        if not cache_file.is_file():
+            return False
+        with np.load(cache_file) as cache:
+            shape = tuple(cache['shape'])
+            self.__labels = cache['labels'].reshape(shape).astype(np.int32)
+            self.__contour_mask = np.unpackbits(cache['contour_mask'], count=shape[0] * shape[1]).reshape(shape) * \
+                np.uint8(255)
+            self.__pixel_counts = cache['pixel_counts']
+            self.__pixel_index = np.cumsum(cache['pixel_index_delta'], dtype=np.int64)
+        logger.debug(f'segmentation from cache: {cache_file}')
+        return True
+
+    def save(self, segmented_superpixel, contour_mask, region_size, ratio, blur, segmentation_scale=1):
+        self.__labels = np.asarray(segmented_superpixel)
+        self.__contour_mask = np.asarray(contour_mask)
+        labels_1d = self.__labels.reshape(-1)
+        self.__pixel_counts = np.bincount(labels_1d)
+        self.__pixel_index = np.argsort(labels_1d, kind='stable')
+        cache_file = self.__file(self.__labels.shape, region_size, ratio, blur, segmentation_scale)
+        create_directories(self.__directory)
+        # the pixel positions of a label are mostly consecutive, the differences compress well
+        temporary_path = f'{cache_file}.tmp.npz'
+        np.savez_compressed(temporary_path, shape=np.array(self.__labels.shape),
+                            labels=labels_1d.astype(np.uint16 if self.__pixel_counts.size <= 1 << 16 else np.int32),
+                            contour_mask=np.packbits(self.__contour_mask.reshape(-1) != 0),
+                            pixel_counts=self.__pixel_counts,
+                            pixel_index_delta=np.diff(self.__pixel_index, prepend=0).astype(np.int32))
+        os.replace(temporary_path, cache_file)
+        logger.debug(f'segmentation saved: {cache_file}, {os.path.getsize(cache_file) / 1e6:.1f} MB')
+
+    def labels(self) -> np.ndarray:
+        return self.__labels
+
+    def contour_mask(self) -> np.ndarray:
+        return self.__contour_mask
+
+    def pixel_counts(self) -> np.ndarray:
+        return self.__pixel_counts
+
+    def pixel_index(self) -> np.ndarray:
+        return self.__pixel_index
+
+    def pixel_offsets(self) -> np.ndarray:
+        return np.concatenate(([0], np.cumsum(self.__pixel_counts)))
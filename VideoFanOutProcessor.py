@@ -0,0 +1,78 @@
+import argparse
+import time
+
+from ENFMeanVideoProcessor import ENFMeanVideoProcessor
+from ENFSuperpixelVideoProcessor import ENFSuperpixelVideoProcessor
+from VideoGrabber import VideoGrabber, to_gray
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class VideoFanOutProcessor:
+
+    # decodes a video once and dispatches every frame to the registered consumers (ENFMeanVideoProcessor,
+    # ENFSuperpixelVideoProcessor, ...). a consumer provides needs_colour(), start(video_file, vg),
+    # first_frame(frame_nr, frame, gray), next_frame(frame_nr, frame, gray) and finish().
+    # the conversion to gray happens once per frame for all consumers. luma: frames after the first one are decoded
+    # as Y plane only if no consumer needs colour (motion detection), see VideoGrabber
+    # roi (x, y, width, height) and scale (downscale factor) of the decoded frames apply to all consumers
+    def __init__(self, consumers=None, roi=None, scale=1, luma=False):
+        self.__consumers = list(consumers) if consumers is not None else []
+        self.__roi = roi
+        self.__scale = scale
+        self.__luma = luma
+
+    def register(self, consumer):
+        self.__consumers.append(consumer)
+        return consumer
+
+    def get_consumers(self):
+        return self.__consumers
+
+    def process_video(self, video_file, start_frame_nr=0, end_frame_nr=None):
+        # results of the consumers' finish(), in order of registration
+        if not self.__consumers:
+            logger.warning(f"no consumers registered, {video_file} isn't decoded")
+            return []
+        colour = any(consumer.needs_colour() for consumer in self.__consumers)
+        vg = VideoGrabber(videofile=video_file, start_frame_nr=start_frame_nr, end_frame=end_frame_nr,
+                          luma=self.__luma and not colour, roi=self.__roi, scale=self.__scale)
+        for consumer in self.__consumers:
+            consumer.start(video_file, vg)
+        vg.first_frame(callback=lambda frame_nr, frame: self.__dispatch(frame_nr, frame, first=True))
+        vg.grab(callback=self.__dispatch)
+        results = [consumer.finish() for consumer in self.__consumers]
+        logger.info(f"done: {vg.videofile()}, {len(self.__consumers)} consumers")
+        return results
+
+    def __dispatch(self, frame_nr, frame, first=False):
+        gray = to_gray(frame)
+        for consumer in self.__consumers:
+            if first:
+                consumer.first_frame(frame_nr, frame, gray)
+            else:
+                consumer.next_frame(frame_nr, frame, gray)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("video_file", help="video file")
+    argparser.add_argument("-d", "--data-dir", default="data", help="directory of the results, default: data")
+    argparser.add_argument("-t", "--lightness-threshold", type=int, default=None,
+                           help="lightness threshold of the mean and the superpixel, default: none")
+    argparser.add_argument("-md", "--motion-detection", action="store_true", help="superpixel with motion detection")
+    argparser.add_argument("-ld", "--luma-decoding", action="store_true",
+                           help="decode the Y plane only (without motion detection), faster, slightly different means")
+    args = argparser.parse_args()
+
+    start = time.perf_counter()
+    fan_out = VideoFanOutProcessor(luma=args.luma_decoding)
+    fan_out.register(ENFMeanVideoProcessor(Path(args.video_file).name, lightness_threshold=args.lightness_threshold,
+                                           data_dir=args.data_dir, save_images=False))
+    fan_out.register(ENFSuperpixelVideoProcessor(lightness_threshold=args.lightness_threshold,
+                                                 motion_detection=args.motion_detection, data_dir=args.data_dir,
+                                                 save_img=False))
+    fan_out.process_video(args.video_file)
+    logger.info(f'{args.video_file}: {time.perf_counter() - start:.2f} s')
@@ -1,43 +1,100 @@
+import queue
+import threading
 from pathlib import Path
+from typing import Optional
 
 import cv2
+import numpy as np
 
+from VideoIndex import VideoIndex
 from base_functions import *
 from persistence.Video import Video
 
 logger = logging.getLogger(__name__)
 logger.setLevel(LOGGER_LEVEL)
 
+# limited range luma (16..235) to full range (0..255)
+LIMITED_RANGE_LUT = np.clip(np.round((np.arange(256) - 16) * 255 / 219), 0, 255).astype(np.uint8)
+# codecs with full range luma by definition (JPEG), the colour range of other streams isn't provided by cv2
+FULL_RANGE_CODECS = {'MJPG', 'JPEG'}
+
+
+def to_gray(frame):
+    return frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
 
 class VideoGrabber:
 
+    # luma: the first frame is in colour, all other frames are the Y plane of the decoder (gray, H x W) without
+    # conversion to BGR. the values differ from cv2.COLOR_BGR2GRAY of the BGR frames by up to 2 gray levels
+    # index: frame count, fps and seeking from the VideoIndex of the video if it has been created
+    # roi: region of interest (x, y, width, height), scale: frames are downscaled by this factor (area average).
+    # both are applied to all frames including the first one, width and height are those of the processed frames
+    # luma_cache: frames are read from an existing LumaCache of the video instead of being decoded, without roi and
+    # scale. the first frame and with luma=False all frames are the gray frames converted to BGR
     # TODO: get video data, not by reference
-    def __init__(self, videofile, start_frame_nr=0, end_frame=None, video: Video = None, silent=False):
+    def __init__(self, videofile, start_frame_nr=0, end_frame=None, video: Video = None, silent=False, luma=False,
+                 index=True, roi=None, scale=1, luma_cache=None):
+        if luma_cache is not None and (roi is not None or scale > 1):
+            raise ValueError("roi and scale aren't supported with a luma cache")
+        self.__luma_cache = luma_cache
+        self.__roi = tuple(roi) if roi is not None else None
+        self.__scale = max(int(scale), 1)
         self.__fps = 0
         self.__frames_to_process = 0
+        self.__frame_nr = 0
+        self.__luma = luma
+        self.__luma_native = False
+        self.__luma_lut = None
         self.__videofile = videofile
         self.__start_frame_nr = start_frame_nr
-        self.__cap: cv2.VideoCapture = cv2.VideoCapture(self.__videofile)
-        self.__fps = round(self.__cap.get(cv2.CAP_PROP_FPS), 2)
-        self.__total_frames = int(self.__cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        self.__frames_to_process = int(self.__cap.get(cv2.CAP_PROP_FRAME_COUNT)) - start_frame_nr
+        self.__index = VideoIndex(videofile) if index and luma_cache is None else None
+        if self.__index is not None and not self.__index.exists():
+            self.__index = None
+        self.__cap: Optional[cv2.VideoCapture] = cv2.VideoCapture(self.__videofile) if luma_cache is None else None
+        if luma_cache is not None:
+            self.__fps = luma_cache.fps()
+            self.__total_frames = luma_cache.total_frames()
+        elif self.__index is not None:
+            self.__fps = round(self.__index.fps(), 2)
+            self.__total_frames = self.__index.total_frames()
+        else:
+            self.__fps = round(self.__cap.get(cv2.CAP_PROP_FPS), 2)
+            self.__total_frames = int(self.__cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        self.__frames_to_process = self.__total_frames - start_frame_nr
         if end_frame:
             self.__frames_to_process = end_frame - start_frame_nr
-        self.__cap.set(cv2.CAP_PROP_POS_FRAMES, start_frame_nr)
-        self.__width = int(self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        self.__height = int(self.__cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if luma_cache is not None:
+            self.__source_width, self.__source_height = luma_cache.get_width(), luma_cache.get_height()
+        else:
+            self.__seek(self.__cap, start_frame_nr)
+            self.__source_width = int(self.__cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+            self.__source_height = int(self.__cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if self.__roi is not None:
+            x, y, width, height = self.__roi
+            if x < 0 or y < 0 or width <= 0 or height <= 0 or x + width > self.__source_width or \
+                    y + height > self.__source_height:
+                raise ValueError(f"roi {self.__roi} outside of the frame "
+                                 f"({self.__source_width}x{self.__source_height})")
+        else:
+            width, height = self.__source_width, self.__source_height
+        self.__width = max(width // self.__scale, 1)
+        self.__height = max(height // self.__scale, 1)
         if video is not None:
             video.fps_real = self.__fps
             video.fps = round(self.__fps)
             video.duration = round(self.duration())
         if not silent:
-            logger.debug(f'videofile: {videofile}')
+            logger.debug(f'videofile: {videofile}, video index: {self.__index is not None}, '
+                         f'luma cache: {luma_cache is not None}')
             logger.debug(f'fps_real: {self.__fps}')
             logger.debug(f'fps: {round(self.__fps)}')
             logger.debug(f'frames to process: {self.__frames_to_process}')
             logger.debug(f'duration: {self.duration()}')
             logger.debug(f'total frames: {self.__total_frames}')
             logger.debug(f'total duration: {self.total_duration()}')
+            if self.__roi is not None or self.__scale > 1:
+                logger.debug(f'roi: {self.__roi}, scale: 1/{self.__scale}, frame size: {self.__width}x{self.__height}')
 
     def videofile(self):
         return Path(self.__videofile).name
@@ -70,14 +127,142 @@ class VideoGrabber:
         return self.__fps
 
     def first_frame(self, callback):
+        if self.__luma_cache is not None:
+            self.__frame_nr = 1
+            callback(1, cv2.cvtColor(self.__luma_cache.frames()[self.__start_frame_nr], cv2.COLOR_GRAY2BGR))
+            return
         ret, frame = self.__cap.read()
+        self.__frame_nr = 1
+        if self.__luma and ret:
+            self.__init_luma(frame)
+        if ret and self.__transforms():
+            frame = self.__transform(frame)
         callback(1, frame)
 
-    def grab(self, callback):
-        for frame_nr in range(2, (self.__frames_to_process + 1)):
-            ret, frame = self.__cap.read()
-            if not ret:
-                logger.warning(f"Can't read frame {frame_nr} of {self.__frames_to_process}")
-            else:
-                callback(frame_nr, frame)
+    def __transforms(self):
+        return self.__roi is not None or self.__scale > 1
+
+    def __transform(self, frame, dst=None):
+        if self.__roi is not None:
+            x, y, width, height = self.__roi
+            frame = frame[y:y + height, x:x + width]
+        if self.__scale > 1:
+            return cv2.resize(frame, (self.__width, self.__height), dst=dst, interpolation=cv2.INTER_AREA)
+        if dst is None:
+            return np.ascontiguousarray(frame)
+        dst[...] = frame
+        return dst
+
+    def __init_luma(self, first_frame):
+        # the decoder doesn't switch reliably between BGR and Y plane within a stream: the remaining frames are read
+        # from a second capture without BGR conversion. its first frame is used to detect limited range luma, which
+        # is scaled to the range of cv2.COLOR_BGR2GRAY. the range is that of the codec if it is known, otherwise the one
+        # closer to the converted first frame
+        # the ffmpeg backend warns about the unconverted picture format on every frame
+        cv2.utils.logging.setLogLevel(cv2.utils.logging.LOG_LEVEL_ERROR)
+        cap = cv2.VideoCapture(self.__videofile)
+        cap.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        self.__seek(cap, self.__start_frame_nr)
+        ret, luma = cap.read()
+        if not ret or luma.shape != (self.__source_height, self.__source_width) or luma.dtype != np.uint8:
+            logger.warning("decoder doesn't provide the Y plane, converting BGR frames to gray")
+            cap.release()
+            return
+        gray = to_gray(first_frame).astype(np.int16)
+        error_full_range = np.mean(np.abs(luma.astype(np.int16) - gray))
+        error_limited_range = np.mean(np.abs(LIMITED_RANGE_LUT[luma].astype(np.int16) - gray))
+        codec = int(cap.get(cv2.CAP_PROP_FOURCC)).to_bytes(4, 'little').decode('ascii', errors='replace')
+        logger.debug(f'codec {codec}, mean difference to the first frame: full range {error_full_range:.2f}, '
+                     f'limited range {error_limited_range:.2f}')
+        full_range = codec in FULL_RANGE_CODECS or error_full_range <= error_limited_range
+        self.__luma_lut = None if full_range else LIMITED_RANGE_LUT
+        self.__luma_native = True
         self.__cap.release()
+        self.__cap = cap
+        logger.debug(f'luma decoding, {"limited" if self.__luma_lut is not None else "full"} range')
+
+    def __seek(self, cap: cv2.VideoCapture, frame_nr):
+        if self.__index is not None:
+            self.__index.seek(cap, frame_nr)
+        else:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_nr)
+
+    def grab(self, callback, prefetch=4):
+        for frame_nr, frame in self.frames(prefetch=prefetch):
+            callback(frame_nr, frame)
+        if self.__cap is not None:
+            self.__cap.release()
+
+    def frames(self, block_size=None, prefetch=4):
+        # the remaining frames, decoded on a background thread into a ring of prefetch preallocated buffers.
+        # yields (frame_nr, frame) or with block_size (frame_nr of the first frame, block of up to block_size frames).
+        # buffers are reused: frames kept beyond the next iteration have to be copied
+        if self.__luma_cache is not None:
+            yield from self.__cached_frames(block_size)
+            return
+        shape = (self.__height, self.__width) if self.__luma else (self.__height, self.__width, 3)
+        ring = [np.empty((block_size or 1,) + shape, dtype=np.uint8) for _ in range(prefetch)]
+        free_buffers = queue.Queue()
+        for index in range(prefetch):
+            free_buffers.put(index)
+        filled_buffers = queue.Queue()
+        decoder = threading.Thread(target=self.__decode, args=(ring, free_buffers, filled_buffers), daemon=True)
+        decoder.start()
+        try:
+            while (item := filled_buffers.get()) is not None:
+                index, frame_nr, count = item
+                yield (frame_nr, ring[index][0]) if block_size is None else (frame_nr, ring[index][:count])
+                free_buffers.put(index)
+        finally:
+            free_buffers.put(None)
+            decoder.join()
+
+    def __cached_frames(self, block_size=None):
+        # read only views of the memory-mapped cache, converted to BGR without luma
+        frames = self.__luma_cache.frames()
+        start = self.__start_frame_nr
+        while self.__frame_nr < self.__frames_to_process:
+            count = min(block_size or 1, self.__frames_to_process - self.__frame_nr,
+                        frames.shape[0] - start - self.__frame_nr)
+            if count <= 0:
+                logger.warning(f"Can't read frame {self.__frame_nr + 1} of {self.__frames_to_process}")
+                break
+            block = frames[start + self.__frame_nr:start + self.__frame_nr + count]
+            if not self.__luma:
+                block = np.stack([cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR) for frame in block])
+            first_frame_nr = self.__frame_nr + 1
+            self.__frame_nr += count
+            yield (first_frame_nr, block[0]) if block_size is None else (first_frame_nr, block)
+
+    def __decode(self, ring, free_buffers: queue.Queue, filled_buffers: queue.Queue):
+        # cv2 releases the GIL while decoding, frames are read directly into the buffers. frames with roi or scale
+        # are read into a reused frame and transformed into the buffers
+        direct = not self.__transforms() and (self.__luma_native or not self.__luma)
+        source = None
+        while self.__frame_nr < self.__frames_to_process:
+            index = free_buffers.get()
+            if index is None:
+                break
+            buffer = ring[index]
+            first_frame_nr = self.__frame_nr + 1
+            count = 0
+            while count < buffer.shape[0] and self.__frame_nr < self.__frames_to_process:
+                ret, frame = self.__cap.read(buffer[count] if direct else source)
+                if not ret:
+                    logger.warning(f"Can't read frame {self.__frame_nr + 1} of {self.__frames_to_process}")
+                    self.__frame_nr = self.__frames_to_process
+                    break
+                if not direct:
+                    source = frame
+                    if self.__luma and not self.__luma_native:
+                        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+                    self.__transform(frame, dst=buffer[count])
+                elif not np.shares_memory(frame, buffer):
+                    buffer[count] = frame
+                if self.__luma_lut is not None:
+                    cv2.LUT(buffer[count], self.__luma_lut, dst=buffer[count])
+                self.__frame_nr += 1
+                count += 1
+            if count > 0:
+                filled_buffers.put((index, first_frame_nr, count))
+        filled_buffers.put(None)
@@ -0,0 +1,119 @@
+import argparse
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from base_functions import *
+
+logger = logging.getLogger(__name__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+class VideoIndex:
+    version = 1
+
+    # frame count, presentation timestamps (ms) and keyframes of a video, measured in one pass over the packets
+    # without decoding. saved as sidecar file next to the video, only valid as long as size and modification time
+    # of the video are unchanged
+    def __init__(self, videofile, index_file=None):
+        self.__videofile = videofile
+        self.__index_file = Path(index_file if index_file is not None else f'{videofile}.index.npz')
+        self.__timestamps: Optional[np.ndarray] = None
+        self.__keyframes: Optional[np.ndarray] = None
+        if self.__index_file.is_file():
+            self.__load()
+
+    def __file_stats(self):
+        stat = os.stat(self.__videofile)
+        return np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+
+    def __load(self):
+        with np.load(self.__index_file) as index:
+            if int(index['version']) != self.version or not np.array_equal(index['file_stats'], self.__file_stats()):
+                logger.debug(f'outdated video index: {self.__index_file}')
+                return
+            self.__timestamps = index['timestamps']
+            self.__keyframes = index['keyframes']
+
+    def exists(self):
+        return self.__timestamps is not None
+
+    def create(self):
+        cap = cv2.VideoCapture(self.__videofile, cv2.CAP_FFMPEG, [cv2.CAP_PROP_FORMAT, -1])
+        if not cap.isOpened():
+            raise ValueError(f"couldn't open video: {self.__videofile}")
+        timestamps = []
+        keyframes = []
+        while cap.grab():
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC))
+            keyframes.append(cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME) != 0)
+        cap.release()
+        if not timestamps:
+            raise ValueError(f"no frames in video: {self.__videofile}")
+        # packets are in decoding order, frames are numbered in presentation order (b-frames)
+        order = np.argsort(timestamps, kind='stable')
+        self.__timestamps = np.asarray(timestamps)[order]
+        self.__keyframes = np.flatnonzero(np.asarray(keyframes)[order])
+        if self.__keyframes.size == 0 or self.__keyframes[0] != 0:
+            self.__keyframes = np.concatenate(([0], self.__keyframes))
+        temporary_path = f'{self.__index_file}.tmp.npz'
+        np.savez(temporary_path, version=self.version, file_stats=self.__file_stats(),
+                 timestamps=self.__timestamps, keyframes=self.__keyframes)
+        os.replace(temporary_path, self.__index_file)
+        logger.debug(f'video index: {self.total_frames()} frames, {self.__keyframes.size} keyframes, '
+                     f'fps: {self.fps():.4f}, {self.__index_file}')
+
+    def total_frames(self):
+        return self.__timestamps.size
+
+    def timestamps(self) -> np.ndarray:
+        return self.__timestamps
+
+    def keyframes(self) -> np.ndarray:
+        return self.__keyframes
+
+    def fps(self):
+        # mean frame rate of the presentation timestamps, the container fps is only used for single frame videos
+        if self.__timestamps.size < 2 or self.__timestamps[-1] <= self.__timestamps[0]:
+            cap = cv2.VideoCapture(self.__videofile)
+            fps = cap.get(cv2.CAP_PROP_FPS)
+            cap.release()
+            return fps
+        return 1000 * (self.__timestamps.size - 1) / (self.__timestamps[-1] - self.__timestamps[0])
+
+    def duration(self):
+        return self.__timestamps.size / self.fps()
+
+    def keyframe(self, frame_nr):
+        # last keyframe at or before frame_nr (0-based)
+        return int(self.__keyframes[np.searchsorted(self.__keyframes, frame_nr, side='right') - 1])
+
+    def seek(self, cap: cv2.VideoCapture, frame_nr):
+        # seek to the keyframe, the frames up to frame_nr are decoded without conversion. the timestamp of the frame
+        # before frame_nr verifies the position, the decoder's seek is used if it doesn't match
+        if frame_nr <= 0:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            return
+        keyframe = self.keyframe(frame_nr)
+        cap.set(cv2.CAP_PROP_POS_FRAMES, keyframe)
+        for _ in range(keyframe, frame_nr):
+            cap.grab()
+        interval = 1000 / self.fps()
+        if frame_nr > keyframe and abs(cap.get(cv2.CAP_PROP_POS_MSEC) - self.__timestamps[frame_nr - 1]) > interval / 2:
+            logger.warning(f'position after seeking to frame {frame_nr} differs from the index')
+            cap.set(cv2.CAP_PROP_POS_FRAMES, frame_nr)
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("video_files", nargs='+', help="video files to index")
+    argparser.add_argument("-f", "--force", action="store_true", help="recreate existing indexes")
+    args = argparser.parse_args()
+
+    for video_file in args.video_files:
+        index = VideoIndex(video_file)
+        if args.force or not index.exists():
+            index.create()
+        logger.info(f'{video_file}: {index.total_frames()} frames, {index.keyframes().size} keyframes, '
+                    f'fps: {index.fps():.4f}, duration: {index.duration():.2f} s')
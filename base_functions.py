@@ -50,10 +50,14 @@ def get_destination_path(filename, directory=None):
 
 
 def convert_panda_timestamp_to_timestamp(timestamp):
+    if timestamp is None:
+        return None
     return datetime.strptime(str(timestamp), "%Y-%m-%d %H:%M:%S")
 
 
 def get_timestamp_diff(video_ts, matched_ts):
+    if matched_ts is None:
+        return None
     return round(matched_ts.timestamp() - video_ts.timestamp())
 
 
@@ -61,6 +65,14 @@ def get_enf_truth_path():
     return f'{get_base_path()}/data'
 
 
+def get_ground_truth_store_path():
+    return f'{get_enf_truth_path()}/ground_truth'
+
+
+def get_segmentation_cache_path():
+    return f'{get_base_path()}/cache/segmentation'
+
+
 def read_csv(csv_file) -> pd.Series:
     logger.debug(f'csv: loading {csv_file}')
     ground_truth = pd.read_csv(csv_file, parse_dates=['time'], skiprows=0, sep=',', decimal='.')
@@ -0,0 +1,84 @@
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from ENFCorrelator import ENFCorrelator
+from base_functions import *
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def correlate_loop(extracted_enf, frequency_data: pd.Series):
+    # previous implementation of ENFSuperpixelAnalyzer.correlate / ENFMeanAnalyzer.correlate
+    enf_series = pd.Series(extracted_enf)
+    size = (frequency_data.size - enf_series.size) + 1
+    correlated = np.zeros(size)
+    for i in range(0, size):
+        section = frequency_data.iloc[i:i + enf_series.size].reset_index(drop=True)
+        correlated[i] = enf_series.corr(section)
+    return correlated
+
+
+def create_enf(frequency_data: pd.Series, offset, length, expected_enf_frequency=10., noise=.002, gap=0):
+    rng = np.random.default_rng(offset)
+    enf = frequency_data.iloc[offset:offset + length].to_numpy() - 50 + expected_enf_frequency
+    enf = enf + rng.normal(0, noise, length)
+    if gap > 0:
+        enf[length // 2:length // 2 + gap] = np.nan
+    return enf
+
+
+def benchmark(frequency_data: pd.Series, offset, length, gap=0):
+    enf = create_enf(frequency_data, offset, length, gap=gap)
+    start = time.perf_counter()
+    correlated_loop = correlate_loop(enf, frequency_data)
+    duration_loop = time.perf_counter() - start
+    start = time.perf_counter()
+    correlated_fft = ENFCorrelator.correlate(enf, frequency_data.to_numpy())
+    duration_fft = time.perf_counter() - start
+    same_nan = np.array_equal(np.isnan(correlated_loop), np.isnan(correlated_fft))
+    max_diff = np.nanmax(np.abs(correlated_loop - correlated_fft))
+    logger.info(f'length: {length}, gap: {gap}, reference: {frequency_data.size}')
+    logger.info(f'loop: {duration_loop:.3f} s, fft: {duration_fft:.4f} s, speedup: {duration_loop / duration_fft:.0f}x')
+    logger.info(f'index loop: {np.nanargmax(correlated_loop)}, index fft: {np.nanargmax(correlated_fft)}, '
+                f'expected: {offset}, max. difference: {max_diff:.2e}, same nan positions: {same_nan}')
+
+
+def benchmark_many(frequency_data: pd.Series, videos=50, variants=3):
+    rng = np.random.default_rng(0)
+    enfs = []
+    for video in range(videos):
+        offset = int(rng.integers(0, frequency_data.size - 1800))
+        length = int(rng.integers(420, 1800))
+        enfs.extend(create_enf(frequency_data, offset, length, noise=.002 * (variant + 1))
+                    for variant in range(variants))
+    reference = frequency_data.to_numpy()
+    start = time.perf_counter()
+    correlated_single = [ENFCorrelator.correlate(enf, reference) for enf in enfs]
+    duration_single = time.perf_counter() - start
+    start = time.perf_counter()
+    correlated_many = ENFCorrelator(reference).sliding_pearson_many(enfs)
+    duration_many = time.perf_counter() - start
+    max_diff = max(np.nanmax(np.abs(single - many)) for single, many in zip(correlated_single, correlated_many))
+    logger.info(f'{videos} videos x {variants} variants, reference: {frequency_data.size}')
+    logger.info(f'single: {duration_single:.3f} s, many: {duration_many:.3f} s, '
+                f'speedup: {duration_single / duration_many:.1f}x, max. difference: {max_diff:.2e}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-gt", "--ground-truth", default=f'{get_enf_truth_path()}/2022-09-17.csv',
+                           help="csv file with enf ground truth")
+    argparser.add_argument("-rs", "--reference-seconds", type=int, default=None,
+                           help="limit the reference to the first n seconds, default: whole file")
+    args = argparser.parse_args()
+
+    ground_truth = read_csv(args.ground_truth)
+    if args.reference_seconds is not None:
+        ground_truth = ground_truth.iloc[:args.reference_seconds]
+    benchmark(ground_truth, ground_truth.size // 3, 600)
+    benchmark(ground_truth, ground_truth.size // 2, 1800, gap=30)
+    benchmark_many(ground_truth)
@@ -0,0 +1,56 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ENFSuperpixelVideoProcessor import ENFSuperpixelVideoProcessor
+from base_functions import *
+from benchmark_synthetic import RESOLUTIONS, create_video
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def flicker_correlation(mean_per_superpixel, fps=30):
+    # median pearson correlation of the superpixel intensities with the 10 Hz flicker of the synthetic video
+    flicker = np.sin(2 * np.pi * 10 * np.arange(mean_per_superpixel.shape[1]) / fps)
+    data = mean_per_superpixel.astype(np.float64)
+    data -= data.mean(axis=1, keepdims=True)
+    norm = np.linalg.norm(data, axis=1) * np.linalg.norm(flicker - flicker.mean())
+    return float(np.median(data @ (flicker - flicker.mean()) / np.where(norm > 0, norm, np.inf)))
+
+
+def benchmark(resolution, frame_count, scales, motion_detection, noise):
+    height, width = RESOLUTIONS[resolution]
+    with tempfile.TemporaryDirectory() as directory:
+        video_file = f'{directory}/synthetic_{resolution}.avi'
+        create_video(video_file, height=height, width=width, frames=frame_count, noise=noise)
+        durations = {}
+        for scale in scales:
+            processor = ENFSuperpixelVideoProcessor(motion_detection=motion_detection, dry_run=True, save_img=False,
+                                                    lightness_threshold=0, scale=scale)
+            start = time.perf_counter()
+            mean_per_superpixel = processor.process_video(video_file)
+            durations[scale] = time.perf_counter() - start
+            logger.info(f'{resolution}, scale 1/{scale}, motion detection: {motion_detection}: '
+                        f'{frame_count / durations[scale]:.1f} fps, '
+                        f'speedup {durations[scales[0]] / durations[scale]:.1f}x, '
+                        f'{mean_per_superpixel.shape[0]} superpixel, '
+                        f'flicker correlation: {flicker_correlation(mean_per_superpixel):.4f}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-r", "--resolution", choices=list(RESOLUTIONS) + ['all'], default='all',
+                           help="frame resolution, default: all")
+    argparser.add_argument("-f", "--frames", type=int, default=30, help="number of frames, default: 30")
+    argparser.add_argument("-s", "--scales", type=int, nargs='+', default=[1, 2, 4, 8],
+                           help="downscale factors, default: 1 2 4 8")
+    argparser.add_argument("-n", "--noise", type=float, default=8,
+                           help="standard deviation of the pixel noise, default: 8")
+    argparser.add_argument("-dmd", "--disable-motion-detection", help="disable motion detection", action="store_true")
+    args = argparser.parse_args()
+
+    for name in RESOLUTIONS if args.resolution == 'all' else [args.resolution]:
+        benchmark(name, args.frames, args.scales, not args.disable_motion_detection, args.noise)
@@ -0,0 +1,58 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ENFMeanVideoProcessor import ENFMeanVideoProcessor
+from ENFSuperpixelVideoProcessor import ENFSuperpixelVideoProcessor
+from MotionDetectorGSOC import MOTION_DETECTION_METHODS
+from VideoFanOutProcessor import VideoFanOutProcessor
+from base_functions import *
+from benchmark_synthetic import create_video
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def create_consumers(directory, motion_detection, motion_method):
+    # the segmentation is downscaled, the decoding and not the segmentation of the first frame should be timed
+    return [ENFMeanVideoProcessor('mean', lightness_threshold=100, data_dir=directory, save_images=False),
+            ENFSuperpixelVideoProcessor(lightness_threshold=100, motion_detection=motion_detection,
+                                        motion_method=motion_method, data_dir=directory, save_img=False,
+                                        segmentation_scale=4)]
+
+
+def benchmark(video_file, motion_method, directory):
+    for motion_detection in (False, True):
+        separate_directory, fan_out_directory = f'{directory}/separate', f'{directory}/fan_out'
+        start = time.perf_counter()
+        for consumer in create_consumers(separate_directory, motion_detection, motion_method):
+            consumer.process_video(video_file)
+        duration_separate = time.perf_counter() - start
+        start = time.perf_counter()
+        _, mean_per_superpixel = VideoFanOutProcessor(
+            create_consumers(fan_out_directory, motion_detection, motion_method)).process_video(video_file)
+        duration_fan_out = time.perf_counter() - start
+        separate = ENFSuperpixelVideoProcessor(data_dir=separate_directory).load_mean_data(Path(video_file).name)
+        mean_difference = np.max(np.abs(np.load(f'{separate_directory}/mean_mean_per_frame.npy') -
+                                        np.load(f'{fan_out_directory}/mean_mean_per_frame.npy')))
+        logger.info(f'{f"motion detection ({motion_method})" if motion_detection else "without motion detection"}: '
+                    f'separate {duration_separate:.2f} s, fan-out {duration_fan_out:.2f} s, '
+                    f'speedup {duration_separate / duration_fan_out:.2f}x, max. difference mean per frame '
+                    f'{mean_difference:.3f}, superpixel {np.max(np.abs(separate - mean_per_superpixel)):.3f}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-v", "--video-file", default=None, help="video file, default: synthetic 1080p video")
+    argparser.add_argument("-m", "--motion-method", choices=MOTION_DETECTION_METHODS, default='difference',
+                           help="motion detection method, default: difference")
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.video_file is not None:
+            benchmark(args.video_file, args.motion_method, directory)
+        else:
+            create_video(f'{directory}/synthetic.avi', noise=8)
+            benchmark(f'{directory}/synthetic.avi', args.motion_method, directory)
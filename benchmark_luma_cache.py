@@ -0,0 +1,50 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ENFMeanVideoProcessor import ENFMeanVideoProcessor
+from ENFSuperpixelVideoProcessor import ENFSuperpixelVideoProcessor
+from LumaCache import LumaCache
+from base_functions import *
+from benchmark_synthetic import create_video
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def benchmark(video_file, width, directory):
+    start = time.perf_counter()
+    cache = LumaCache(video_file, width=width)
+    cache.create()
+    logger.info(f'luma cache {cache.get_width()}x{cache.get_height()}: created in {time.perf_counter() - start:.2f} s, '
+                f'{os.path.getsize(f"{video_file}.luma_{cache.get_width()}x{cache.get_height()}.npy") / 1e6:.1f} MB')
+    means = {}
+    for luma_cache in (False, True):
+        start = time.perf_counter()
+        ENFMeanVideoProcessor('mean', data_dir=directory, save_images=False, luma_cache=luma_cache).process_video(
+            video_file)
+        duration_mean = time.perf_counter() - start
+        means[luma_cache] = np.load(f'{directory}/mean_mean_per_frame.npy')
+        start = time.perf_counter()
+        mean_per_superpixel = ENFSuperpixelVideoProcessor(dry_run=True, save_img=False,
+                                                          luma_cache=luma_cache).process_video(video_file)
+        duration_superpixel = time.perf_counter() - start
+        logger.info(f'{"luma cache" if luma_cache else "video"}: mean {duration_mean:.2f} s, superpixel with motion '
+                    f'detection {duration_superpixel:.2f} s, {mean_per_superpixel.shape[0]} superpixel')
+    logger.info(f'max. difference of the mean per frame: {np.max(np.abs(means[True] - means[False])):.3f}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-v", "--video-file", default=None, help="video file, default: synthetic 1080p video")
+    argparser.add_argument("-W", "--width", type=int, default=128, help="width of the cached frames, default: 128")
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        if args.video_file is not None:
+            benchmark(args.video_file, args.width, directory)
+        else:
+            create_video(f'{directory}/synthetic.avi', noise=8)
+            benchmark(f'{directory}/synthetic.avi', args.width, directory)
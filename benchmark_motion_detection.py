@@ -0,0 +1,103 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from MeanMedianSuperpixelCalculator import MeanMedianSuperpixelCalculator
+from MotionDetectorGSOC import MotionDetectorGSOC, MOTION_DETECTION_METHODS
+from MotionDetectorSuperpixelVariance import MotionDetectorSuperpixelVariance
+from base_functions import *
+from benchmark_synthetic import RESOLUTIONS, create_image, flicker
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def create_frames(height, width, count, fps=30, seed=0):
+    # smooth random image flickering at 10 Hz, a dark square moves from left to right through the middle
+    rng = np.random.default_rng(seed)
+    image = create_image(height, width, rng)
+    size = height // 5
+    frames = []
+    for frame_nr in range(count):
+        frame = np.clip(flicker(image, frame_nr, fps), 0, 255).astype(np.uint8)
+        x = int((width - size) * frame_nr / max(count - 1, 1))
+        frame[(height - size) // 2:(height + size) // 2, x:x + size] = 20
+        frames.append(frame)
+    return frames
+
+
+def detect(frames, segmented_superpixel, motion_scale, motion_stride, method='gsoc'):
+    md = MotionDetectorGSOC(show_background=False, motion_threshold_factor=.2, motion_scale=motion_scale,
+                            motion_stride=motion_stride, method=method)
+    md.first_frame(frames[0], segmented_superpixel=segmented_superpixel)
+    start = time.perf_counter()
+    for frame in frames[1:]:
+        md.next_frame(frame)
+    duration = (time.perf_counter() - start) / (len(frames) - 1)
+    return duration, md.get_steady_superpixel_indices() == 0
+
+
+def detect_variance(frames, segmented_superpixel):
+    # only the detection is timed, the means are calculated for the superpixel intensities anyway
+    mmc = MeanMedianSuperpixelCalculator(threshold=0)
+    mmc.initialize(segmented_superpixel, len(frames))
+    means = np.stack([mmc.mean_intensities(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).reshape(-1))
+                      for frame in frames], axis=1)[1:]
+    start = time.perf_counter()
+    steady = MotionDetectorSuperpixelVariance().steady_superpixel(means)
+    duration = (time.perf_counter() - start) / (len(frames) - 1)
+    return duration, ~steady
+
+
+def jaccard_index(motion, reference_motion):
+    union = np.count_nonzero(motion | reference_motion)
+    return np.count_nonzero(motion & reference_motion) / union if union > 0 else 1.
+
+
+def benchmark(resolution, frame_count, scales, strides, methods):
+    height, width = RESOLUTIONS[resolution]
+    frames = create_frames(height, width, frame_count)
+    md = MotionDetectorGSOC(show_background=False, motion_threshold_factor=.2)
+    md.first_frame(frames[0])
+    segmented_superpixel = md.segmented_superpixel()
+    reference_duration, reference_motion = detect(frames, segmented_superpixel, 1, 1)
+    logger.info(f'{resolution}: {len(md.get_superpixel_indices())} superpixel, {frame_count} frames, '
+                f'full resolution, every frame: {1000 * reference_duration:.1f} ms per frame, '
+                f'{np.count_nonzero(reference_motion)} superpixel with motion')
+    for scale in scales:
+        for stride in strides:
+            if scale == 1 and stride == 1:
+                continue
+            duration, motion = detect(frames, segmented_superpixel, scale, stride)
+            logger.info(f'scale 1/{scale}, every {stride}. frame: {1000 * duration:.1f} ms per frame, '
+                        f'speedup {reference_duration / duration:.1f}x, {np.count_nonzero(motion)} superpixel with '
+                        f'motion, jaccard index to full resolution: {jaccard_index(motion, reference_motion):.3f}')
+    for method in methods:
+        if method == 'gsoc':
+            continue
+        if method == 'variance':
+            duration, motion = detect_variance(frames, segmented_superpixel)
+        else:
+            duration, motion = detect(frames, segmented_superpixel, 1, 1, method)
+        logger.info(f'{method}: {1000 * duration:.2f} ms per frame, speedup {reference_duration / duration:.1f}x, '
+                    f'{np.count_nonzero(motion)} superpixel with motion, jaccard index to gsoc: '
+                    f'{jaccard_index(motion, reference_motion):.3f}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-r", "--resolution", choices=list(RESOLUTIONS) + ['all'], default='1080p',
+                           help="frame resolution, default: 1080p")
+    argparser.add_argument("-f", "--frames", type=int, default=20, help="number of frames, default: 20")
+    argparser.add_argument("-s", "--scales", type=int, nargs='+', default=[1, 2, 4],
+                           help="downscale factors, default: 1 2 4")
+    argparser.add_argument("-st", "--strides", type=int, nargs='+', default=[1, 2, 4],
+                           help="strides, default: 1 2 4")
+    argparser.add_argument("-m", "--methods", choices=MOTION_DETECTION_METHODS, nargs='+',
+                           default=MOTION_DETECTION_METHODS, help="motion detection methods, default: all")
+    args = argparser.parse_args()
+
+    for name in RESOLUTIONS if args.resolution == 'all' else [args.resolution]:
+        benchmark(name, args.frames, args.scales, args.strides, args.methods)
@@ -0,0 +1,89 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from ENFSuperpixelAnalyzer import ENFSuperpixelAnalyzer
+from MeanMedianSuperpixelCalculator import MeanMedianSuperpixelCalculator
+from MotionDetectorGSOC import MotionDetectorGSOC
+from base_functions import *
+from benchmark_synthetic import RESOLUTIONS
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def create_scene(height, width, cells=150, seed=0):
+    # image of random cells with random brightness and texture, half of the cells are lit by the flickering light
+    rng = np.random.default_rng(seed)
+    points = rng.uniform((0, 0), (height, width), (cells, 2))
+    rows, columns = np.indices((height, width), dtype=np.float32)
+    cell = np.zeros((height, width), dtype=np.int32)
+    distance = np.full((height, width), np.inf, dtype=np.float32)
+    for i, (y, x) in enumerate(points):
+        cell_distance = (rows - y) ** 2 + (columns - x) ** 2
+        closer = cell_distance < distance
+        cell[closer] = i
+        distance[closer] = cell_distance[closer]
+    colours = rng.integers(60, 230, (cells, 3))
+    texture = cv2.GaussianBlur(rng.normal(0, 12, (height, width, 3)).astype(np.float32), (9, 9), 0)
+    image = np.clip(colours[cell] + texture, 0, 255).astype(np.uint8)
+    lit = rng.random(cells) < .5
+    return image, lit[cell]
+
+
+def enf_signal(frame_count, fps=30, frequency=10., deviation=.05, seed=0):
+    # flicker at the alias frequency of the enf, the frequency drifts like the grid frequency
+    rng = np.random.default_rng(seed)
+    drift = cv2.GaussianBlur(np.cumsum(rng.normal(0, 1, frame_count)).reshape(1, -1), (1, 4 * fps + 1), 0)
+    drift = deviation * drift.reshape(-1) / max(np.abs(drift).max(), 1e-9)
+    return np.sin(2 * np.pi * np.cumsum(frequency + drift) / fps)
+
+
+def superpixel_means(image, lit, segmented_superpixel, signal, amplitude=.03, noise=8., seed=0):
+    # means per superpixel (rows) and frame (columns) of image * (1 + amplitude * signal) at the lit pixels plus
+    # gaussian pixel noise, calculated from the means of the image instead of decoding frames
+    calculator = MeanMedianSuperpixelCalculator(threshold=0)
+    calculator.initialize(segmented_superpixel, signal.size)
+    luminance = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).reshape(-1).astype(np.float32)
+    labels = np.unique(segmented_superpixel)
+    base = calculator.mean_intensities(luminance)[labels]
+    flicker = calculator.mean_intensities(luminance * lit.reshape(-1))[labels]
+    pixel_count = np.bincount(segmented_superpixel.reshape(-1))[labels]
+    rng = np.random.default_rng(seed)
+    return base[:, None] + amplitude * flicker[:, None] * signal[None, :] + \
+        rng.normal(0, 1, (labels.size, signal.size)) * (noise / np.sqrt(pixel_count))[:, None]
+
+
+def benchmark(resolution, seconds, scales, fps=30):
+    height, width = RESOLUTIONS[resolution]
+    image, lit = create_scene(height, width)
+    signal = enf_signal(seconds * fps, fps)
+    reference_duration = None
+    for scale in scales:
+        # the frame difference doesn't initialize a background model worth mentioning, only the segmentation is timed
+        md = MotionDetectorGSOC(show_background=False, method='difference', segmentation_scale=scale)
+        start = time.perf_counter()
+        md.first_frame(image)
+        duration = time.perf_counter() - start
+        reference_duration = reference_duration if reference_duration is not None else duration
+        mean_per_superpixel = superpixel_means(image, lit, md.segmented_superpixel(), signal)
+        analyzer = ENFSuperpixelAnalyzer(destination='.', fps=fps, fps_real=fps, show_plots=False, save_data=False)
+        enf_metric, _ = analyzer.detect_enf(mean_per_superpixel)
+        logger.info(f'{resolution}, segmentation scale 1/{scale}: {len(md.get_superpixel_indices())} superpixel, '
+                    f'segmentation {duration:.2f} s, speedup {reference_duration / duration:.1f}x, '
+                    f'ENF metric median: {enf_metric.median}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-r", "--resolution", choices=list(RESOLUTIONS) + ['all'], default='1080p',
+                           help="frame resolution, default: 1080p")
+    argparser.add_argument("-d", "--duration", type=int, default=120, help="duration in seconds, default: 120")
+    argparser.add_argument("-s", "--scales", type=int, nargs='+', default=[1, 2, 4, 8],
+                           help="downscale factors of the segmentation, default: 1 2 4 8")
+    args = argparser.parse_args()
+
+    for name in RESOLUTIONS if args.resolution == 'all' else [args.resolution]:
+        benchmark(name, args.duration, args.scales)
@@ -0,0 +1,57 @@
+import argparse
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+from ENFCorrelator import ENFCorrelator
+from ENFSubsequenceSearch import ENFSubsequenceSearch
+from GroundTruthStore import GroundTruthStore
+from benchmark_timestamp_search import create_store
+from base_functions import *
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def measure(function):
+    # duration and peak of the memory allocated by numpy and python in MB
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = function()
+    duration = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def benchmark(store: GroundTruthStore, offset, length, top_k=5, noise=.002, block_size=1 << 20):
+    rng = np.random.default_rng(offset)
+    enf = store.frequencies(offset, offset + length) - 40 + rng.normal(0, noise, length)
+    search = ENFSubsequenceSearch(store, block_size=block_size)
+    matches, duration_search, peak_search = measure(lambda: search.search(enf, top_k=top_k))
+    correlated, duration_full, peak_full = measure(
+        lambda: ENFCorrelator(store.frequencies(0, store.size())).sliding_pearson(enf))
+    logger.info(f'length: {length}, reference: {store.size()}, expected: {offset}')
+    logger.info(f'subsequence search: {duration_search:.3f} s, {peak_search:.0f} MB, '
+                f'full correlation: {duration_full:.3f} s, {peak_full:.0f} MB')
+    logger.info(f'{search.stats}')
+    logger.info(f'full correlation: {np.nanargmax(correlated)}, {np.nanmax(correlated):.4f}')
+    for match in matches:
+        logger.info(f'match: {match.index}, correlation: {match.correlation}, '
+                    f'full correlation: {correlated[match.index]:.4f}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-gt", "--ground-truth", default=f'{get_enf_truth_path()}/2022-09-17.csv',
+                           help="csv file with enf ground truth")
+    argparser.add_argument("-d", "--days", type=int, default=31, help="days of the synthetic archive, default: 31")
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = create_store(directory, read_csv(args.ground_truth), args.days)
+        benchmark(store, store.size() // 3 + 1234, 600)
+        benchmark(store, store.size() // 2 + 77, 1800)
+        benchmark(store, store.size() // 2 + 77, 1800, block_size=1 << 16)
@@ -0,0 +1,90 @@
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from MeanMedianSuperpixelCalculator import MeanMedianSuperpixelCalculator
+from base_functions import *
+from benchmark_synthetic import RESOLUTIONS, create_labels
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def create_frames(height, width, count, seed=0):
+    rng = np.random.default_rng(seed)
+    return [cv2.cvtColor(rng.integers(100, 256, (height, width), dtype=np.uint8), cv2.COLOR_GRAY2BGR)
+            for _ in range(count)]
+
+
+def aggregate_loop(labels, frames, median=True):
+    # previous implementation of MeanMedianSuperpixelCalculator.next_frame
+    labels_1d = labels.reshape(-1)
+    pixel_locations = {i: np.where(labels_1d == i)[0] for i in np.unique(labels_1d)}
+    mean = np.zeros((labels_1d.max() + 1, len(frames)))
+    median_result = np.zeros((labels_1d.max() + 1, len(frames)))
+    for frame_nr, frame in enumerate(frames):
+        luminance = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).flatten()
+        for i, locations in pixel_locations.items():
+            mean[i, frame_nr] = np.mean(luminance[locations])
+            if median:
+                median_result[i, frame_nr] = np.median(luminance[locations])
+    return mean, median_result
+
+
+def benchmark(resolution, frame_count, block_size):
+    height, width = RESOLUTIONS[resolution]
+    labels = create_labels(height, width)
+    frames = create_frames(height, width, frame_count)
+    logger.info(f'{resolution}: {len(np.unique(labels))} superpixel, {frame_count} frames')
+
+    start = time.perf_counter()
+    mean_loop, _ = aggregate_loop(labels, frames, median=False)
+    duration_loop = (time.perf_counter() - start) / frame_count
+    start = time.perf_counter()
+    _, median_loop = aggregate_loop(labels, frames, median=True)
+    duration_loop_median = (time.perf_counter() - start) / frame_count
+
+    calculator = MeanMedianSuperpixelCalculator(threshold=0)
+    calculator.initialize(labels, frame_count)
+    start = time.perf_counter()
+    mean_frame = np.stack([calculator.mean_intensities(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).reshape(-1))
+                           for frame in frames], axis=1)
+    duration_frame = (time.perf_counter() - start) / frame_count
+    start = time.perf_counter()
+    mean_block = np.concatenate(
+        [calculator.mean_intensities(np.stack([cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).reshape(-1)
+                                               for frame in frames[i:i + block_size]]))
+         for i in range(0, frame_count, block_size)], axis=1)
+    duration_block = (time.perf_counter() - start) / frame_count
+    start = time.perf_counter()
+    median_histogram = np.stack([calculator.median_intensities(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).reshape(-1))
+                                 for frame in frames], axis=1)
+    duration_histogram = (time.perf_counter() - start) / frame_count
+
+    labels_present = np.unique(labels)
+    max_diff_frame = np.max(np.abs(mean_loop[labels_present] - mean_frame[labels_present]))
+    max_diff_block = np.max(np.abs(mean_loop[labels_present] - mean_block[labels_present]))
+    max_diff_histogram = np.max(np.abs(median_loop[labels_present] - median_histogram[labels_present]))
+    logger.info(f'per frame: loop (mean): {1000 * duration_loop:.2f} ms, loop (mean + median): '
+                f'{1000 * duration_loop_median:.2f} ms, sparse per frame: {1000 * duration_frame:.2f} ms, '
+                f'sparse per block of {block_size}: {1000 * duration_block:.2f} ms')
+    logger.info(f'speedup mean: per frame {duration_loop / duration_frame:.1f}x, '
+                f'per block {duration_loop / duration_block:.1f}x, max. difference: per frame {max_diff_frame:.2e}, '
+                f'per block {max_diff_block:.2e}')
+    logger.info(f'median per frame: loop: {1000 * (duration_loop_median - duration_loop):.2f} ms, histogram: '
+                f'{1000 * duration_histogram:.2f} ms, max. difference: {max_diff_histogram:.2e}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-r", "--resolution", choices=list(RESOLUTIONS) + ['all'], default='all',
+                           help="frame resolution, default: all")
+    argparser.add_argument("-f", "--frames", type=int, default=60, help="number of frames, default: 60")
+    argparser.add_argument("-b", "--block-size", type=int, default=30,
+                           help="frames per sparse matrix product, default: 30")
+    args = argparser.parse_args()
+
+    for name in RESOLUTIONS if args.resolution == 'all' else [args.resolution]:
+        benchmark(name, args.frames, args.block_size)
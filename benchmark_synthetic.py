@@ -0,0 +1,35 @@
+import cv2
+import numpy as np
+
+# synthetic data of the benchmarks
+RESOLUTIONS = {'1080p': (1080, 1920), '4k': (2160, 3840)}
+
+
+def create_image(height, width, rng):
+    # smooth random image
+    return cv2.GaussianBlur(rng.integers(60, 230, (height, width, 3), dtype=np.uint8), (31, 31), 0)
+
+
+def flicker(image, frame_nr, fps=30):
+    # image flickering at 10 Hz, float
+    return image * (1 + .03 * np.sin(2 * np.pi * 10 * frame_nr / fps))
+
+
+def create_video(filename, height=1080, width=1920, frames=300, fps=30, seed=0, noise=0):
+    # smooth random image flickering at 10 Hz, noise: standard deviation of gaussian noise per pixel and frame
+    rng = np.random.default_rng(seed)
+    image = create_image(height, width, rng)
+    writer = cv2.VideoWriter(filename, cv2.VideoWriter_fourcc(*'MJPG'), fps, (width, height))
+    for frame_nr in range(frames):
+        frame = flicker(image, frame_nr, fps)
+        if noise > 0:
+            frame += rng.normal(0, noise, frame.shape).astype(np.float32)
+        writer.write(np.clip(frame, 0, 255).astype(np.uint8))
+    writer.release()
+
+
+def create_labels(height, width, superpixel_size_denominator=18):
+    # square superpixels of the region size used by MotionDetectorGSOC, labels start at 1
+    region_size = int(min(height, width) / superpixel_size_denominator)
+    rows, columns = np.indices((height, width))
+    return (rows // region_size) * -(-width // region_size) + columns // region_size + 1
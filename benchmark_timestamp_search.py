@@ -0,0 +1,53 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+
+from ENFCorrelator import ENFCorrelator
+from ENFTimestampSearch import ENFTimestampSearch
+from GroundTruthStore import GroundTruthStore
+from base_functions import *
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def create_store(directory, ground_truth: pd.Series, days, seed=0):
+    # synthetic archive: the recorded day with an individual random walk per day, so no two days are identical
+    rng = np.random.default_rng(seed)
+    store = GroundTruthStore(directory)
+    for day in range(days):
+        drift = np.cumsum(rng.normal(0, .0005, ground_truth.size))
+        store.add(ground_truth.index + pd.Timedelta(days=day), ground_truth.to_numpy() + drift - np.mean(drift))
+    return store
+
+
+def benchmark(store: GroundTruthStore, offset, length, top_k=5, noise=.002):
+    rng = np.random.default_rng(offset)
+    enf = store.frequencies(offset, offset + length) - 40 + rng.normal(0, noise, length)
+    start = time.perf_counter()
+    matches = ENFTimestampSearch(store).search(enf, top_k=top_k)
+    duration_search = time.perf_counter() - start
+    start = time.perf_counter()
+    correlated = ENFCorrelator(store.frequencies(0, store.size())).sliding_pearson(enf)
+    duration_full = time.perf_counter() - start
+    logger.info(f'length: {length}, reference: {store.size()}, expected: {store.timestamp_of(offset)}')
+    logger.info(f'coarse to fine: {duration_search:.3f} s, full correlation: {duration_full:.3f} s')
+    logger.info(f'full correlation: {store.timestamp_of(int(np.nanargmax(correlated)))}, '
+                f'{np.nanmax(correlated):.4f}')
+    for match in matches:
+        logger.info(f'match: {match}')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-gt", "--ground-truth", default=f'{get_enf_truth_path()}/2022-09-17.csv',
+                           help="csv file with enf ground truth")
+    argparser.add_argument("-d", "--days", type=int, default=31, help="days of the synthetic archive, default: 31")
+    args = argparser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        store = create_store(directory, read_csv(args.ground_truth), args.days)
+        benchmark(store, store.size() // 3 + 1234, 600)
+        benchmark(store, store.size() // 2 + 77, 1800)
@@ -0,0 +1,85 @@
+import argparse
+import tempfile
+import time
+
+import cv2
+
+from MeanMedianSuperpixelCalculator import MeanMedianSuperpixelCalculator
+from VideoGrabber import VideoGrabber
+from base_functions import *
+from benchmark_synthetic import create_labels, create_video
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
+
+def create_calculator(video_file):
+    vg = VideoGrabber(video_file, silent=True)
+    calculator = MeanMedianSuperpixelCalculator(threshold=0)
+    calculator.initialize(create_labels(vg.get_height(), vg.get_width()), vg.total_frames())
+    vg.first_frame(callback=lambda frame_nr, frame: calculator.first_frame(frame))
+    return calculator
+
+
+def grab_synchronous(video_file, calculator):
+    # previous implementation of VideoGrabber.grab
+    vg = VideoGrabber(video_file, silent=True)
+    cap = cv2.VideoCapture(video_file)
+    cap.read()
+    for _ in range(2, vg.total_frames() + 1):
+        ret, frame = cap.read()
+        if ret:
+            calculator.next_frame(frame)
+    cap.release()
+    return vg.total_frames() - 1
+
+
+def grab_prefetch(video_file, calculator):
+    vg = VideoGrabber(video_file, silent=True)
+    vg.first_frame(callback=lambda frame_nr, frame: None)
+    vg.grab(callback=lambda frame_nr, frame: calculator.next_frame(frame))
+    return vg.total_frames() - 1
+
+
+def grab_blocks(video_file, calculator, block_size):
+    vg = VideoGrabber(video_file, silent=True)
+    vg.first_frame(callback=lambda frame_nr, frame: None)
+    for frame_nr, block in vg.frames(block_size=block_size):
+        calculator.next_frames(block)
+    return vg.total_frames() - 1
+
+
+def grab_luma(video_file, calculator, block_size):
+    vg = VideoGrabber(video_file, silent=True, luma=True)
+    vg.first_frame(callback=lambda frame_nr, frame: None)
+    for frame_nr, block in vg.frames(block_size=block_size):
+        calculator.next_frames(block)
+    return vg.total_frames() - 1
+
+
+def benchmark(video_file, block_size):
+    for name, grab in (('synchronous', grab_synchronous), ('prefetch', grab_prefetch),
+                       (f'blocks of {block_size}', lambda video, calculator: grab_blocks(video, calculator,
+                                                                                       block_size)),
+                       (f'luma blocks of {block_size}', lambda video, calculator: grab_luma(video, calculator,
+                                                                                          block_size))):
+        calculator = create_calculator(video_file)
+        start = time.perf_counter()
+        frames = grab(video_file, calculator)
+        duration = time.perf_counter() - start
+        logger.info(f'{name}: {frames / duration:.1f} fps')
+
+
+if __name__ == "__main__":
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("-v", "--video-file", default=None, help="video file, default: synthetic 1080p video")
+    argparser.add_argument("-b", "--block-size", type=int, default=16, help="frames per block, default: 16")
+    args = argparser.parse_args()
+
+    logger.info(f'cores: {os.cpu_count()}')
+    if args.video_file is not None:
+        benchmark(args.video_file, args.block_size)
+    else:
+        with tempfile.TemporaryDirectory() as directory:
+            create_video(f'{directory}/synthetic.avi')
+            benchmark(f'{directory}/synthetic.avi', args.block_size)
@@ -1,8 +1,18 @@
 import argparse
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 
+from GroundTruthStore import GroundTruthStore
+from base_functions import *
+
+logger = logging.getLogger(__file__)
+logger.setLevel(LOGGER_LEVEL)
+
 
 def convert_csv_netztransparenz(csv_file):
     csv_file_path = Path(csv_file)
@@ -16,9 +26,119 @@ def convert_csv_netztransparenz(csv_file):
     data.to_csv(new_filename)
 
 
+def hash_file(csv_file, block_size=1 << 20):
+    sha256 = hashlib.sha256()
+    with open(csv_file, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def _days_since_epoch(dates: np.ndarray) -> np.ndarray:
+    # only a few distinct dates per file: parse them once and map them back
+    unique_dates, inverse = np.unique(dates, return_inverse=True)
+    date_format = "%d.%m.%Y" if unique_dates[0][2:3] == '.' else "%Y-%m-%d"
+    days = pd.to_datetime(pd.Series(unique_dates), format=date_format) - pd.Timestamp(0)
+    return np.asarray(days // pd.Timedelta(days=1), dtype=np.int64)[inverse]
+
+
+def _seconds_of_day(times: np.ndarray) -> np.ndarray:
+    # HH:MM:SS parsed from the code points without pandas date parsing, other formats are parsed by pandas
+    times = np.asarray(times, dtype=str)
+    if times.size > 0 and np.all(np.char.str_len(times) == 8):
+        characters = times.astype('U8').view(np.uint32).reshape(-1, 8).astype(np.int64)
+        digits = characters[:, [0, 1, 3, 4, 6, 7]] - ord('0')
+        if np.all(characters[:, [2, 5]] == ord(':')) and np.all((digits >= 0) & (digits <= 9)):
+            return (digits[:, 0] * 10 + digits[:, 1]) * 3600 + (digits[:, 2] * 10 + digits[:, 3]) * 60 + \
+                digits[:, 4] * 10 + digits[:, 5]
+    # H:MM:SS or with fractions of seconds, malformed times raise instead of being misparsed
+    times = pd.Series(times)
+    malformed = ~times.str.fullmatch(r'\d{1,2}:\d{2}:\d{2}(\.\d+)?')
+    if malformed.any():
+        raise ValueError(f"malformed time: {times[malformed].iloc[0]}")
+    return np.asarray(pd.to_timedelta(times) // pd.Timedelta(seconds=1), dtype=np.int64)
+
+
+def read_csv_netztransparenz(csv_file, chunk_size=86400):
+    # epochs and frequencies per chunk of rows, a file is never held in memory as a whole
+    for chunk in pd.read_csv(csv_file, usecols=[0, 1, 4], dtype={'Datum': str, 'von': str}, sep=';', decimal=',',
+                             chunksize=chunk_size):
+        chunk = chunk.dropna()
+        if chunk.empty:
+            continue
+        dates = chunk['Datum'].to_numpy(dtype=str)
+        times = chunk['von'].to_numpy(dtype=str)
+        yield _days_since_epoch(dates) * 86400 + _seconds_of_day(times), chunk.iloc[:, 2].to_numpy(dtype=np.float64)
+
+
+def first_epoch(csv_file):
+    # epoch of the first sample of a file, None for files without samples
+    for epochs, _ in read_csv_netztransparenz(csv_file, chunk_size=16):
+        return int(epochs[0])
+    return None
+
+
+def parse_shard(csv_file, shard, nominal):
+    # worker: parses a file chunk by chunk into a shard, epochs (int64) and deltas from nominal (float32)
+    samples = 0
+    with open(f'{shard}.epochs', 'wb') as epochs_file, open(f'{shard}.deltas', 'wb') as deltas_file:
+        for epochs, frequencies in read_csv_netztransparenz(csv_file):
+            epochs.astype(np.int64).tofile(epochs_file)
+            (frequencies - nominal).astype(np.float32).tofile(deltas_file)
+            samples += epochs.size
+    return samples
+
+
+def append_shard(store: GroundTruthStore, shard, samples):
+    # main process: appends a shard in chunks and removes it
+    if samples > 0:
+        epochs = np.memmap(f'{shard}.epochs', dtype=np.int64, mode='r', shape=(samples,))
+        deltas = np.memmap(f'{shard}.deltas', dtype=np.float32, mode='r', shape=(samples,))
+        for start in range(0, samples, store.chunk_size):
+            end = min(start + store.chunk_size, samples)
+            store.add_epochs(np.asarray(epochs[start:end]), deltas[start:end].astype(np.float64) + store.get_nominal())
+        del epochs, deltas
+    for suffix in ('epochs', 'deltas'):
+        Path(f'{shard}.{suffix}').unlink()
+
+
+def ingest_netztransparenz(csv_files, store: GroundTruthStore, workers=None):
+    csv_files = list(csv_files)
+    with ProcessPoolExecutor(max_workers=workers) as executor, tempfile.TemporaryDirectory() as directory:
+        hashes = list(executor.map(hash_file, csv_files))
+        pending = [(csv_file, content_hash) for csv_file, content_hash in zip(csv_files, hashes)
+                   if not store.is_ingested(content_hash)]
+        logger.info(f'ingesting {len(pending)} of {len(csv_files)} files, '
+                    f'{len(csv_files) - len(pending)} already ingested')
+        # chronological order by the first sample, not by filename: the shards are appended without moving the store
+        first_epochs = list(executor.map(first_epoch, [csv_file for csv_file, _ in pending]))
+        pending = [item for _, item in sorted(zip(first_epochs, pending),
+                                              key=lambda item: -1 if item[0] is None else item[0])]
+        # the workers parse the files in parallel, the main process only appends the shards in order
+        shards = [f'{directory}/{i}' for i in range(len(pending))]
+        parsed = executor.map(parse_shard, [csv_file for csv_file, _ in pending], shards,
+                              [store.get_nominal()] * len(pending))
+        for (csv_file, content_hash), shard, samples in zip(pending, shards, parsed):
+            append_shard(store, shard, samples)
+            store.mark_ingested(content_hash, Path(csv_file).name)
+            logger.info(f'ingested {csv_file}: {samples} samples')
+    logger.info(f'ground truth store: {store.start_timestamp()} - {store.end_timestamp()}')
+
+
 if __name__ == "__main__":
     argparser = argparse.ArgumentParser()
-    argparser.add_argument("csv_file", help="csv file from netztransparenz.de")
+    argparser.add_argument("csv_file", help="csv file or directory with csv files from netztransparenz.de")
+    argparser.add_argument("-s", "--store", default=get_ground_truth_store_path(),
+                           help=f"ground truth store directory, default: {get_ground_truth_store_path()}")
+    argparser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                           help="number of worker processes, default: number of cores")
+    argparser.add_argument("-c", "--csv", action="store_true",
+                           help="convert a single file into a csv file instead of ingesting it into the store")
     args = argparser.parse_args()
 
-    convert_csv_netztransparenz(args.csv_file)
\ No newline at end of file
+    if args.csv:
+        convert_csv_netztransparenz(args.csv_file)
+    else:
+        csv_path = Path(args.csv_file)
+        files = list(csv_path.glob('*.csv')) if csv_path.is_dir() else [csv_path]
+        ingest_netztransparenz(files, GroundTruthStore(args.store), workers=args.workers)
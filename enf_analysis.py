@@ -1,12 +1,18 @@
 import argparse
 from sys import version_info
-import numpy as np
+from typing import Tuple
 from matplotlib import pyplot as plt
 
 from ENFAnalysisConfig import ENFAnalysisConfig
+from ENFCorrelator import ENFCorrelator
 from ENFSuperpixelAnalyzer import ENFSuperpixelAnalyzer
 from ENFSuperpixelVideoProcessor import ENFSuperpixelVideoProcessor
+from ENFTimestampSearch import ENFTimestampSearch
+from GroundTruthStore import GroundTruthStore
+from LumaCache import LumaCache
+from MotionDetectorGSOC import MOTION_DETECTION_METHODS
 from VideoGrabber import VideoGrabber
+from VideoIndex import VideoIndex
 from base_functions import *
 from persistence.Video import Video
 
@@ -29,8 +35,46 @@ def parse_arguments() -> ENFAnalysisConfig:
     argparser.add_argument("-bw", "--bandpass-width", type=float, default=.2, help="default: 0.2")
     argparser.add_argument("-nf", "--network-frequency", type=int, default=50, choices=[50, 60],
                            help="network frequency in Hz, default 50")
-    argparser.add_argument("-gt", "--ground-truth", help="csv file with enf ground truth")
+    argparser.add_argument("-gt", "--ground-truth",
+                           help="csv file or ground truth store directory with enf ground truth")
     argparser.add_argument("-dp", "--disable-plots", help="disable plots and images", action="store_true")
+    argparser.add_argument("-tk", "--top-k", type=int, default=5,
+                           help="number of timestamps reported by a search in a ground truth store, default: 5")
+    argparser.add_argument("-es", "--exact-search", action="store_true",
+                           help="exact search in a ground truth store with lower bound pruning instead of the coarse "
+                                "to fine search")
+    argparser.add_argument("-w", "--workers", type=int, default=os.cpu_count(),
+                           help="number of threads for the spectrograms of the superpixels, default: number of cores")
+    argparser.add_argument("-p", "--processes", type=int, default=1,
+                           help="number of processes, the video is split into segments processed in parallel, "
+                                "default: 1")
+    argparser.add_argument("-roi", "--region-of-interest", type=int, nargs=4, metavar=("X", "Y", "WIDTH", "HEIGHT"),
+                           help="process only this region of the frames")
+    argparser.add_argument("-ds", "--downscale", type=int, default=1,
+                           help="downscale factor of the frames (area average), default: 1")
+    argparser.add_argument("-mm", "--motion-method", choices=MOTION_DETECTION_METHODS, default='gsoc',
+                           help="motion detection method, default: gsoc")
+    argparser.add_argument("-ms", "--motion-scale", type=int, default=1,
+                           help="downscale factor of the frames for the motion detection, default: 1")
+    argparser.add_argument("-mst", "--motion-stride", type=int, default=1,
+                           help="motion detection only on every n-th frame, default: 1")
+    argparser.add_argument("-pl", "--pipeline", action="store_true",
+                           help="decoding, motion detection and aggregation in separate processes")
+    argparser.add_argument("-vi", "--video-index", action="store_true",
+                           help="create an index of the video (sidecar file) for the frame count, fps and seeking")
+    argparser.add_argument("-sds", "--segmentation-downscale", type=int, default=1,
+                           help="downscale factor of the first frame for the superpixel segmentation, default: 1")
+    argparser.add_argument("-sc", "--segmentation-cache", nargs='?', const=get_segmentation_cache_path(),
+                           help="reuse the superpixel segmentation of the first frame, cached in this directory, "
+                                "default: cache/segmentation")
+    argparser.add_argument("-lc", "--luma-cache", action="store_true",
+                           help="process the low resolution luma of the video, cached in a sidecar file")
+    argparser.add_argument("-ld", "--luma-decoding", action="store_true",
+                           help="decode the Y plane only without motion detection, faster, the means differ slightly")
+    argparser.add_argument("-cs", "--chunked-storage", action="store_true",
+                           help="write the means per superpixel during processing into a chunked store")
+    argparser.add_argument("-nb", "--narrow-band", action="store_true",
+                           help="estimate the enf only within the band-pass (zoom fft with interpolated peak)")
     argparser.add_argument("-ss", "--skip-seconds",
                            help="skips number of seconds for timestamp correlation, default: 4", type=int, default=4)
     args = argparser.parse_args()
@@ -47,8 +91,26 @@ def parse_arguments() -> ENFAnalysisConfig:
     config.ground_truth = args.ground_truth
     config.disable_plots = args.disable_plots
     config.skip_seconds = args.skip_seconds
-    if config.ground_truth is not None and not Path(config.ground_truth).is_file():
-        logger.error(f"couldn't access ground truth csv file: {config.ground_truth}")
+    config.top_k = args.top_k
+    config.exact_search = args.exact_search
+    config.workers = args.workers
+    config.narrow_band = args.narrow_band
+    config.processes = args.processes
+    config.video_index = args.video_index
+    config.pipeline = args.pipeline
+    config.roi = args.region_of_interest
+    config.scale = args.downscale
+    config.motion_scale = args.motion_scale
+    config.motion_stride = args.motion_stride
+    config.motion_method = args.motion_method
+    config.segmentation_cache = args.segmentation_cache
+    config.segmentation_scale = args.segmentation_downscale
+    config.luma_cache = args.luma_cache
+    config.luma = args.luma_decoding
+    config.chunked_storage = args.chunked_storage
+    if config.ground_truth is not None and not Path(config.ground_truth).is_file() and \
+            not GroundTruthStore(config.ground_truth).exists():
+        logger.error(f"couldn't access ground truth csv file or store: {config.ground_truth}")
         exit()
     return config
 
@@ -56,15 +118,27 @@ def parse_arguments() -> ENFAnalysisConfig:
 def process_video(video_file: str, config: ENFAnalysisConfig):
     video_processor = ENFSuperpixelVideoProcessor(motion_detection=config.motion_detection, data_dir='.',
                                                   show_final_image=not config.disable_plots,
-                                                  lightness_threshold=config.lightness_threshold, save_img=False)
+                                                  lightness_threshold=config.lightness_threshold, save_img=False,
+                                                  processes=config.processes, pipeline=config.pipeline,
+                                                  roi=config.roi, scale=config.scale, motion_scale=config.motion_scale,
+                                                  motion_stride=config.motion_stride,
+                                                  motion_method=config.motion_method,
+                                                  segmentation_cache_dir=config.segmentation_cache,
+                                                  segmentation_scale=config.segmentation_scale,
+                                                  luma_cache=config.luma_cache, luma=config.luma,
+                                                  chunked_storage=config.chunked_storage)
     video = Video()
     config.video = video
     video.filename = Path(video_file).name
     video.motion = config.motion_detection
+    if config.video_index and not VideoIndex(video_file).exists():
+        VideoIndex(video_file).create()
+    if config.luma_cache and not LumaCache(video_file).exists():
+        LumaCache(video_file).create()
     vg = VideoGrabber(videofile=video_file, start_frame_nr=0, end_frame=1, video=video, silent=True)
     vg.first_frame(callback=lambda nr, frame: None)
-    if config.use_video_data_cache and Path(video_processor.get_mean_data_filename(Path(video_file).name)).is_file():
-        mean_per_superpixel = np.load(video_processor.get_mean_data_filename(video.filename))
+    if config.use_video_data_cache and video_processor.has_mean_data(video.filename):
+        mean_per_superpixel = video_processor.load_mean_data(video.filename)
     else:
         mean_per_superpixel = video_processor.process_video(video_file)
     video.expected_enf_frequency = calc_alias(config.network_frequency, video.fps_real)
@@ -75,6 +149,33 @@ def process_video(video_file: str, config: ENFAnalysisConfig):
     return mean_per_superpixel
 
 
+def load_ground_truth(config: ENFAnalysisConfig, extracted_enf,
+                      enf_analyzer: ENFSuperpixelAnalyzer) -> Tuple[pd.Series, ENFCorrelator]:
+    if Path(config.ground_truth).is_dir():
+        store = GroundTruthStore(config.ground_truth)
+        video_timestamp = config.video.get_video_timestamp()
+        if video_timestamp is not None and store.contains(video_timestamp):
+            # the recording, padded by its duration on both sides, also across midnight
+            duration = int(config.video.duration) // store.get_stride() + 1
+            start, end = store.recording_range(video_timestamp, duration, offset=duration)
+        else:
+            # unknown recording date: search in the whole store
+            logger.info(f'searching timestamp from {store.start_timestamp()} to {store.end_timestamp()}')
+            if config.exact_search:
+                matches = enf_analyzer.correlate_top_k(extracted_enf, store, top_k=config.top_k)
+            else:
+                matches = ENFTimestampSearch(store).search(extracted_enf, top_k=config.top_k)
+            for match in matches:
+                logger.info(f'candidate: {match}')
+            if matches:
+                start, end = store.recording_range(matches[0].timestamp, extracted_enf.size)
+            else:
+                start, end = 0, store.size()
+        return store.series(start, end), store.correlator(start, end)
+    ground_truth = read_csv(config.ground_truth)
+    return ground_truth, ENFCorrelator(ground_truth.to_numpy())
+
+
 def process_enf_analysis(mean_per_superpixel, config: ENFAnalysisConfig):
     if config.video.duration < 420:
         logger.warning(f'Video duration is < 420 s. Matched timestamp might be wrong.')
@@ -83,7 +184,8 @@ def process_enf_analysis(mean_per_superpixel, config: ENFAnalysisConfig):
                                          show_plots=not config.disable_plots, bandpass_order=config.bandpass_order,
                                          bandpass_width=config.bandpass_width, destination='.',
                                          samples_stft=config.samples_representative_enf, save_data=False,
-                                         samples_stft_me=config.samples_max_energy)
+                                         samples_stft_me=config.samples_max_energy, workers=config.workers,
+                                         narrow_band=config.narrow_band)
     enf_metric, representative_enf = enf_analyzer.detect_enf(mean_per_superpixel)
     max_energy_enf, weighted_energy_enf = enf_analyzer.extract_enf(mean_per_superpixel)
     logger.info(f'ENF metrics: {enf_metric}')
@@ -91,13 +193,12 @@ def process_enf_analysis(mean_per_superpixel, config: ENFAnalysisConfig):
         logger.warning(f'ENF metric: median is < 0.6, there are probably no ENF traces.')
 
     if config.ground_truth is not None:
-        ground_truth = read_csv(config.ground_truth)
-        logger.info("correlate representative ENF")
-        enf_result_representative_enf = enf_analyzer.correlate(representative_enf[config.skip_seconds:], ground_truth,
-                                                               "representative ENF")
-        logger.info("correlate max. energy ENF")
-        enf_result_max_energy = enf_analyzer.correlate(max_energy_enf[config.skip_seconds:], ground_truth,
-                                                       "max. energy")
+        ground_truth, correlator = load_ground_truth(config, representative_enf[config.skip_seconds:], enf_analyzer)
+        logger.info("correlate representative ENF and max. energy ENF")
+        # both enf share the spectra of the ground truth
+        enf_result_representative_enf, enf_result_max_energy = enf_analyzer.correlate_many(
+            [representative_enf[config.skip_seconds:], max_energy_enf[config.skip_seconds:]], ground_truth,
+            ["representative ENF", "max. energy"], correlator=correlator)
 
         logger.info(f'representative ENF: {enf_result_representative_enf}')
         logger.info(f'max. energy ENF: {enf_result_max_energy}')
@@ -1,6 +1,7 @@
 from pathlib import Path
 from persistence.Persistence import Persistence
 from VideoGrabber import VideoGrabber
+from VideoIndex import VideoIndex
 from persistence.Video import VideoPersistence
 from base_functions import *
 
@@ -13,6 +14,10 @@ def get_video_stats(frame_nr, frame):
 
 
 def add_video(videopath: Path, network_frequency, video_contains_motion, hint):
+    # measured frame count and fps instead of the container metadata, later processing seeks with the index
+    index = VideoIndex(str(videopath))
+    if not index.exists():
+        index.create()
     vg = VideoGrabber(videofile=str(videopath), end_frame=1)
     vg.first_frame(get_video_stats)
 
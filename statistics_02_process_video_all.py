@@ -0,0 +1,87 @@
+from ENFMeanVideoProcessor import ENFMeanVideoProcessor
+from ENFSuperpixelVideoProcessor import ENFSuperpixelVideoProcessor
+from VideoFanOutProcessor import VideoFanOutProcessor
+from persistence.Persistence import Persistence
+from base_functions import *
+from persistence.DatasetVideoMean import DatasetVideoMeanPersistence, DatasetVideoMean
+from persistence.DatasetVideoSuperpixel import DatasetVideoSuperpixelPersistence, DatasetVideoSuperpixel
+from persistence.Video import VideoPersistence
+
+
+def process(video_id, lightness_threshold, motion_detection, motion_threshold, hint, mean=True, superpixel=True,
+            dry_run=False, store_all_superpixels=False):
+    # ds_video_mean and ds_video_sp of a video from a single decoding (VideoFanOutProcessor)
+    persistence = Persistence()
+    logger.info(f"processing video_id: {video_id}, mean: {mean}, superpixel: {superpixel}, "
+                f"motion_detection: {motion_detection}")
+    try:
+        vp = VideoPersistence(persistence.get_connection(), dry_run=dry_run)
+        dvmp = DatasetVideoMeanPersistence(persistence.get_connection(), dry_run=dry_run)
+        dvsp = DatasetVideoSuperpixelPersistence(persistence.get_connection(), dry_run=dry_run)
+
+        video = vp.find_video_by_id(video_id)
+        video_path = f'{get_input_path()}/{video.filename}'
+        fan_out = VideoFanOutProcessor()
+        dvs = None
+        if mean:
+            dvm: DatasetVideoMean = dvmp.create_entry(video)
+            dvm.lightness_threshold = lightness_threshold
+            dvm.hint = hint
+            dvmp.save(dvm)
+            logger.info(f"created DatasetVideoMean: {dvm.id}")
+            fan_out.register(ENFMeanVideoProcessor(dvm.video.filename, lightness_threshold=lightness_threshold,
+                                                   data_dir=get_destination_path(dvm.id, DESTINATION_MEAN)))
+        if superpixel:
+            dvs: DatasetVideoSuperpixel = dvsp.create_entry(video)
+            dvs.lightness_threshold = lightness_threshold
+            dvs.hint = hint
+            if motion_detection:
+                dvs.motion_threshold = motion_threshold
+            dvsp.save(dvs)
+            logger.info(f"created DatasetVideoSuperpixel: {dvs.id}")
+            destination = get_destination_path(dvs.id, DESTINATION_SUPERPIXEL)
+            if not dry_run:
+                create_directories(destination)
+            fan_out.register(ENFSuperpixelVideoProcessor(lightness_threshold=dvs.lightness_threshold,
+                                                         motion_threshold_factor=dvs.motion_threshold,
+                                                         data_dir=destination, motion_detection=motion_detection,
+                                                         dataset_video=dvs, dry_run=dry_run,
+                                                         segmentation_cache_dir=get_segmentation_cache_path(),
+                                                         store_all_superpixels=store_all_superpixels))
+        fan_out.process_video(video_path)
+        if dvs is not None:
+            dvsp.save(dvs)
+        logger.info(f"processed video_id: {video_id}")
+    except Exception as ex:
+        logger.warning(f'Exception: {ex}')
+    finally:
+        persistence.close()
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger(__file__)
+    logger.setLevel(LOGGER_LEVEL)
+
+    dry_run = False
+
+    lightness_threshold = 120
+    motion_threshold = .2
+    # all superpixel with motion traces in a chunked store, thresholds via statistics_02_threshold_video_superpixel
+    store_all_superpixels = False
+    hint = ""  # "wo detection"
+    # unprocessed videos of the mean and of the superpixel, each video is decoded once
+    persistence = Persistence(dry_run=dry_run)
+    vp = VideoPersistence(persistence.get_connection())
+    mean_videos = vp.find_unprocessed_mean_videos()
+    sp_videos = vp.find_unprocessed_sp_videos()
+    mean_video_ids = {video.id for video in mean_videos}
+    sp_video_ids = {video.id for video in sp_videos}
+    videos = {video.id: video for video in mean_videos + sp_videos}
+    persistence.close()
+    logger.info(f'processing videos with ids: {sorted(videos)}')
+    for video_id in sorted(videos):
+        process(video_id, lightness_threshold, videos[video_id].motion, motion_threshold, hint,
+                mean=video_id in mean_video_ids, superpixel=video_id in sp_video_ids, dry_run=dry_run,
+                store_all_superpixels=store_all_superpixels)
+
+    logger.info("processed all videos")
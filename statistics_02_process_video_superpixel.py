@@ -5,7 +5,8 @@ from persistence.DatasetVideoSuperpixel import DatasetVideoSuperpixelPersistence
 from persistence.Video import VideoPersistence
 
 
-def process(video_id, lightness_threshold, motion_detection, motion_threshold, hint, dry_run=False):
+def process(video_id, lightness_threshold, motion_detection, motion_threshold, hint, dry_run=False,
+            store_all_superpixels=False):
     persistence = Persistence()
     logger.info(f"processing video_id: {video_id}, motion_detection: {motion_detection}")
     try:
@@ -29,7 +30,9 @@ def process(video_id, lightness_threshold, motion_detection, motion_threshold, h
                                                 lightness_threshold=dvs.lightness_threshold,
                                                 motion_threshold_factor=dvs.motion_threshold,
                                                 data_dir=destination, motion_detection=motion_detection,
-                                                dataset_video=dvs, dry_run=dry_run)
+                                                dataset_video=dvs, dry_run=dry_run,
+                                                segmentation_cache_dir=get_segmentation_cache_path(),
+                                                store_all_superpixels=store_all_superpixels)
         enf_sp_vp.process_video(video_path)
         dvsp.save(dvs)
         logger.info(f"processed video_id: {video_id}")
@@ -48,6 +51,8 @@ if __name__ == "__main__":
 
     lightness_threshold = 120
     motion_threshold = .2
+    # all superpixel with motion traces in a chunked store, thresholds via statistics_02_threshold_video_superpixel
+    store_all_superpixels = False
     hint = ""  # "wo detection"
     video_ids = []  # if empty, unprocessed videos will be processed
     if not video_ids:
@@ -58,11 +63,13 @@ if __name__ == "__main__":
         logger.info(f'processing videos with ids: {list(map(lambda vid: vid.id, videos))}')
         for video in videos:
             motion_detection = video.motion
-            process(video.id, lightness_threshold, motion_detection, motion_threshold, hint, dry_run=dry_run)
+            process(video.id, lightness_threshold, motion_detection, motion_threshold, hint, dry_run=dry_run,
+                    store_all_superpixels=store_all_superpixels)
     else:
         logger.info(f'processing videos with ids: {video_ids}')
         motion_detection = True
         for video_id in video_ids:
-            process(video_id, lightness_threshold, motion_detection, motion_threshold, hint, dry_run=dry_run)
+            process(video_id, lightness_threshold, motion_detection, motion_threshold, hint, dry_run=dry_run,
+                    store_all_superpixels=store_all_superpixels)
 
     logger.info("processed all videos")
@@ -0,0 +1,61 @@
+from SuperpixelIntensityStore import SuperpixelIntensityStore
+from persistence.Persistence import Persistence
+from base_functions import *
+from persistence.DatasetVideoSuperpixel import DatasetVideoSuperpixelPersistence, DatasetVideoSuperpixel
+
+
+def process(ds_video_sp_id, lightness_threshold, motion_threshold, hint, dry_run=False):
+    # new ds_video_sp from a dataset processed with all superpixel (store_all_superpixels), without decoding the video
+    persistence = Persistence()
+    logger.info(f"thresholding ds_video_sp_id: {ds_video_sp_id}, lightness_threshold: {lightness_threshold}, "
+                f"motion_threshold: {motion_threshold}")
+    try:
+        dvsp = DatasetVideoSuperpixelPersistence(persistence.get_connection(), dry_run=dry_run)
+        source: DatasetVideoSuperpixel = dvsp.find_video_superpixel_by_id(ds_video_sp_id)
+        filename = source.video.filename
+        store = SuperpixelIntensityStore(f'{get_destination_path(source.id, DESTINATION_SUPERPIXEL)}/'
+                                         f'{filename}_mean_per_spx')
+        if not store.has_statistics():
+            logger.warning(f"ds_video_sp_id {ds_video_sp_id} wasn't processed with all superpixel")
+            return
+        motion_threshold = motion_threshold if source.video.motion else None
+        if motion_threshold is not None and not store.has_motion_trace():
+            # e.g. motion method variance: the motion isn't traced per superpixel during decoding
+            logger.warning(f"ds_video_sp_id {ds_video_sp_id} has no motion trace, motion threshold "
+                           f"{motion_threshold} can't be applied")
+            return
+        # the median of the first frame if lightness_threshold is None or above the brightest pixel
+        lightness_threshold = store.lightness_threshold(lightness_threshold)
+        labels = store.threshold_labels(lightness_threshold=lightness_threshold,
+                                        motion_threshold_factor=motion_threshold)
+        dvs: DatasetVideoSuperpixel = dvsp.create_entry(source.video)
+        logger.info(f"created DatasetVideoSuperpixel: {dvs.id}, {labels.size} superpixel")
+        dvs.superpixel = source.superpixel
+        dvs.region_size = source.region_size
+        dvs.lightness_threshold = lightness_threshold
+        dvs.motion_threshold = motion_threshold
+        dvs.hint = f"{hint}, thresholds of {source.id}" if hint else f"thresholds of {source.id}"
+        if not dry_run:
+            store.export(f'{get_destination_path(dvs.id, DESTINATION_SUPERPIXEL)}/{filename}_mean_per_spx', labels,
+                         labels)
+        dvsp.save(dvs)
+    except Exception as ex:
+        logger.warning(f'Exception: {ex}')
+    finally:
+        persistence.close()
+
+
+if __name__ == "__main__":
+    logger = logging.getLogger(__file__)
+    logger.setLevel(LOGGER_LEVEL)
+
+    dry_run = False
+
+    ds_video_sp_ids = []
+    hint = ""
+    for lightness_threshold in [80, 120, 160]:
+        for motion_threshold in [.1, .2, .3]:
+            for ds_video_sp_id in ds_video_sp_ids:
+                process(ds_video_sp_id, lightness_threshold, motion_threshold, hint, dry_run=dry_run)
+
+    logger.info("thresholded all datasets")
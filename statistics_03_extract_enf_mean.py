@@ -3,6 +3,7 @@ import numpy as np
 from ENFMeanAnalyzer import ENFMeanAnalyzer
 from persistence.Persistence import Persistence
 from base_functions import *
+from GroundTruthStore import ground_truth_available, load_ground_truth
 from persistence.DatasetEnfMean import DatasetEnfMeanPersistence, init_DatasetEnfMean_without_ids
 from persistence.DatasetVideoMean import DatasetVideoMeanPersistence
 
@@ -20,7 +21,8 @@ def load_mean_per_frame(filename, start=None, end=None):
 
 
 def process(ds_video_mean_id, csv_file=None, show_plots=False, dry_run=False, skip_seconds=0,
-            correlate_only_recording_time=False, comment="", nfft=8192, samples=256):
+            correlate_only_recording_time=False, comment="", nfft=8192, samples=256, ground_truth_cache=None):
+    # ground_truth_cache: ground truth and correlator per csv file (and recording time) shared by several calls
     logger.info(f'processing ds_video_mean_id: {ds_video_mean_id}')
     persistence = Persistence(dry_run=dry_run)
     dvmp = DatasetVideoMeanPersistence(persistence.get_connection(), dry_run=dry_run)
@@ -28,7 +30,7 @@ def process(ds_video_mean_id, csv_file=None, show_plots=False, dry_run=False, sk
     if csv_file is None:
         csv_file = f"{dvm.video.filename[1:11]}.csv"
 
-    if Path(f'{get_enf_truth_path()}/{csv_file}').is_file():
+    if ground_truth_available(csv_file):
         demp = DatasetEnfMeanPersistence(persistence.get_connection(), dry_run=dry_run)
         dem = demp.create_entry(dvm)
         dem.csv = csv_file
@@ -48,11 +50,16 @@ def process(ds_video_mean_id, csv_file=None, show_plots=False, dry_run=False, sk
         demp.save(dem)
         enf_max_freq, enf_weighted = ea.extract_enf_mean_per_frame(mean_per_frame)
 
-        enf_truth = read_csv(f'{get_enf_truth_path()}/{dem.csv}')
-
-        if correlate_only_recording_time:
-            enf_truth = slice_csv_data(enf_truth, dvm.video.get_video_timestamp(), enf_max_freq.size)
-        enf_result = ea.correlate(enf_max_freq[skip_seconds:], enf_truth, "max frequency")
+        ground_truth_key = (dem.csv, dvm.video.get_video_timestamp(), enf_max_freq.size) \
+            if correlate_only_recording_time else (dem.csv,)
+        ground_truth_cache = {} if ground_truth_cache is None else ground_truth_cache
+        if ground_truth_key not in ground_truth_cache:
+            ground_truth_cache[ground_truth_key] = load_ground_truth(*ground_truth_key)
+        enf_truth, correlator = ground_truth_cache[ground_truth_key]
+        # both enf variants are correlated in one pass over the ground truth
+        correlated = ea.correlation_curves([enf_max_freq[skip_seconds:], enf_weighted[skip_seconds:]], enf_truth,
+                                           correlator)
+        enf_result = ea.correlate(enf_max_freq[skip_seconds:], enf_truth, "max frequency", correlated=correlated[0])
         # enf_result = ea.correlate(enf, data['wien'])
         logger.info(enf_result)
         if show_plots:
@@ -74,7 +81,7 @@ def process(ds_video_mean_id, csv_file=None, show_plots=False, dry_run=False, sk
         ds_enf_weighted = demp.create_entry(dvm)
         init_DatasetEnfMean_without_ids(dem, ds_enf_weighted)
         ea.set_filename_prefix(ds_enf_weighted.id)
-        enf_result = ea.correlate(enf_weighted[skip_seconds:], enf_truth, "weighted")
+        enf_result = ea.correlate(enf_weighted[skip_seconds:], enf_truth, "weighted", correlated=correlated[1])
         logger.info(f'weighted: {enf_result}')
 
         matched_timestamp = convert_panda_timestamp_to_timestamp(enf_result.get_timestamp())
@@ -104,8 +111,10 @@ if __name__ == "__main__":
     samples_list = [256, 512, 1024]  # which sample sizes should be used
 
     ds_video_mean_ids = [1]  # ds_video_mean.id
+    ground_truth_cache = {}  # videos of the same day share the ground truth
     for samples in samples_list:
         comment = f"{samples}"
         for video_mean_id in ds_video_mean_ids:
             process(video_mean_id, csv_file, show_plots, dry_run, skip_seconds=skip_seconds, samples=samples,
-                    correlate_only_recording_time=correlate_only_recording_time, comment=comment)
+                    correlate_only_recording_time=correlate_only_recording_time, comment=comment,
+                    ground_truth_cache=ground_truth_cache)
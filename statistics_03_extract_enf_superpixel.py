@@ -3,6 +3,8 @@ import numpy as np
 from ENFSuperpixelAnalyzer import ENFSuperpixelAnalyzer
 from persistence.Persistence import Persistence
 from base_functions import *
+from GroundTruthStore import ground_truth_available, load_ground_truth
+from SuperpixelIntensityStore import SuperpixelIntensityStore
 from persistence.DatasetEnfSuperpixel import DatasetEnfSuperpixel, DatasetEnfSuperpixelPersistence, \
     init_DatasetEnfSuperpixel_without_ids
 from persistence.DatasetVideoSuperpixel import DatasetVideoSuperpixelPersistence, DatasetVideoSuperpixel
@@ -12,16 +14,17 @@ logger.setLevel(LOGGER_LEVEL)
 
 
 def load_mean_per_spx(filename, start=None, end=None):
-    data = np.load(filename)
-    if end is not None and end < data.shape[1]:
-        data = data[:, :end]
-    if start is not None and start < data.shape[1]:
-        data = data[:, start:]
-    return data
+    # chunked SuperpixelIntensityStore or a single npy file, only the frames start:end are read
+    store = SuperpixelIntensityStore(filename)
+    if store.exists():
+        return store.read(start, end)
+    data = np.load(f'{filename}.npy', mmap_mode='r')
+    return np.asarray(data[:, start:end])
 
 
 def process(ds_video_sp_id, csv_file=None, show_plots=False, dry_run=False, skip_seconds=0,
-            correlate_only_recording_time=False, nfft=8192, samples=256, comment=""):
+            correlate_only_recording_time=False, nfft=8192, samples=256, comment="", ground_truth_cache=None):
+    # ground_truth_cache: ground truth and correlator per csv file (and recording time) shared by several calls
     logger = logging.getLogger(__file__)
     logger.setLevel(logging.DEBUG)
     logger.info(f'processing ds_video_sp_id: {ds_video_sp_id}, samples: {samples}')
@@ -31,7 +34,7 @@ def process(ds_video_sp_id, csv_file=None, show_plots=False, dry_run=False, skip
     if csv_file is None:
         csv_file = f"{dvsp.video.filename[1:11]}.csv"
 
-    if Path(f'{get_enf_truth_path()}/{csv_file}').is_file():
+    if ground_truth_available(csv_file):
         desp = DatasetEnfSuperpixelPersistence(persistence.get_connection(), dry_run=dry_run)
         des = desp.create_entry(dvsp)
         des.csv = csv_file
@@ -40,7 +43,7 @@ def process(ds_video_sp_id, csv_file=None, show_plots=False, dry_run=False, skip
 
         filename = dvsp.video.filename
         destination = get_destination_path(dvsp.id, DESTINATION_SUPERPIXEL)
-        file_to_process = f'{destination}/{filename}_mean_per_spx.npy'
+        file_to_process = f'{destination}/{filename}_mean_per_spx'
 
         mean_per_superpixel = load_mean_per_spx(file_to_process)
         if mean_per_superpixel.shape[0] == 0:
@@ -62,9 +65,12 @@ def process(ds_video_sp_id, csv_file=None, show_plots=False, dry_run=False, skip
             enf_max_freq, enf_weighted = ea.extract_enf(mean_per_superpixel)
             desp.save(des)
 
-            enf_truth = read_csv(f'{get_enf_truth_path()}/{des.csv}')
-            if correlate_only_recording_time:
-                enf_truth = slice_csv_data(enf_truth, dvsp.video.get_video_timestamp(), representative_enf.size)
+            ground_truth_key = (des.csv, dvsp.video.get_video_timestamp(), representative_enf.size) \
+                if correlate_only_recording_time else (des.csv,)
+            ground_truth_cache = {} if ground_truth_cache is None else ground_truth_cache
+            if ground_truth_key not in ground_truth_cache:
+                ground_truth_cache[ground_truth_key] = load_ground_truth(*ground_truth_key)
+            enf_truth, correlator = ground_truth_cache[ground_truth_key]
 
             if show_plots:
                 plt.figure()
@@ -73,7 +79,12 @@ def process(ds_video_sp_id, csv_file=None, show_plots=False, dry_run=False, skip
                 plt.legend()
                 plt.show()
 
-            enf_result = ea.correlate(representative_enf[skip_seconds:], enf_truth, "representative")
+            # all enf variants are correlated in one pass over the ground truth
+            correlated = ea.correlation_curves(
+                [representative_enf[skip_seconds:], enf_weighted[skip_seconds:], enf_max_freq[skip_seconds:]],
+                enf_truth, correlator)
+            enf_result = ea.correlate(representative_enf[skip_seconds:], enf_truth, "representative",
+                                      correlated=correlated[0])
             logger.info(enf_result)
             if show_plots:
                 enf_result.show_plot(margin_in_sec=10, title="representative")
@@ -94,7 +105,7 @@ def process(ds_video_sp_id, csv_file=None, show_plots=False, dry_run=False, skip
             ds_enf_weighted = desp.create_entry(dvsp)
             init_DatasetEnfSuperpixel_without_ids(des, ds_enf_weighted)
             ea.set_filename_prefix(ds_enf_weighted.id)
-            enf_result = ea.correlate(enf_weighted[skip_seconds:], enf_truth, "weighted")
+            enf_result = ea.correlate(enf_weighted[skip_seconds:], enf_truth, "weighted", correlated=correlated[1])
             logger.info(f'weighted: {enf_result}')
 
             matched_timestamp = convert_panda_timestamp_to_timestamp(enf_result.get_timestamp())
@@ -112,7 +123,7 @@ def process(ds_video_sp_id, csv_file=None, show_plots=False, dry_run=False, skip
             ds_enf_max_amplitude = desp.create_entry(dvsp)
             init_DatasetEnfSuperpixel_without_ids(des, ds_enf_max_amplitude)
             ea.set_filename_prefix(ds_enf_max_amplitude.id)
-            enf_result = ea.correlate(enf_max_freq[skip_seconds:], enf_truth, "max amplitude")
+            enf_result = ea.correlate(enf_max_freq[skip_seconds:], enf_truth, "max amplitude", correlated=correlated[2])
             logger.info(f'max amplitude: {enf_result}')
 
             matched_timestamp = convert_panda_timestamp_to_timestamp(enf_result.get_timestamp())
@@ -139,9 +150,11 @@ if __name__ == "__main__":
     csv_file = None  # None = date from filename # "2022-08-19.csv"
     ds_video_sp_ids = [1]
     samples_list = [256, 512, 1024]
+    ground_truth_cache = {}  # videos of the same day share the ground truth
     for video_sp_id in ds_video_sp_ids:
         for samples in samples_list:
             comment = f"{samples}"
 
             process(video_sp_id, csv_file, show_plots, dry_run, skip_seconds=skip_seconds, samples=samples,
-                    correlate_only_recording_time=correlate_only_recording_time, comment=comment)
+                    correlate_only_recording_time=correlate_only_recording_time, comment=comment,
+                    ground_truth_cache=ground_truth_cache)